@@ -0,0 +1,79 @@
+# Локальный бенчмарк движка рассылок (broadcast.py) без обращения к Telegram.
+#
+# Запуск из корня репозитория:
+#     python benchmarks/broadcast_bench.py --users 20000 --latency 0.05 --workers 16
+#
+# FakeBot имитирует задержку ответа Telegram и, при необходимости, ответы RetryAfter.
+# С --rate 0 лимитер не ограничивает общую скорость, и измеряется пропускная способность самого движка.
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.error import RetryAfter
+
+import broadcast
+import storage
+
+
+class FakeBot:
+    def __init__(self, latency, retry_after_ratio):
+        self.latency = latency
+        self.retry_after_ratio = retry_after_ratio
+        self.sent = 0
+        self.retry_after_count = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        if self.retry_after_ratio and random.random() < self.retry_after_ratio:
+            self.retry_after_count += 1
+            raise RetryAfter(1)
+        self.sent += 1
+
+
+def seed_users(count):
+    conn = storage.get_connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, username, first_name, created_at) VALUES (?, ?, ?, '')",
+            ((user_id, f"user{user_id}", 'Bench') for user_id in range(1, count + 1))
+        )
+
+
+async def run(args):
+    bot = FakeBot(args.latency, args.retry_after_ratio)
+    limiter = broadcast.RateLimiter(global_rate=args.rate, per_chat_interval=broadcast.PER_CHAT_INTERVAL)
+    broadcast_id = storage.create_broadcast('Бенчмарк рассылки', None)
+    started = time.perf_counter()
+    row = await broadcast.run_broadcast(bot, broadcast_id, limiter=limiter, workers=args.workers)
+    elapsed = time.perf_counter() - started
+    print(f"пользователей:       {args.users}")
+    print(f"воркеров:            {args.workers}")
+    print(f"доставлено:          {row['sent']}, ошибок: {row['failed']}, RetryAfter: {bot.retry_after_count}")
+    print(f"время:               {elapsed:.2f} с")
+    print(f"сообщений в секунду: {row['sent'] / elapsed:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк движка рассылок с фейковым ботом')
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=broadcast.WORKERS)
+    parser.add_argument('--latency', type=float, default=0.05, help='задержка ответа Telegram, секунд')
+    parser.add_argument('--rate', type=float, default=0, help='общий лимит сообщений в секунду (0 — без лимита)')
+    parser.add_argument('--retry-after-ratio', type=float, default=0.0, help='доля ответов RetryAfter')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        storage.init(data_dir)
+        seed_users(args.users)
+        asyncio.run(run(args))
+        storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# Нагрузочный тест параллельной обработки обновлений.
+#
+# Для каждого виртуального пользователя проигрывается полный диалог оформления заказа
+# (/start → тип работы → тема → дата → пропуск руководителя и базы практики → план → подтверждение).
+# Обновления всех пользователей перемешиваются и подаются в очередь приложения сразу, не дожидаясь
+# ответов бота, поэтому корректное завершение всех диалогов подтверждает, что порядок обновлений
+# каждого пользователя сохраняется. Тест запускается для нескольких значений UPDATE_CONCURRENCY.
+#
+# Запуск из корня репозитория:
+#     python benchmarks/conversation_load.py --users 1000 --api-latency 0.02 --concurrency 1 32 128
+import argparse
+import asyncio
+import logging
+import random
+import time
+from datetime import date, timedelta
+
+from fake_telegram import FakeRequest, callback_update, message_update, prepare_environment
+
+
+def conversation(user_id, deadline):
+    return [
+        ('message', '/start'),
+        ('callback', 'make_order'),
+        ('callback', 'course_theory'),
+        ('message', f"Тема работы пользователя {user_id}"),
+        ('callback', f"cbcal_0_s_d_{deadline.year}_{deadline.month}_{deadline.day}"),
+        ('callback', 'skip_supervisor'),
+        ('callback', 'skip_practice_base'),
+        ('callback', 'write_plan'),
+        ('message', 'Введение; Глава 1; Глава 2; Заключение'),
+        ('callback', 'confirm_order'),
+    ]
+
+
+# Перемешивание обновлений разных пользователей с сохранением порядка внутри диалога
+def interleave(users, deadline, seed):
+    rng = random.Random(seed)
+    pending = {user_id: conversation(user_id, deadline) for user_id in users}
+    positions = {user_id: 0 for user_id in users}
+    order = []
+    active = list(users)
+    while active:
+        user_id = rng.choice(active)
+        order.append((user_id, pending[user_id][positions[user_id]]))
+        positions[user_id] += 1
+        if positions[user_id] == len(pending[user_id]):
+            active.remove(user_id)
+    return order
+
+
+async def run_once(bot, storage, args, concurrency, first_user_id):
+    from telegram import Update
+
+    bot.UPDATE_CONCURRENCY = concurrency
+    application = bot.build_application(request=FakeRequest(latency=args.api_latency))
+    await application.initialize()
+    await application.start()
+
+    users = list(range(first_user_id, first_user_id + args.users))
+    deadline = date.today() + timedelta(days=20)
+    replay = interleave(users, deadline, args.seed)
+    orders_before = storage.count_orders()
+
+    started = time.perf_counter()
+    for update_id, (user_id, (kind, payload)) in enumerate(replay, start=1):
+        if kind == 'message':
+            data = message_update(update_id, user_id, payload)
+        else:
+            data = callback_update(update_id, user_id, payload)
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    # Ожидание, пока очередь опустеет и все обновления будут обработаны
+    idle_checks = 0
+    while idle_checks < 2:
+        await asyncio.sleep(0.02)
+        busy = not application.update_queue.empty() or application.update_processor.active_updates
+        idle_checks = 0 if busy else idle_checks + 1
+    elapsed = time.perf_counter() - started
+
+    await application.stop()
+    await application.shutdown()
+
+    confirmed = storage.count_orders() - orders_before
+    print(f"UPDATE_CONCURRENCY={concurrency:<4} обновлений: {len(replay)}, время: {elapsed:.2f} с, "
+          f"обновлений в секунду: {len(replay) / elapsed:.1f}, "
+          f"подтверждено заказов: {confirmed} из {args.users}")
+    return elapsed
+
+
+async def run(args):
+    prepare_environment()
+    import bot
+    import storage
+    logging.getLogger().setLevel(logging.WARNING)
+
+    results = []
+    for index, concurrency in enumerate(args.concurrency):
+        first_user_id = 10000 + index * args.users
+        results.append((concurrency, await run_once(bot, storage, args, concurrency, first_user_id)))
+
+    baseline_concurrency, baseline = results[0]
+    for concurrency, elapsed in results[1:]:
+        print(f"ускорение {concurrency} относительно {baseline_concurrency}: {baseline / elapsed:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест параллельной обработки диалогов')
+    parser.add_argument('--users', type=int, default=1000, help='виртуальных пользователей')
+    parser.add_argument('--api-latency', type=float, default=0.02, help='задержка ответа Bot API, секунд')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 32], help='значения UPDATE_CONCURRENCY')
+    parser.add_argument('--seed', type=int, default=1)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# Имитация Telegram Bot API для бенчмарков: HTTP-слой бота подменяется FakeRequest,
+# поэтому приложение из bot.py работает полностью локально, без сети.
+#
+# Перед импортом bot.py вызовите prepare_environment(): он задаёт токен, ID администратора,
+# временную папку для данных и файл цен в ней, чтобы бенчмарк не трогал рабочие файлы.
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.request import BaseRequest
+
+BOT_ID = 123456
+BOT_USERNAME = 'gipsr_bench_bot'
+ADMIN_ID = 1
+
+
+def prepare_environment(**extra):
+    base_dir = tempfile.mkdtemp(prefix='gipsr_bench_')
+    os.environ['TELEGRAM_BOT_TOKEN'] = f"{BOT_ID}:bench-token"
+    os.environ['ADMIN_CHAT_ID'] = str(ADMIN_ID)
+    os.environ['BASE_DIR'] = base_dir
+    os.environ['PRICES_FILE'] = os.path.join(base_dir, 'data', 'prices.json')
+    for key, value in extra.items():
+        os.environ[key] = str(value)
+    return base_dir
+
+
+# HTTP-слой, отвечающий на методы Bot API заранее заготовленными ответами.
+# latency — задержка ответа, on_call — функция (method, parameters), вызываемая на каждый запрос.
+class FakeRequest(BaseRequest):
+    def __init__(self, latency=0.0, on_call=None):
+        self.latency = latency
+        self.on_call = on_call
+        self.calls = {}
+        self._message_id = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        parameters = request_data.parameters if request_data is not None else {}
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if api_method == 'getUpdates':
+            # Обновления в бенчмарках передаются напрямую, а не через long polling
+            await asyncio.sleep(1)
+        result = self._result(api_method, parameters)
+        if self.on_call is not None:
+            self.on_call(api_method, parameters)
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+    def _result(self, api_method, parameters):
+        if api_method == 'getMe':
+            return {
+                'id': BOT_ID, 'is_bot': True, 'first_name': 'Bench', 'username': BOT_USERNAME,
+                'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False,
+            }
+        if api_method == 'getUpdates':
+            return []
+        if api_method == 'getFile':
+            return {
+                'file_id': parameters.get('file_id'), 'file_unique_id': 'unique',
+                'file_size': 16, 'file_path': 'documents/plan.txt',
+            }
+        if api_method in ('sendMessage', 'editMessageText', 'sendDocument'):
+            self._message_id += 1
+            chat_id = int(parameters.get('chat_id', 0))
+            return {
+                'message_id': parameters.get('message_id', self._message_id),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': parameters.get('text', ''),
+            }
+        return True
+
+
+# Построение входящих обновлений в формате Bot API
+
+def _user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}", 'username': f"user{user_id}"}
+
+
+def message_update(update_id, user_id, text):
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': _user(user_id),
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def document_update(update_id, user_id, file_name):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': _user(user_id),
+            'document': {
+                'file_id': f"file{update_id}", 'file_unique_id': f"unique{update_id}",
+                'file_name': file_name, 'mime_type': 'text/plain', 'file_size': 16,
+            },
+        },
+    }
+
+
+def callback_update(update_id, user_id, data):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': _user(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'Bench'},
+                'text': '...',
+            },
+        },
+    }
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
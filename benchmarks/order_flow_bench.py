@@ -0,0 +1,372 @@
+# Бенчмарк полного диалога оформления заказа с базовой линией.
+#
+# Приложение собирается той же функцией bot.build_application, что и в main(), Bot API подменён
+# FakeRequest, поэтому работают настоящие ConversationHandler, процессор обновлений, SQLite и очередь
+# задач, но без сети. Каждый виртуальный пользователь проходит диалог шаг за шагом
+# (/start → тип работы → тема → дата → руководитель → база практики → план → подтверждение),
+# дожидаясь обработки предыдущего шага; пользователи работают одновременно.
+#
+# Результат: пропускная способность, p50/p95/p99 по каждому шагу (состоянию диалога) и рост RSS
+# процесса между раундами. Раундов несколько: первый прогревает кэши, рост памяти на следующих
+# раундах указывает на утечку.
+# Для шага измеряются два времени: задержка шага (от передачи обновления до конца обработки,
+# включая ожидание места среди UPDATE_CONCURRENCY) и время самого обработчика. Задержка шага
+# в основном состоит из ожидания в очереди и сильно зависит от загрузки машины, поэтому
+# она только выводится, а с базовой линией сравнивается время обработчика.
+#
+# Базовая линия хранится в benchmarks/baselines/order_flow.json для каждой конфигурации запуска.
+# Без --save-baseline результат сравнивается с ней, и при ухудшении больше допуска скрипт
+# завершается с кодом 1 (для p99 допуск шире: хвост распределения шумнее). После изменений,
+# влияющих на производительность, базовую линию обновляют (--save-baseline) и коммитят вместе
+# с изменением, чтобы разница была видна в ревью.
+# Цифры зависят от машины: сравнивать имеет смысл запуски на одном и том же окружении.
+# Бенчмарк запускается --runs раз в отдельных процессах, и сравнивается (и сохраняется)
+# медиана каждого показателя по запускам, поэтому единичный шумный запуск не даёт ложного ухудшения.
+# RSS измеряется через psutil, если он установлен, иначе через /proc (Linux); если ни то,
+# ни другое недоступно, проверка памяти пропускается.
+#
+# Запуск из корня репозитория:
+#     python benchmarks/order_flow_bench.py --users 200 --rounds 3
+#     python benchmarks/order_flow_bench.py --users 200 --rounds 3 --save-baseline
+import argparse
+import asyncio
+import functools
+import gc
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from telegram.ext import ConversationHandler
+
+from conversation_load import conversation
+from fake_telegram import FakeRequest, callback_update, message_update, percentile, prepare_environment
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'order_flow.json')
+# Обработчик bot.py, который должен сработать на каждом шаге conversation()
+STEP_HANDLERS = (
+    'start',
+    'main_menu_handler',
+    'select_order_type_callback',
+    'input_topic',
+    'handle_calendar',
+    'select_supervisor_option',
+    'select_practice_base_option',
+    'input_plan_choice',
+    'input_plan_text',
+    'confirm_order',
+)
+# Допустимое ухудшение относительно базовой линии, доля: для p50 и p95 и для p99
+TOLERANCE = 0.25
+TAIL_TOLERANCE = 0.5
+# Разница меньше этих значений считается шумом
+LATENCY_NOISE_MS = 2.0
+RSS_NOISE_MB = 2.0
+
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Время обработчиков текущего раунда: имя обработчика -> список длительностей, секунд
+handler_times = {}
+
+
+# Текущий RSS процесса в МБ или None, если измерить его нечем
+def rss_mb():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    if not os.path.exists('/proc/self/status'):
+        return None
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return None
+
+
+def _record_time(callback):
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            if name in handler_times:
+                handler_times[name].append(time.perf_counter() - started)
+    return wrapper
+
+
+# Точное время каждого вызова обработчиков шагов (гистограммы metrics дают только корзины)
+def record_handler_times(handler):
+    if isinstance(handler, ConversationHandler):
+        for nested in handler.entry_points + handler.fallbacks:
+            record_handler_times(nested)
+        for state_handlers in handler.states.values():
+            for nested in state_handlers:
+                record_handler_times(nested)
+    elif getattr(handler, 'callback', None) is not None and handler.callback.__name__ in STEP_HANDLERS:
+        handler.callback = _record_time(handler.callback)
+
+
+async def virtual_user(application, user_id, deadline, latencies, update_ids, rng, think_time):
+    from telegram import Update
+
+    for step, (kind, payload) in enumerate(conversation(user_id, deadline)):
+        update_id = next(update_ids)
+        if kind == 'message':
+            data = message_update(update_id, user_id, payload)
+        else:
+            data = callback_update(update_id, user_id, payload)
+        update = Update.de_json(data, application.bot)
+        started = time.perf_counter()
+        # Тот же путь, что и у обновлений из очереди приложения
+        await application.update_processor.process_update(update, application.process_update(update))
+        latencies[STEP_HANDLERS[step]].append(time.perf_counter() - started)
+        if think_time:
+            await asyncio.sleep(rng.uniform(0, think_time))
+
+
+async def run_round(application, users, deadline, update_ids, args, round_index):
+    latencies = {name: [] for name in STEP_HANDLERS}
+    handler_times.clear()
+    handler_times.update({name: [] for name in STEP_HANDLERS})
+    rng = random.Random(args.seed + round_index)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        virtual_user(application, user_id, deadline, latencies, update_ids, rng, args.think_time)
+        for user_id in users
+    ))
+    return time.perf_counter() - started, latencies, dict(handler_times)
+
+
+async def run(args):
+    prepare_environment(UPDATE_CONCURRENCY=args.concurrency)
+    import bot
+    import metrics
+    import storage
+    logging.getLogger().setLevel(logging.WARNING)
+
+    application = bot.build_application(request=FakeRequest(latency=args.api_latency))
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            record_handler_times(handler)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+
+    deadline = date.today() + timedelta(days=20)
+    update_ids = iter(range(1, 10 ** 9))
+    orders_before = storage.count_orders()
+    gc.collect()
+    rss_start = rss_mb()
+    rounds = []
+    for round_index in range(args.rounds):
+        # Новые пользователи в каждом раунде: состояние диалогов и user_data тоже растут
+        first_user_id = 10000 + round_index * args.users
+        users = range(first_user_id, first_user_id + args.users)
+        elapsed, latencies, handlers = await run_round(application, users, deadline, update_ids, args, round_index)
+        gc.collect()
+        rounds.append({'elapsed': elapsed, 'latencies': latencies, 'handlers': handlers, 'rss_mb': rss_mb()})
+
+    await application.stop()
+    await application.post_stop(application)
+    await application.shutdown()
+
+    # Каждый шаг должен был попасть в свой обработчик, а каждый диалог — закончиться заказом
+    handler_calls = {name: metrics._handlers[name]['latency'].total for name in STEP_HANDLERS}
+    handler_errors = sum(stats['errors'] for stats in metrics._handlers.values())
+    confirmed = storage.count_orders() - orders_before
+    expected = args.users * args.rounds
+    problems = [
+        f"{name}: {calls} вызовов из {expected}" for name, calls in handler_calls.items() if calls != expected
+    ]
+    if confirmed != expected:
+        problems.append(f"подтверждено заказов: {confirmed} из {expected}")
+    if handler_errors:
+        problems.append(f"исключений в обработчиках: {handler_errors}")
+    return summarize(args, rounds, rss_start), problems
+
+
+def quantiles(measured, key):
+    result = {}
+    for name in STEP_HANDLERS:
+        values = [value for round_result in measured for value in round_result[key][name]]
+        result[name] = {
+            'p50_ms': round(percentile(values, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(values, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 2),
+        }
+    return result
+
+
+# Сводка по раундам после прогрева (первый раунд учитывается, только если он единственный)
+def summarize(args, rounds, rss_start):
+    measured = rounds[1:] or rounds
+    updates = args.users * len(STEP_HANDLERS) * len(measured)
+    elapsed = sum(result['elapsed'] for result in measured)
+    summary = {
+        'throughput_ups': round(updates / elapsed, 1),
+        'orders_per_second': round(args.users * len(measured) / elapsed, 1),
+        'steps': quantiles(measured, 'latencies'),
+        'handlers': quantiles(measured, 'handlers'),
+        'rss_start_mb': None,
+        'rss_end_mb': None,
+        'rss_growth_per_round_mb': None,
+    }
+    rss = [rss_start] + [result['rss_mb'] for result in rounds]
+    if None not in rss:
+        summary['rss_start_mb'] = round(rss_start, 1)
+        summary['rss_end_mb'] = round(rss[-1], 1)
+        # Рост памяти за раунд после прогрева
+        summary['rss_growth_per_round_mb'] = round((rss[-1] - rss[1]) / max(len(rounds) - 1, 1), 2)
+    return summary
+
+
+def config_key(args):
+    return (f"users={args.users},rounds={args.rounds},api_latency={args.api_latency},"
+            f"concurrency={args.concurrency},think_time={args.think_time}")
+
+
+def print_report(result):
+    print(f"Пропускная способность: {result['throughput_ups']} обновлений/с, "
+          f"{result['orders_per_second']} заказов/с")
+    print(f"\n{'шаг':<30}{'задержка шага, мс':^30}{'время обработчика, мс':^30}")
+    print(f"{'':<30}" + f"{'p50':>10}{'p95':>10}{'p99':>10}" * 2)
+    for name, step in result['steps'].items():
+        handler = result['handlers'][name]
+        print(f"{name:<30}{step['p50_ms']:>10.1f}{step['p95_ms']:>10.1f}{step['p99_ms']:>10.1f}"
+              f"{handler['p50_ms']:>10.1f}{handler['p95_ms']:>10.1f}{handler['p99_ms']:>10.1f}")
+    if result['rss_growth_per_round_mb'] is None:
+        print("\n⚠️ RSS не измерен: нет psutil и /proc/self/status, проверка памяти пропущена")
+    else:
+        print(f"\nRSS: {result['rss_start_mb']} МБ → {result['rss_end_mb']} МБ, "
+              f"рост за раунд после прогрева: {result['rss_growth_per_round_mb']} МБ")
+
+
+def load_baselines():
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(key, result):
+    baselines = load_baselines()
+    baselines[key] = result
+    os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+    with open(BASELINE_PATH, 'w', encoding='utf-8', newline='\r\n') as f:
+        json.dump(baselines, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+# Сравнение с базовой линией: список ухудшений сверх допуска.
+# Сравнивается время обработчиков, а не задержка шага, которая в основном — ожидание в очереди.
+def compare(baseline, result, tolerance, tail_tolerance=TAIL_TOLERANCE):
+    regressions = []
+    if result['throughput_ups'] < baseline['throughput_ups'] * (1 - tolerance):
+        regressions.append(
+            f"пропускная способность {result['throughput_ups']} < {baseline['throughput_ups']} обновлений/с"
+        )
+    for name, handler in result['handlers'].items():
+        old = baseline.get('handlers', {}).get(name)
+        if old is None:
+            continue
+        for quantile, allowed in (('p50_ms', tolerance), ('p95_ms', tolerance), ('p99_ms', tail_tolerance)):
+            if handler[quantile] > old[quantile] * (1 + allowed) + LATENCY_NOISE_MS:
+                regressions.append(f"{name} {quantile[:3]}: {handler[quantile]} мс > {old[quantile]} мс")
+    growth, old_growth = result['rss_growth_per_round_mb'], baseline.get('rss_growth_per_round_mb')
+    if growth is not None and old_growth is not None and growth > max(old_growth, 0) * (1 + tolerance) + RSS_NOISE_MB:
+        regressions.append(f"рост RSS за раунд {growth} МБ > {old_growth} МБ")
+    return regressions
+
+
+# Медиана каждого показателя по нескольким запускам
+def median_result(results):
+    first = results[0]
+    if isinstance(first, dict):
+        return {key: median_result([result[key] for result in results]) for key in first}
+    if first is None:
+        return None
+    return round(statistics.median(results), 2)
+
+
+# Один запуск в отдельном процессе: состояние bot.py, базы и метрик у каждого запуска своё
+def run_child(args):
+    with tempfile.TemporaryDirectory() as output_dir:
+        output = os.path.join(output_dir, 'result.json')
+        completed = subprocess.run([
+            sys.executable, os.path.abspath(__file__),
+            '--users', str(args.users), '--rounds', str(args.rounds), '--api-latency', str(args.api_latency),
+            '--concurrency', str(args.concurrency), '--think-time', str(args.think_time), '--seed', str(args.seed),
+            '--runs', '1', '--output', output,
+        ])
+        if completed.returncode != 0:
+            raise SystemExit(completed.returncode)
+        with open(output, encoding='utf-8') as f:
+            return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк полного диалога оформления заказа')
+    parser.add_argument('--users', type=int, default=200, help='одновременных виртуальных пользователей')
+    parser.add_argument('--rounds', type=int, default=3, help='раундов (первый — прогрев)')
+    parser.add_argument('--api-latency', type=float, default=0.02, help='задержка ответа Bot API, секунд')
+    parser.add_argument('--concurrency', type=int, default=32, help='UPDATE_CONCURRENCY')
+    parser.add_argument('--think-time', type=float, default=0.0, help='максимальная пауза пользователя между шагами, секунд')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='допустимое ухудшение p50 и p95, доля')
+    parser.add_argument('--tail-tolerance', type=float, default=TAIL_TOLERANCE, help='допустимое ухудшение p99, доля')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--runs', type=int, default=3, help='запусков, по которым берётся медиана')
+    parser.add_argument('--save-baseline', action='store_true', help='записать результат как базовую линию')
+    parser.add_argument('--output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.runs > 1:
+        results = []
+        for index in range(args.runs):
+            print(f"Запуск {index + 1} из {args.runs}")
+            results.append(run_child(args))
+        result = median_result(results)
+        print(f"\nМедиана по {args.runs} запускам:")
+        print_report(result)
+    else:
+        result, problems = asyncio.run(run(args))
+        print_report(result)
+        if problems:
+            print(f"\n❌ Диалог прошёл некорректно: {'; '.join(problems)}")
+            raise SystemExit(1)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(result, f)
+            return
+
+    key = config_key(args)
+    if args.save_baseline:
+        save_baseline(key, result)
+        print(f"\nБазовая линия для {key} сохранена в {os.path.relpath(BASELINE_PATH)}")
+        return
+    baseline = load_baselines().get(key)
+    if baseline is None:
+        print(f"\nБазовой линии для {key} нет; сохраните её с --save-baseline")
+        return
+    regressions = compare(baseline, result, args.tolerance, args.tail_tolerance)
+    if regressions:
+        print(f"\n❌ Ухудшение относительно базовой линии (допуск {args.tolerance:.0%}):")
+        for regression in regressions:
+            print(f"  {regression}")
+        raise SystemExit(1)
+    print(f"\n✅ В пределах базовой линии (допуск {args.tolerance:.0%})")
+
+
+if __name__ == '__main__':
+    main()
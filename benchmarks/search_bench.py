@@ -0,0 +1,94 @@
+# Бенчмарк полнотекстового поиска (команда /search, storage.search).
+#
+# Создаёт во временной папке базу с заданным количеством заказов и отзывов со случайными темами,
+# руководителями и планами, измеряет время построения индекса для уже заполненной базы
+# (как при первом запуске после обновления) и задержку поиска: от редких слов до слов,
+# которые встречаются в большой доле документов.
+#
+# Запуск из корня репозитория:
+#     python benchmarks/search_bench.py --orders 100000 --feedbacks 20000
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage
+from fake_telegram import percentile
+
+SUBJECTS = (
+    'анализ управление персонал предприятие финансовый маркетинг стратегия развитие инвестиции логистика '
+    'психология право экономика бухгалтерский учёт организация'
+).split()
+SYLLABLES = ('ка', 'ро', 'ми', 'ну', 'ста', 'ле', 'ви', 'за', 'то', 'пре', 'до', 'гра', 'ли', 'ме', 'сто')
+NAMES = ('Иван', 'Мария', 'Ольга', 'Пётр', 'Анна', 'Сергей', 'Дмитрий', 'Елена', 'Алексей', 'Наталья')
+QUERIES = (
+    'финансовый анализ', 'инвест', 'логистика', 'Мария', 'проф Ольга', 'спасибо маркетинг', 'несуществующее слово',
+)
+
+
+def fill(orders, feedbacks, seed):
+    rng = random.Random(seed)
+    words = list(SUBJECTS) + [''.join(rng.sample(SYLLABLES, 3)) for _ in range(3000)]
+    conn = storage.get_connection()
+    # Заполнение без триггеров индекса: так выглядит база, созданная до появления поиска
+    conn.executescript(''.join(
+        f"DROP TRIGGER {name};" for name in (
+            'orders_fts_insert', 'orders_fts_update', 'orders_fts_delete', 'feedbacks_fts_insert', 'feedbacks_fts_delete'
+        )
+    ) + ''.join(f"DROP TABLE {table};" for table in storage.SEARCH_TABLES))
+    with conn:
+        conn.executemany(
+            'INSERT INTO orders (order_id, user_id, username, first_name, order_type, topic, supervisor, '
+            'practice_base, plan, price, status, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [
+                (
+                    order_id, 1000 + order_id % 5000, f"user{order_id % 5000}", rng.choice(NAMES), 'Курсовая работа',
+                    ' '.join(rng.sample(words, 6)), f"проф. {rng.choice(NAMES)}", 'ООО Ромашка',
+                    '; '.join(rng.sample(words, 5)), 7000, 'Новый заказ', '2026-01-01 00:00:00',
+                )
+                for order_id in range(1, orders + 1)
+            ]
+        )
+        conn.executemany(
+            'INSERT INTO feedbacks (user_id, user_key, text, created_at) VALUES (?, ?, ?, ?)',
+            [
+                (user_id, f"user{user_id}", 'Спасибо за ' + ' '.join(rng.sample(words, 8)), '2026-01-01 00:00:00')
+                for user_id in range(feedbacks)
+            ]
+        )
+    storage.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк полнотекстового поиска по заказам и отзывам')
+    parser.add_argument('--orders', type=int, default=100000)
+    parser.add_argument('--feedbacks', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20, help='повторов каждого запроса')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    storage.init(tempfile.mkdtemp(prefix='gipsr_search_bench_'))
+    fill(args.orders, args.feedbacks, args.seed)
+
+    started = time.perf_counter()
+    storage.get_connection()
+    print(f"Построение индекса для {args.orders} заказов и {args.feedbacks} отзывов: "
+          f"{time.perf_counter() - started:.2f} с")
+
+    print(f"\n{'запрос':<25}{'заказов':>9}{'отзывов':>9}{'p50, мс':>10}{'p95, мс':>10}")
+    for query in QUERIES:
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            orders, feedbacks = storage.search(query, 10)
+            timings.append(time.perf_counter() - started)
+        print(f"{query:<25}{len(orders):>9}{len(feedbacks):>9}"
+              f"{percentile(timings, 0.5) * 1000:>10.1f}{percentile(timings, 0.95) * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
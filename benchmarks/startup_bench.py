@@ -0,0 +1,142 @@
+# Бенчмарк запуска бота: время импорта bot.py (по данным python -X importtime) и RSS процесса
+# после импорта и в простое после инициализации приложения.
+#
+# Каждый замер выполняется в отдельном процессе, результат — медиана по нескольким запускам.
+# Бенчмарк проверяет бюджет: время импорта, RSS в простое и отсутствие тяжёлых модулей,
+# которые должны загружаться только по требованию (выгрузки, календарь). При превышении бюджета
+# скрипт завершается с кодом 1, поэтому его можно запускать перед выкладкой.
+#
+# Запуск из корня репозитория:
+#     python benchmarks/startup_bench.py --runs 5
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Бюджет запуска
+IMPORT_BUDGET_MS = 400
+IDLE_RSS_BUDGET_MB = 64
+# Модули, которые не должны загружаться при запуске
+LAZY_MODULES = ('pandas', 'numpy', 'openpyxl', 'telegram_bot_calendar')
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+# Замер внутри дочернего процесса: результат печатается одной JSON-строкой в stdout
+def child():
+    from fake_telegram import FakeRequest, prepare_environment
+
+    prepare_environment()
+    started = time.perf_counter()
+    import bot
+    import_ms = (time.perf_counter() - started) * 1000
+    rss_import = rss_mb()
+
+    async def idle():
+        application = bot.build_application(request=FakeRequest())
+        await application.initialize()
+        await application.post_init(application)
+        await application.start()
+        await asyncio.sleep(1)
+        rss = rss_mb()
+        await application.stop()
+        await application.post_stop(application)
+        await application.shutdown()
+        return rss
+
+    rss_idle = asyncio.run(idle())
+    print(json.dumps({
+        'import_ms': import_ms,
+        'rss_import_mb': rss_import,
+        'rss_idle_mb': rss_idle,
+        'lazy_loaded': [name for name in LAZY_MODULES if name in sys.modules],
+    }))
+
+
+# Разбор вывода -X importtime: имя модуля -> (собственное время, суммарное время), мкс
+def parse_importtime(stderr):
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def run_child():
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', os.path.abspath(__file__), '--child'],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(f"Дочерний процесс завершился с кодом {result.returncode}")
+    measurement = json.loads(result.stdout.strip().splitlines()[-1])
+    return measurement, parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк времени запуска и памяти бота')
+    parser.add_argument('--runs', type=int, default=3, help='количество запусков')
+    parser.add_argument('--top', type=int, default=15, help='сколько самых медленных модулей показать')
+    parser.add_argument('--import-budget-ms', type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument('--rss-budget-mb', type=float, default=IDLE_RSS_BUDGET_MB)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return
+
+    measurements = []
+    importtimes = []
+    for _ in range(args.runs):
+        measurement, times = run_child()
+        measurements.append(measurement)
+        importtimes.append(times)
+
+    import_ms = statistics.median(m['import_ms'] for m in measurements)
+    bot_cumulative_ms = statistics.median(t.get('bot', (0, 0))[1] for t in importtimes) / 1000
+    rss_import = statistics.median(m['rss_import_mb'] for m in measurements)
+    rss_idle = statistics.median(m['rss_idle_mb'] for m in measurements)
+    lazy_loaded = sorted({name for m in measurements for name in m['lazy_loaded']})
+
+    print(f"Запусков: {args.runs}")
+    print(f"Импорт bot.py: {import_ms:.0f} мс (по -X importtime: {bot_cumulative_ms:.0f} мс)")
+    print(f"RSS после импорта: {rss_import:.1f} МБ, в простое: {rss_idle:.1f} МБ")
+    print(f"\nСамые медленные модули (собственное время, медиана):")
+    names = set().union(*importtimes)
+    slowest = sorted(
+        ((statistics.median(t.get(name, (0, 0))[0] for t in importtimes), name) for name in names),
+        reverse=True
+    )[:args.top]
+    for self_us, name in slowest:
+        print(f"  {self_us / 1000:7.1f} мс  {name}")
+
+    failures = []
+    if import_ms > args.import_budget_ms:
+        failures.append(f"импорт {import_ms:.0f} мс > {args.import_budget_ms:.0f} мс")
+    if rss_idle > args.rss_budget_mb:
+        failures.append(f"RSS в простое {rss_idle:.1f} МБ > {args.rss_budget_mb:.0f} МБ")
+    if lazy_loaded:
+        failures.append(f"при запуске загружены модули {', '.join(lazy_loaded)}")
+    if failures:
+        print(f"\n❌ Бюджет запуска превышен: {'; '.join(failures)}")
+        raise SystemExit(1)
+    print(f"\n✅ Бюджет запуска соблюдён (импорт ≤ {args.import_budget_ms:.0f} мс, "
+          f"RSS ≤ {args.rss_budget_mb:.0f} МБ)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# Нагрузочный тест режима webhook.
+#
+# Поднимает webhook-сервер приложения из bot.py на локальном порту (Bot API подменён FakeRequest),
+# отправляет на него синтетические обновления /start по HTTP и измеряет сквозную задержку:
+# от отправки POST до ответа бота пользователю (sendMessage).
+#
+# Запуск из корня репозитория:
+#     python benchmarks/webhook_bench.py --updates 2000 --users 500 --clients 50
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from fake_telegram import FakeRequest, message_update, percentile, prepare_environment
+
+SECRET_TOKEN = 'bench-secret'
+
+
+async def run(args):
+    prepare_environment(
+        BOT_MODE='webhook',
+        WEBHOOK_URL='https://bench.invalid',
+        WEBHOOK_SECRET_TOKEN=SECRET_TOKEN,
+        UPDATE_CONCURRENCY=args.concurrency,
+    )
+    import bot
+
+    sent_at = {}
+    latencies = []
+    done = asyncio.Event()
+
+    def on_call(method, parameters):
+        if method != 'sendMessage':
+            return
+        queue = sent_at.get(int(parameters['chat_id']))
+        if queue:
+            latencies.append(time.perf_counter() - queue.pop(0))
+            if len(latencies) >= args.updates:
+                done.set()
+
+    application = bot.build_application(request=FakeRequest(latency=args.api_latency, on_call=on_call))
+    await application.initialize()
+    await application.updater.start_webhook(
+        listen='127.0.0.1',
+        port=args.port,
+        url_path=bot.WEBHOOK_PATH,
+        webhook_url=f"{bot.WEBHOOK_URL}/{bot.WEBHOOK_PATH}",
+        secret_token=SECRET_TOKEN,
+    )
+    await application.start()
+
+    url = f"http://127.0.0.1:{args.port}/{bot.WEBHOOK_PATH}"
+    limiter = asyncio.Semaphore(args.clients)
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        # Запрос без правильного секретного токена должен быть отклонён
+        response = await client.post(url, json=message_update(0, 1, '/start'),
+                                     headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'})
+        print(f"запрос с неверным токеном: HTTP {response.status_code}")
+
+        async def post(update_id):
+            user_id = 1000 + update_id % args.users
+            async with limiter:
+                sent_at.setdefault(user_id, []).append(time.perf_counter())
+                await client.post(url, json=message_update(update_id, user_id, '/start'),
+                                  headers={'X-Telegram-Bot-Api-Secret-Token': SECRET_TOKEN})
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(update_id) for update_id in range(1, args.updates + 1)))
+        await asyncio.wait_for(done.wait(), timeout=120)
+        elapsed = time.perf_counter() - started
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+
+    print(f"обновлений:            {args.updates} от {args.users} пользователей")
+    print(f"UPDATE_CONCURRENCY:    {args.concurrency}")
+    print(f"время:                 {elapsed:.2f} с")
+    print(f"обновлений в секунду:  {args.updates / elapsed:.1f}")
+    print(f"задержка p50/p95/p99:  {percentile(latencies, 0.5) * 1000:.1f} / "
+          f"{percentile(latencies, 0.95) * 1000:.1f} / {percentile(latencies, 0.99) * 1000:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест webhook-режима бота')
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--clients', type=int, default=50, help='одновременных HTTP-запросов')
+    parser.add_argument('--concurrency', type=int, default=1, help='значение UPDATE_CONCURRENCY')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка ответа Bot API, секунд')
+    parser.add_argument('--port', type=int, default=8781)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
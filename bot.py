@@ -1,4 +1,5 @@
 import os
+import asyncio
 import logging
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -8,10 +9,25 @@ from telegram.ext import (
     CallbackQueryHandler, MessageHandler, filters, ConversationHandler
 )
 from dotenv import load_dotenv
-import pandas as pd
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+import csv
+import io
 import json
-from telegram_bot_calendar import DetailedTelegramCalendar
+import shlex
+import zipfile
+
+import storage
+import broadcast
+import fileio
+from update_processor import PerUserUpdateProcessor
+from persistence import SqlitePersistence
+import pricing
+from render_cache import RenderCache
+import uploads
+import jobs
+import exports
+import metrics
+import sharding
 
 # Загрузка переменных окружения из файла .env
 load_dotenv()
@@ -25,6 +41,36 @@ if not TELEGRAM_BOT_TOKEN:
 if not ADMIN_CHAT_ID:
     raise ValueError("ID администратора не найден! Укажите ADMIN_CHAT_ID в файле .env")
 
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Настройки webhook (используются при BOT_MODE=webhook)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # Публичный адрес бота, например https://bot.example.com
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')
+WEBHOOK_CERT = os.getenv('WEBHOOK_CERT')  # Сертификат и ключ нужны, только если TLS не завершается прокси
+WEBHOOK_KEY = os.getenv('WEBHOOK_KEY')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+
+# Количество обновлений, обрабатываемых одновременно.
+# Обновления одного пользователя всегда обрабатываются по очереди (см. update_processor.py).
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '32'))
+
+# Порт HTTP-эндпоинта метрик в формате Prometheus (слушает только 127.0.0.1); не задан — эндпоинт выключен
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+# Количество рабочих процессов. При SHARDS > 1 запускается входной процесс, который получает
+# обновления и распределяет их по рабочим процессам по user_id (см. sharding.py)
+SHARDS = int(os.getenv('SHARDS', '1'))
+
+if BOT_MODE not in ('polling', 'webhook'):
+    raise ValueError("Неизвестный BOT_MODE! Допустимые значения: polling, webhook")
+
+if BOT_MODE == 'webhook' and not (WEBHOOK_URL and WEBHOOK_SECRET_TOKEN):
+    raise ValueError("Для режима webhook укажите WEBHOOK_URL и WEBHOOK_SECRET_TOKEN в файле .env")
+
 # Настройка логирования
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -32,14 +78,44 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Изменение BASE_DIR на путь в домашней директории пользователя
-BASE_DIR = os.path.join(os.path.expanduser("~"), "gipsr_bot", "Gipsr_Orders", "clients")
+# Изменение BASE_DIR на путь в домашней директории пользователя (можно переопределить в .env)
+BASE_DIR = os.getenv('BASE_DIR') or os.path.join(os.path.expanduser("~"), "gipsr_bot", "Gipsr_Orders", "clients")
 
 # Убедимся, что папка для клиентов и другие необходимые папки существуют
 os.makedirs(BASE_DIR, exist_ok=True)
 os.makedirs(os.path.join(BASE_DIR, 'feedbacks'), exist_ok=True)
 os.makedirs(os.path.join(BASE_DIR, 'data'), exist_ok=True)  # Для хранения других данных, если необходимо
 
+# Журнал заказов (SQLite) и Excel-выгрузка, которая строится из него по запросу
+storage.init(os.path.join(BASE_DIR, 'data'))
+ORDERS_EXCEL_PATH = os.path.join(BASE_DIR, 'orders.xlsx')
+# Временные файлы выгрузок командой /export
+EXPORTS_DIR = os.path.join(BASE_DIR, 'data', 'exports')
+os.makedirs(EXPORTS_DIR, exist_ok=True)
+# Файлы планов хранятся один раз по хэшу содержимого, в папках клиентов — ссылки на них
+uploads.init(os.path.join(BASE_DIR, 'data', 'plans'))
+
+# Просмотр отзывов администратором: отзывов на странице и максимальная длина отзыва в списке
+FEEDBACKS_PAGE_SIZE = 5
+FEEDBACK_PREVIEW_LENGTH = 600
+
+# Просмотр заказов администратором: заказов на странице, максимальная длина темы в списке
+# и периоды фильтра по дате создания, дней
+ORDERS_PAGE_SIZE = 10
+ORDER_TOPIC_PREVIEW_LENGTH = 80
+ORDER_FILTER_PERIODS = (1, 7, 30)
+
+# Массовое обновление статусов: максимальный размер CSV-файла и сколько строк
+# с ненайденными заказами и ошибками показывать в отчёте
+STATUS_UPDATES_MAX_FILE_SIZE = 1024 * 1024
+STATUS_REPORT_LIST_LIMIT = 20
+
+# Поиск командой /search: сколько заказов и сколько отзывов показывать
+SEARCH_RESULTS_LIMIT = 10
+
+# Количество позиций в рейтинге рефералов
+REFERRAL_LEADERBOARD_SIZE = 20
+
 # Типы заказов и их описания
 ORDER_TYPES = {
     'self': {
@@ -64,18 +140,11 @@ ORDER_TYPES = {
     }
 }
 
-# Словарь для хранения информации о рефералах
-referrals = {}
-
-# Словарь для хранения информации о заказах пользователей
-user_orders = {}
+# Заказы, пользователи и рефералы хранятся в SQLite (см. storage.py)
 
 # Словарь для хранения отзывов
 feedbacks = []
 
-# Список пользователей, взаимодействовавших с ботом
-user_ids = set()
-
 # Режимы цен (Hard Mode и Light Mode)
 PRICING_MODES = {
     'hard': {
@@ -91,7 +160,7 @@ PRICING_MODES = {
     }
 }
 
-current_pricing_mode = 'light'  # По умолчанию Light Mode
+DEFAULT_PRICING_MODE = 'light'  # По умолчанию Light Mode
 
 # Состояния диалога
 (
@@ -122,79 +191,124 @@ current_pricing_mode = 'light'  # По умолчанию Light Mode
     SHOW_FAQ
 ) = range(25)
 
-# Цены (хранятся в отдельном файле prices.json в директории data)
-PRICES_FILE = os.path.join(os.path.dirname(__file__), 'data', 'prices.json')
-
-def load_prices():
-    with open(PRICES_FILE, 'r', encoding='utf-8') as f:
-        return json.load(f)
-
-def save_prices(prices):
-    with open(PRICES_FILE, 'w', encoding='utf-8') as f:
-        json.dump(prices, f, ensure_ascii=False, indent=4)
-
-# Инициализация цен
-try:
-    PRICES = load_prices()
-except FileNotFoundError:
-    PRICES = {
-        'self': {'base': 1500},
-        'course_theory': {'base': 7000},
-        'course_empirical': {'base': 11000},
-        'vkr': {'base': 32000},
-        'master': {'base': 42000}
-    }
-    save_prices(PRICES)
-
-# Функция расчёта цены с учётом дедлайна
-def calculate_price(order_type_key, deadline_date):
-    prices = PRICES.get(order_type_key, {'base': 0})
-    base_price = prices.get('base', 0)
-
-    # Расчёт дней до дедлайна
-    days_left = (deadline_date - datetime.now()).days
-
-    # Применение правил ценообразования в зависимости от текущего режима
-    if current_pricing_mode == 'hard':
-        if days_left <= 7:
-            return int(base_price * 1.3)
-        elif 8 <= days_left <= 14:
-            return int(base_price * 1.15)
-        else:
-            return base_price
-    elif current_pricing_mode == 'light':
-        if days_left <= 3:
-            return int(base_price * 1.3)
-        elif days_left >= 7:
-            return base_price
-        else:
-            return base_price  # Можно добавить дополнительные условия при необходимости
-    else:
-        return base_price  # На случай, если режим не распознан
+# Цены, режим ценообразования и версия цен хранятся в файле prices.json в папке данных BASE_DIR
+# (см. pricing.py); путь можно переопределить в .env
+PRICES_FILE = os.getenv('PRICES_FILE') or os.path.join(BASE_DIR, 'data', 'prices.json')
+# Прежнее место файла — папка data рядом с bot.py. Оттуда файл только читается, если в BASE_DIR его ещё нет
+LEGACY_PRICES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'prices.json')
+# Цены по умолчанию, если файла цен нет или он повреждён
+DEFAULT_PRICES = {
+    'self': {'base': 1500},
+    'course_theory': {'base': 7000},
+    'course_empirical': {'base': 11000},
+    'vkr': {'base': 32000},
+    'master': {'base': 42000}
+}
 
-# Настройка локализации календаря на русский язык
-class MyTranslationCalendar(DetailedTelegramCalendar):
-    def __init__(self, **kwargs):
-        super().__init__(locale='ru', **kwargs)
+# Режим для prices.json старого формата: раньше он хранился в базе, а ещё раньше не сохранялся вовсе
+def load_legacy_pricing_mode():
+    return storage.get_setting('pricing_mode', DEFAULT_PRICING_MODE)
+
+# Инициализация цен при запуске приложения (post_init): прайс-лист компилируется в таблицу
+# движка цен (см. pricing.py). При импорте модуля файлы не читаются и не записываются.
+def init_pricing():
+    path = PRICES_FILE
+    if not os.path.exists(path) and not os.getenv('PRICES_FILE') and os.path.exists(LEGACY_PRICES_FILE):
+        path = LEGACY_PRICES_FILE
+        logger.info(f"Цены читаются из прежнего места {path} и будут сохранены в {PRICES_FILE}")
+    try:
+        pricing.configure(*pricing.load_config(path, load_legacy_pricing_mode()))
+    except FileNotFoundError:
+        path = None
+        pricing.configure(DEFAULT_PRICES, DEFAULT_PRICING_MODE, 0)
+    except ValueError as e:
+        if path == PRICES_FILE:
+            # Файл повреждён (например, записан на месте прежней версией бота и оборван сбоем):
+            # он сохраняется для ручного восстановления, а бот запускается с ценами по умолчанию
+            corrupt_path = f"{PRICES_FILE}.corrupt"
+            os.replace(PRICES_FILE, corrupt_path)
+            logger.error(f"Файл цен повреждён ({e}), сохранён как {corrupt_path}; действуют цены по умолчанию")
+        else:
+            logger.error(f"Файл цен {path} повреждён ({e}); действуют цены по умолчанию")
+        path = None
+        pricing.configure(DEFAULT_PRICES, DEFAULT_PRICING_MODE, 0)
+    # Файл без версии, новый или прочитанный из прежнего места сохраняется в версионированном формате.
+    # Запись идёт под блокировкой файла цен: несколько процессов бота запускаются одновременно.
+    if pricing.current_version() == 0 or path != PRICES_FILE:
+        os.makedirs(os.path.dirname(PRICES_FILE), exist_ok=True)
+        pricing.update_config(PRICES_FILE, pricing.get_prices(), pricing.current_mode())
+
+# Новая версия цен применена: прайс-лист нужно построить заново
+def on_prices_reloaded(table):
+    screens.invalidate('price_list')
+
+# Изменённый вручную prices.json не прошёл проверку: действуют прежние цены, администратор узнаёт причину.
+# Файл общий для всех процессов, поэтому сообщение отправляет только один из них.
+async def on_prices_rejected(error):
+    if sharding.is_primary():
+        await jobs.enqueue('notify_admin', {
+            'text': f"⚠️ Файл цен {PRICES_FILE} не применён: {error}\nДействует версия цен {pricing.current_version()}."
+        })
+
+# Перечитывание prices.json, изменённого другим процессом
+async def reload_pricing():
+    table = await fileio.run_blocking(pricing.reload_config, PRICES_FILE)
+    if table is not None:
+        on_prices_reloaded(table)
+
+sharding.subscribe('pricing', reload_pricing)
+
+# Новая версия цен, заданная администратором: файл, кэш прайс-листа и остальные процессы.
+# ValueError — прайс-лист не прошёл проверку, действующие цены не изменились.
+async def publish_price_table(prices=None, mode=None):
+    table = await fileio.run_blocking(pricing.update_config, PRICES_FILE, prices, mode)
+    on_prices_reloaded(table)
+    sharding.publish('pricing')
+    return table
+
+# Быстрый выбор срока, дней от сегодня: совпадает с границами надбавок за срочность
+# (3 дня — Light Mode, 7 и 14 дней — Hard Mode) и обычным сроком в 30 дней.
+# Выбранная дата попадает в ступень с этой границей, потому что pricing.quote считает календарные дни.
+QUICK_DEADLINE_DAYS = (3, 7, 14, 30)
+
+# Календарь с русской локализацией.
+# telegram_bot_calendar загружается при первом выборе даты, а не при запуске бота.
+_calendar_class = None
+
+def make_calendar(**kwargs):
+    global _calendar_class
+    if _calendar_class is None:
+        from telegram_bot_calendar import DetailedTelegramCalendar
+
+        class MyTranslationCalendar(DetailedTelegramCalendar):
+            def __init__(self, **kwargs):
+                super().__init__(locale='ru', **kwargs)
+
+        _calendar_class = MyTranslationCalendar
+    return _calendar_class(**kwargs)
 
 # Обработчик команды /start
+@fileio.measured
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    user_ids.add(user.id)
     text = update.message.text
     args = text.split()
 
     # Проверка на реферальный код
-    if len(args) > 1:
-        referrer_id = args[1]
-        if referrer_id != str(user.id):
-            referrals[user.id] = referrer_id
-            # Отправка уведомления рефереру
-            await context.bot.send_message(
-                chat_id=int(referrer_id),
-                text=f"🎉 Ваш друг {user.first_name} присоединился по вашей реферальной ссылке!\n"
-                     "За денежной выплатой обращайтесь сюда: @Thisissaymoon"
-            )
+    referrer_id = None
+    if len(args) > 1 and args[1].isdigit() and args[1] != str(user.id):
+        referrer_id = int(args[1])
+
+    is_new_referral = await fileio.run_blocking(
+        storage.register_user, user.id, user.username, user.first_name, referrer_id
+    )
+    if is_new_referral:
+        # Отправка уведомления рефереру
+        await context.bot.send_message(
+            chat_id=referrer_id,
+            text=f"🎉 Ваш друг {user.first_name} присоединился по вашей реферальной ссылке!\n"
+                 "За денежной выплатой обращайтесь сюда: @Thisissaymoon"
+        )
 
     # Генерация персональной реферальной ссылки
     ref_link = f"https://t.me/{context.bot.username}?start={user.id}"
@@ -215,10 +329,11 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_text(help_text, parse_mode='Markdown')
 
-# Обработчик главного меню
-async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
+# Кэш статичных экранов и прайс-листа
+screens = RenderCache('экранов')
 
+# Главное меню без персонального приветствия
+def render_main_menu():
     keyboard = [
         [InlineKeyboardButton("📝 Сделать заказ", callback_data='make_order')],
         [InlineKeyboardButton("💰 Прайс-лист", callback_data='price_list')],
@@ -229,7 +344,6 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     menu_text = (
-        f"Привет, {user.first_name}! 👋\n\n"
         "Я помогу вам заказать работу.\n\n"
         "Выберите нужный раздел:\n\n"
         "📝 *Сделать заказ* — оформить новый заказ на выполнение работы.\n"
@@ -238,6 +352,13 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "📄 *FAQ* — ответы на часто задаваемые вопросы.\n"
         "📞 *Связаться с администратором* — задать вопрос напрямую."
     )
+    return menu_text, reply_markup
+
+# Обработчик главного меню
+async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    menu_body, reply_markup = screens.get('main_menu', render_main_menu)
+    menu_text = f"Привет, {user.first_name}! 👋\n\n" + menu_body
 
     if update.callback_query:
         await update.callback_query.message.edit_text(
@@ -272,19 +393,16 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.message.reply_text("Неизвестный выбор. Пожалуйста, используйте кнопки для навигации.")
         return SELECT_MAIN_MENU
 
-# Обработчик показа прайс-листа
-async def show_price_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-
+# Прайс-лист для текущих цен и режима ценообразования
+def render_price_list():
     price_list_text = "💰 *Прайс-лист:*\n\n"
-    for key, value in PRICES.items():
+    for key, value in pricing.get_prices().items():
         order_info = ORDER_TYPES.get(key, {'name': key})
         order_name = order_info['name']
         base_price = value.get('base', 0)
         price_list_text += f"- {order_name}: от {base_price} руб.\n"
 
-    pricing_mode_info = PRICING_MODES.get(current_pricing_mode, {})
+    pricing_mode_info = PRICING_MODES.get(pricing.current_mode(), {})
     price_list_text += "\n*Как формируется цена:*\n"
     price_list_text += pricing_mode_info.get('description', '')
 
@@ -292,14 +410,18 @@ async def show_price_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_main')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
+    return price_list_text, reply_markup
 
+# Обработчик показа прайс-листа
+async def show_price_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    price_list_text, reply_markup = screens.get('price_list', render_price_list)
     await query.message.edit_text(price_list_text, parse_mode='Markdown', reply_markup=reply_markup)
     return SHOW_PRICE_LIST  # Возвращаем состояние
 
-# Обработчик показа FAQ
-async def show_faq(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
+# Экран FAQ
+def render_faq():
     faq_text = (
         "❓ *Часто задаваемые вопросы:*\n\n"
         "1️⃣ *Как оформить заказ?*\n"
@@ -318,6 +440,13 @@ async def show_faq(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_main')]
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
+    return faq_text, reply_markup
+
+# Обработчик показа FAQ
+async def show_faq(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    faq_text, reply_markup = screens.get('faq', render_faq)
     await query.message.edit_text(faq_text, parse_mode='Markdown', reply_markup=reply_markup)
     return SHOW_FAQ  # Возвращаем состояние
 
@@ -327,14 +456,8 @@ async def back_to_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     return await main_menu(update, context)
 
-# Обработчик выбора типа заказа
-async def select_order_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.callback_query:
-        query = update.callback_query
-        await query.answer()
-    else:
-        query = update
-
+# Клавиатура выбора типа работы
+def render_order_type_keyboard():
     keyboard = [
         [InlineKeyboardButton("💡 Самостоятельная работа", callback_data='self')],
         [InlineKeyboardButton("📚 Курсовая (теоретическая)", callback_data='course_theory')],
@@ -343,7 +466,17 @@ async def select_order_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("🎓 Магистерская диссертация", callback_data='master')],
         [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_main')]
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return InlineKeyboardMarkup(keyboard)
+
+# Обработчик выбора типа заказа
+async def select_order_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.callback_query:
+        query = update.callback_query
+        await query.answer()
+    else:
+        query = update
+
+    reply_markup = screens.get('order_type_keyboard', render_order_type_keyboard)
 
     if update.callback_query:
         await query.message.edit_text(
@@ -404,22 +537,77 @@ async def input_topic(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['topic'] = topic
         return await select_deadline_date(update, context)
 
+# Кэш клавиатур календаря и день, для которого они построены. Год и месяц в ключе берутся
+# из нажатой кнопки, то есть от пользователя, поэтому размер кэша ограничен
+CALENDAR_CACHE_SIZE = 256
+calendars = RenderCache('календарей', max_size=CALENDAR_CACHE_SIZE)
+_calendars_day = None
+
+# Клавиатура календаря (JSON) для шага step ('y', 'm', 'd') с текущей датой current_date.
+# Клавиатура зависит только от шага, года, месяца и минимальной даты (сегодня), поэтому строится
+# один раз на ключ; с наступлением нового дня все клавиатуры перестраиваются.
+# call_data — нажатая кнопка календаря, которая ведёт на этот шаг (None для первого шага).
+def get_calendar_keyboard(step, current_date, call_data=None):
+    global _calendars_day
+    today = datetime.now().date()
+    if _calendars_day != today:
+        calendars.invalidate()
+        _calendars_day = today
+
+    def render():
+        calendar = make_calendar(min_date=today)
+        keyboard = calendar.process(call_data)[1] if call_data else calendar.build()[0]
+        if step != 'y':
+            return keyboard
+        # На шаге выбора года сверху — кнопки быстрого выбора срока
+        markup = json.loads(keyboard)
+        quick_picks = [
+            {'text': f"+{days} дн. ({(today + timedelta(days=days)).strftime('%d.%m')})",
+             'callback_data': f"deadline_in_{days}"}
+            for days in QUICK_DEADLINE_DAYS
+        ]
+        markup['inline_keyboard'] = [quick_picks[:2], quick_picks[2:]] + markup['inline_keyboard']
+        return json.dumps(markup)
+
+    return calendars.get((step, current_date.year, current_date.month, today), render)
+
 # Обработчик выбора даты дедлайна
 async def select_deadline_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("📅 Пожалуйста, выберите дату сдачи работы:")
-    calendar, step = MyTranslationCalendar(min_date=datetime.now().date()).build()
-    await update.message.reply_text(f"Выберите {step}", reply_markup=calendar)
+    calendar = get_calendar_keyboard('y', datetime.now().date())
+    await update.message.reply_text("Выберите y", reply_markup=calendar)
     return SELECT_DEADLINE_DATE
 
-# Обработчик календаря
+# Обработчик календаря.
+# Кнопки календаря имеют вид cbcal_<id>_<действие>_<шаг>_<год>_<месяц>_<день>:
+# действие g — перейти к шагу, s — выбрать значение (выбор дня завершает выбор даты), n — пустая кнопка.
 async def handle_calendar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    result, key, step = MyTranslationCalendar(min_date=datetime.now().date()).process(query.data)
-    if not result and key:
-        await query.message.edit_text(f"Выберите {step}", reply_markup=key)
-        return SELECT_DEADLINE_DATE
-    elif result:
+    result = None
+    if query.data.startswith('deadline_in_'):
+        # Принимаются только сроки с кнопок быстрого выбора
+        days = query.data[len('deadline_in_'):]
+        if not days.isdigit() or int(days) not in QUICK_DEADLINE_DAYS:
+            return SELECT_DEADLINE_DATE
+        result = datetime.now().date() + timedelta(days=int(days))
+    else:
+        params = query.data.split('_')
+        if len(params) < 7 or params[2] not in ('g', 's') or params[3] not in ('y', 'm', 'd'):
+            return
+        action, step = params[2], params[3]
+        try:
+            current_date = date(int(params[4]), int(params[5]), int(params[6]))
+        except ValueError:
+            return
+        if action == 's' and step == 'd':
+            result = current_date
+        else:
+            next_step = step if action == 'g' else {'y': 'm', 'm': 'd'}[step]
+            key = get_calendar_keyboard(next_step, current_date, query.data)
+            await query.message.edit_text(f"Выберите {next_step}", reply_markup=key)
+            return SELECT_DEADLINE_DATE
+    if result:
         context.user_data['deadline'] = datetime.combine(result, datetime.min.time())
         await query.message.edit_text(f"🗓 Вы выбрали дату: {result.strftime('%d.%m.%Y')}")
         order_type_key = context.user_data.get('order_type_key')
@@ -543,6 +731,7 @@ async def input_plan_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return INPUT_PLAN_TEXT
     elif choice == 'skip_plan':
         context.user_data['plan'] = 'Не предоставлен'
+        context.user_data.pop('plan_sha256', None)
         return await calculate_price_step(query, context)
     elif choice == 'back_to_order_type':
         return await select_order_type(update, context)
@@ -551,20 +740,23 @@ async def input_plan_choice(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return INPUT_PLAN_CHOICE
 
 # Обработчик загрузки файла плана
+@fileio.measured
 async def upload_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
     document = update.message.document
     if document:
-        file = await document.get_file()
         user = update.effective_user
         client_name = user.username if user.username else f"user_{user.id}"
-        order_type_key = context.user_data.get('order_type_key', 'unknown')
         order_type = context.user_data.get('order_type', 'Неизвестный тип')
         order_dir = os.path.join(BASE_DIR, client_name, order_type)
 
-        os.makedirs(order_dir, exist_ok=True)
-        file_path = os.path.join(order_dir, document.file_name)
-        await file.download_to_drive(file_path)
-        context.user_data['plan'] = f"Файл: {document.file_name}"
+        # Файл скачивается потоком и хранится один раз, даже если его присылают повторно
+        try:
+            file_path, sha256, _ = await uploads.store_plan(document, order_dir)
+        except (uploads.UploadRejected, uploads.UploadFailed) as e:
+            await update.message.reply_text(f"❌ {e}")
+            return UPLOAD_PLAN
+        context.user_data['plan'] = f"Файл: {os.path.basename(file_path)}"
+        context.user_data['plan_sha256'] = sha256
         await update.message.reply_text("✅ Файл плана успешно загружен.")
     else:
         await update.message.reply_text("Пожалуйста, загрузите файл.")
@@ -575,6 +767,7 @@ async def upload_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def input_plan_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     plan_text = update.message.text
     context.user_data['plan'] = plan_text
+    context.user_data.pop('plan_sha256', None)
     return await calculate_price_step(update, context)
 
 # Расчет стоимости и отправка сообщения
@@ -588,8 +781,12 @@ async def calculate_price_step(update_or_query, context: ContextTypes.DEFAULT_TY
     else:
         deadline_date = datetime.now() + timedelta(days=30)
 
-    price = calculate_price(order_type_key, deadline_date)
+    # Цена и версия берутся из одного снимка таблицы: подтверждение сохранит именно эту цену,
+    # даже если цены изменятся, пока пользователь думает
+    table = pricing.current_table()
+    price = pricing.quote(order_type_key, deadline_date, table)
     data['price'] = price
+    data['price_version'] = table.version
 
     confirm_text = (
         f"✨ *Предварительная стоимость вашей работы составляет {price} рублей.*\n\n"
@@ -610,6 +807,7 @@ async def calculate_price_step(update_or_query, context: ContextTypes.DEFAULT_TY
     return CALCULATE_PRICE
 
 # Обработчик подтверждения заказа
+@fileio.measured
 async def confirm_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -620,66 +818,48 @@ async def confirm_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
     client_name = user.username if user.username else f"user_{user.id}"
     order_type = data.get('order_type', 'Неизвестный тип')
     order_dir = os.path.join(BASE_DIR, client_name, order_type)
-    os.makedirs(order_dir, exist_ok=True)
-    order_filename = f"order_{len(os.listdir(order_dir)) + 1}.txt"
-    order_path = os.path.join(order_dir, order_filename)
+    await fileio.makedirs(order_dir)
 
-    # Сохранение заказа в словарь
-    order_id = len(user_orders.get(user.id, [])) + 1
     order_data = {
-        'order_id': order_id,
         'date': datetime.now(),
         'type': order_type,
         'topic': data.get('topic'),
         'deadline': data.get('deadline'),
         'price': data.get('price'),
+        'price_version': data.get('price_version'),
         'status': 'Новый заказ'
     }
 
-    user_orders.setdefault(user.id, []).append(order_data)
-
-    with open(order_path, 'w', encoding='utf-8') as f:
-        f.write(f"Пользователь: {user.first_name} (@{user.username})\n")
-        f.write(f"ID: {user.id}\n")
-        f.write(f"Тип работы: {order_type}\n")
-        f.write(f"Тема: {data.get('topic')}\n")
-        f.write(f"Сроки: {data.get('deadline').strftime('%d.%m.%Y')}\n")
-        f.write(f"Научный руководитель: {data.get('supervisor', 'Не указано')}\n")
-        f.write(f"База практики: {data.get('practice_base', 'Не указано')}\n")
-        f.write(f"План: {data.get('plan', 'Не предоставлен')}\n")
-        f.write(f"Стоимость: {data.get('price')} рублей\n")
-        f.write(f"Статус: {order_data['status']}\n")
-
-    # Обновление Excel-файла
-    excel_path = os.path.join(BASE_DIR, 'orders.xlsx')
-    order_data_excel = {
-        'Дата': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'Пользователь': f"{user.first_name} (@{user.username})",
-        'ID': user.id,
-        'Тип работы': order_type,
-        'Тема': data.get('topic'),
-        'Сроки': data.get('deadline').strftime('%d.%m.%Y'),
-        'Стоимость': data.get('price'),
-        'Статус': 'Новый заказ'
-    }
-    if os.path.exists(excel_path):
-        df = pd.read_excel(excel_path)
-        df = pd.concat([df, pd.DataFrame([order_data_excel])], ignore_index=True)
-    else:
-        df = pd.DataFrame([order_data_excel])
-    df.to_excel(excel_path, index=False)
-
-    # Уведомление администратору
-    await context.bot.send_message(
-        chat_id=ADMIN_CHAT_ID,
-        text=f"🆕 *Новый заказ от пользователя @{user.username}:*\n\n"
-             f"Тип работы: {order_type}\n"
-             f"Тема: {data.get('topic')}\n"
-             f"Сроки: {data.get('deadline').strftime('%d.%m.%Y')}\n"
-             f"Стоимость: {data.get('price')} рублей\n"
-             f"ID заказа: {order_id}\n"
-             f"Подробнее см. в Excel-файле.",
-        parse_mode='Markdown'
+    # Запись заказа в журнал вместе с фоновой задачей: уведомление администратору отправляется
+    # очередью задач (см. jobs.py) после ответа пользователю. orders.xlsx строится только по запросу
+    # администратора: полная перестройка выгрузки на каждый заказ стоила бы O(всех заказов)
+    order_id = await fileio.run_blocking(storage.append_order, {
+        **order_data,
+        'user_id': user.id,
+        'username': user.username,
+        'first_name': user.first_name,
+        'supervisor': data.get('supervisor', 'Не указано'),
+        'practice_base': data.get('practice_base', 'Не указано'),
+        'plan': data.get('plan', 'Не предоставлен'),
+        'plan_sha256': data.get('plan_sha256'),
+    }, [('notify_admin_new_order', {})])
+    jobs.wake()
+
+    # Имя файла совпадает с глобальным номером заказа, поэтому сканировать папку не нужно
+    order_path = os.path.join(order_dir, f"order_{order_id}.txt")
+    await fileio.write_text(
+        order_path,
+        f"Пользователь: {user.first_name} (@{user.username})\n"
+        f"ID: {user.id}\n"
+        f"Тип работы: {order_type}\n"
+        f"Тема: {data.get('topic')}\n"
+        f"Сроки: {data.get('deadline').strftime('%d.%m.%Y')}\n"
+        f"Научный руководитель: {data.get('supervisor', 'Не указано')}\n"
+        f"База практики: {data.get('practice_base', 'Не указано')}\n"
+        f"План: {data.get('plan', 'Не предоставлен')}\n"
+        f"Стоимость: {data.get('price')} рублей\n"
+        f"Статус: {order_data['status']}\n",
+        group=True
     )
 
     await query.message.reply_text(
@@ -709,14 +889,17 @@ async def feedback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return LEAVE_FEEDBACK
 
 # Обработчик получения отзыва
+@fileio.measured
 async def receive_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     feedback_text = update.message.text
-    feedback_dir = os.path.join(BASE_DIR, 'feedbacks', user.username or f"user_{user.id}")
-    os.makedirs(feedback_dir, exist_ok=True)
+    user_key = user.username or f"user_{user.id}"
+    feedback_dir = os.path.join(BASE_DIR, 'feedbacks', user_key)
+    await fileio.makedirs(feedback_dir)
     feedback_file = os.path.join(feedback_dir, f"feedback_{datetime.now().strftime('%Y%m%d%H%M%S')}.txt")
-    with open(feedback_file, 'w', encoding='utf-8') as f:
-        f.write(feedback_text)
+    await fileio.write_text(feedback_file, feedback_text, group=True)
+    # Запись в индекс отзывов, по которому строится просмотр для администратора
+    await fileio.run_blocking(storage.add_feedback, user.id, user_key, feedback_text)
     await update.message.reply_text("Спасибо за ваш отзыв! 🙏")
     # Отправка отзыва администратору
     await context.bot.send_message(
@@ -725,13 +908,24 @@ async def receive_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return await main_menu(update, context)
 
+# Клавиатура профиля
+def render_profile_keyboard():
+    keyboard = [
+        [InlineKeyboardButton("🗑 Удалить заказ", callback_data='delete_order')],
+        [InlineKeyboardButton("🔄 Повторить заказ", callback_data='repeat_order')],
+        [InlineKeyboardButton("💬 Оставить отзыв", callback_data='leave_feedback')],
+        [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_main')]
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
 # Обработчик показа профиля пользователя
+@fileio.measured
 async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     user = update.effective_user
-    orders = user_orders.get(user.id, [])
-    referral_count = sum(1 for ref in referrals.values() if ref == str(user.id))
+    orders = await fileio.run_blocking(storage.get_user_orders, user.id)
+    referral_count = await fileio.run_blocking(storage.count_referrals, user.id)
     ref_link = context.user_data.get('ref_link', f"https://t.me/{context.bot.username}?start={user.id}")
 
     profile_text = f"👤 *Ваш профиль*\n\n"
@@ -744,20 +938,14 @@ async def show_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for order in orders:
             profile_text += (
                 f"- ID заказа: {order['order_id']}\n"
-                f"  Тип: {order['type']}\n"
+                f"  Тип: {order['order_type']}\n"
                 f"  Тема: {order['topic']}\n"
                 f"  Статус: {order['status']}\n\n"
             )
     else:
         profile_text += "У вас пока нет заказов.\n"
 
-    keyboard = [
-        [InlineKeyboardButton("🗑 Удалить заказ", callback_data='delete_order')],
-        [InlineKeyboardButton("🔄 Повторить заказ", callback_data='repeat_order')],
-        [InlineKeyboardButton("💬 Оставить отзыв", callback_data='leave_feedback')],
-        [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_main')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = screens.get('profile_keyboard', render_profile_keyboard)
 
     await query.message.edit_text(profile_text, parse_mode='Markdown', reply_markup=reply_markup)
     return PROFILE_MENU
@@ -784,19 +972,13 @@ async def profile_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         return PROFILE_MENU
 
 # Обработчик подтверждения удаления заказа
+@fileio.measured
 async def delete_order_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     order_id_text = update.message.text.strip()
     try:
         order_id = int(order_id_text)
-        orders = user_orders.get(user.id, [])
-        order_found = False
-        for order in orders:
-            if order['order_id'] == order_id:
-                orders.remove(order)
-                order_found = True
-                break
-        if order_found:
+        if await fileio.run_blocking(storage.delete_order, user.id, order_id):
             await update.message.reply_text(
                 f"✅ Заказ с ID {order_id} успешно удалён.",
                 reply_markup=InlineKeyboardMarkup([
@@ -824,10 +1006,13 @@ async def admin_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     keyboard = [
         [InlineKeyboardButton("📄 Просмотр заказов", callback_data='admin_view_orders')],
+        [InlineKeyboardButton("📊 Выгрузить заказы в Excel", callback_data='admin_export_orders')],
         [InlineKeyboardButton("💰 Изменить цены", callback_data='admin_update_prices')],
         [InlineKeyboardButton("💬 Просмотр отзывов", callback_data='admin_view_feedbacks')],
         [InlineKeyboardButton("🔄 Обновить статус заказа", callback_data='admin_update_order_status')],
         [InlineKeyboardButton("📢 Сделать рассылку", callback_data='admin_broadcast')],
+        [InlineKeyboardButton("🏆 Топ рефералов", callback_data='admin_referral_leaderboard')],
+        [InlineKeyboardButton("🌳 Дерево рефералов", callback_data='admin_referral_tree')],
         [InlineKeyboardButton("⚙️ Изменить режим ценообразования", callback_data='admin_change_pricing_mode')],
         [InlineKeyboardButton("⬅️ Назад", callback_data='back_to_main_admin')]
     ]
@@ -846,6 +1031,9 @@ async def admin_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if query.data == 'admin_view_orders':
         await admin_view_orders(update, context)
         return ADMIN_MENU
+    elif query.data == 'admin_export_orders':
+        await admin_export_orders(update, context)
+        return ADMIN_MENU
     elif query.data == 'admin_update_prices':
         await query.message.reply_text("Отправьте новый прайс-лист в формате JSON:")
         return ADMIN_UPDATE_PRICES
@@ -853,11 +1041,21 @@ async def admin_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await admin_view_feedbacks(update, context)
         return ADMIN_MENU
     elif query.data == 'admin_update_order_status':
-        await query.message.reply_text("Введите ID пользователя, ID заказа и новый статус через пробел:")
+        await query.message.reply_text(
+            "Введите ID пользователя, ID заказа и новый статус через пробел.\n"
+            "Для нескольких заказов — по одному заказу в строке, "
+            "или отправьте CSV-файл с колонками user_id, order_id, status."
+        )
         return ADMIN_UPDATE_ORDER_STATUS
     elif query.data == 'admin_broadcast':
         await query.message.reply_text("Введите сообщение для рассылки всем пользователям:")
         return ADMIN_BROADCAST
+    elif query.data == 'admin_referral_leaderboard':
+        await admin_referral_leaderboard(update, context)
+        return ADMIN_MENU
+    elif query.data == 'admin_referral_tree':
+        await admin_referral_tree(update, context)
+        return ADMIN_MENU
     elif query.data == 'admin_change_pricing_mode':
         await admin_change_pricing_mode(update, context)
         return ADMIN_CHANGE_PRICING_MODE
@@ -868,82 +1066,452 @@ async def admin_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return ADMIN_MENU
 
 # Функции для админ-панели
+
+# Фильтр списка заказов хранится в user_data администратора
+def get_orders_filter(context):
+    return context.user_data.setdefault('orders_filter', {'status': None, 'order_type': None, 'days': None})
+
+def describe_orders_filter(order_filter):
+    parts = []
+    if order_filter['status']:
+        parts.append(f"статус: {order_filter['status']}")
+    if order_filter['order_type']:
+        parts.append(f"тип: {order_filter['order_type']}")
+    if order_filter['days']:
+        parts.append(f"за {order_filter['days']} дн.")
+    return ', '.join(parts)
+
+# Страница списка заказов (от новых к старым) с кнопками навигации и фильтров
+def render_orders_page(order_filter, before_id=None, after_id=None):
+    date_from = None
+    if order_filter['days']:
+        date_from = (datetime.now() - timedelta(days=order_filter['days'])).strftime('%Y-%m-%d %H:%M:%S')
+    rows, has_older, has_newer = storage.get_orders_page(
+        ORDERS_PAGE_SIZE, before_id, after_id,
+        status=order_filter['status'], order_type=order_filter['order_type'], date_from=date_from
+    )
+    description = describe_orders_filter(order_filter)
+    orders_text = f"📄 Заказы ({description}):\n\n" if description else "📄 Заказы:\n\n"
+    if not rows:
+        orders_text += "Нет заказов."
+    for order in rows:
+        topic = order['topic'] or ''
+        if len(topic) > ORDER_TOPIC_PREVIEW_LENGTH:
+            topic = topic[:ORDER_TOPIC_PREVIEW_LENGTH] + "…"
+        name = f"@{order['username']}" if order['username'] else (order['first_name'] or 'Без имени')
+        orders_text += (
+            f"#{order['order_id']} • {order['created_at']} • {order['status']}\n"
+            f"{order['order_type']}: {topic}\n"
+            f"Пользователь: {name}, ID {order['user_id']}\n\n"
+        )
+
+    keyboard = []
+    buttons = []
+    if has_newer:
+        buttons.append(InlineKeyboardButton("⬅️ Новее", callback_data=f"orders_newer_{rows[0]['id']}"))
+    if has_older:
+        buttons.append(InlineKeyboardButton("Старше ➡️", callback_data=f"orders_older_{rows[-1]['id']}"))
+    if buttons:
+        keyboard.append(buttons)
+    filter_buttons = [InlineKeyboardButton("🔎 Фильтры", callback_data='orders_filter')]
+    if description:
+        filter_buttons.append(InlineKeyboardButton("✖️ Сбросить", callback_data='orders_reset'))
+    keyboard.append(filter_buttons)
+    return orders_text, InlineKeyboardMarkup(keyboard)
+
+# Меню фильтров. Статусы передаются в callback_data номером в списке statuses,
+# т.к. текст статуса может не поместиться в 64 байта
+def render_orders_filter_menu(order_filter, statuses):
+    def mark(selected, text):
+        return f"✅ {text}" if selected else text
+
+    keyboard = [[InlineKeyboardButton(mark(order_filter['status'] is None, "Все статусы"), callback_data='orders_fs_all')]]
+    for index, status in enumerate(statuses):
+        keyboard.append([InlineKeyboardButton(mark(order_filter['status'] == status, status), callback_data=f"orders_fs_{index}")])
+    keyboard.append([InlineKeyboardButton(mark(order_filter['order_type'] is None, "Все типы"), callback_data='orders_ft_all')])
+    for key, info in ORDER_TYPES.items():
+        keyboard.append([InlineKeyboardButton(mark(order_filter['order_type'] == info['name'], info['name']), callback_data=f"orders_ft_{key}")])
+    periods = [InlineKeyboardButton(mark(order_filter['days'] is None, "Всё время"), callback_data='orders_fd_all')]
+    for days in ORDER_FILTER_PERIODS:
+        periods.append(InlineKeyboardButton(mark(order_filter['days'] == days, f"{days} дн."), callback_data=f"orders_fd_{days}"))
+    keyboard.append(periods)
+    keyboard.append([InlineKeyboardButton("📄 Показать заказы", callback_data='orders_show')])
+    return "🔎 Фильтры списка заказов:", InlineKeyboardMarkup(keyboard)
+
+@fileio.measured
 async def admin_view_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    orders_text = "📄 *Список заказов:*\n\n"
-    for user_id, orders in user_orders.items():
-        for order in orders:
-            orders_text += (
-                f"Пользователь ID: {user_id}\n"
-                f"ID заказа: {order['order_id']}\n"
-                f"Тип: {order['type']}\n"
-                f"Тема: {order['topic']}\n"
-                f"Статус: {order['status']}\n\n"
-            )
-    await update.callback_query.message.reply_text(orders_text or "Нет заказов.", parse_mode='Markdown')
+    orders_text, reply_markup = await fileio.run_blocking(render_orders_page, get_orders_filter(context))
+    await update.callback_query.message.reply_text(orders_text, reply_markup=reply_markup)
+
+# Навигация по списку заказов и выбор фильтров (кнопки с callback_data orders_*)
+@fileio.measured
+async def admin_orders_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if update.effective_user.id != ADMIN_CHAT_ID:
+        return ADMIN_MENU
+    order_filter = get_orders_filter(context)
+    action = query.data[len('orders_'):]
+
+    if action.startswith(('fs_', 'ft_', 'fd_')) or action == 'filter':
+        previous = dict(order_filter)
+        if action.startswith('fs_'):
+            value = action[3:]
+            statuses = context.user_data.get('orders_statuses', [])
+            if value == 'all':
+                order_filter['status'] = None
+            elif int(value) < len(statuses):
+                order_filter['status'] = statuses[int(value)]
+        elif action.startswith('ft_'):
+            value = action[3:]
+            order_filter['order_type'] = ORDER_TYPES[value]['name'] if value in ORDER_TYPES else None
+        elif action.startswith('fd_'):
+            value = action[3:]
+            order_filter['days'] = int(value) if value.isdigit() else None
+        if action != 'filter' and order_filter == previous:
+            # Повторное нажатие на выбранный фильтр — меню не меняется
+            return ADMIN_MENU
+        statuses = await fileio.run_blocking(storage.get_order_statuses)
+        context.user_data['orders_statuses'] = statuses
+        menu_text, reply_markup = render_orders_filter_menu(order_filter, statuses)
+        await query.message.edit_text(menu_text, reply_markup=reply_markup)
+        return ADMIN_MENU
 
+    if action == 'reset':
+        order_filter.update(status=None, order_type=None, days=None)
+    before_id = after_id = None
+    if action.startswith('older_'):
+        before_id = int(action[len('older_'):])
+    elif action.startswith('newer_'):
+        after_id = int(action[len('newer_'):])
+    orders_text, reply_markup = await fileio.run_blocking(render_orders_page, order_filter, before_id, after_id)
+    await query.message.edit_text(orders_text, reply_markup=reply_markup)
+    return ADMIN_MENU
+
+# Построение orders.xlsx из журнала заказов и отправка администратору
+@fileio.measured
+async def admin_export_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    orders_count = await fileio.run_blocking(exports.export_orders, ORDERS_EXCEL_PATH)
+    if not orders_count:
+        await update.callback_query.message.reply_text("Нет заказов.")
+        return
+    content = await fileio.read_bytes(ORDERS_EXCEL_PATH)
+    await update.callback_query.message.reply_document(
+        document=content,
+        filename='orders.xlsx',
+        caption=f"📊 Выгружено заказов: {orders_count}"
+    )
+
+@fileio.measured
 async def admin_receive_new_prices(update: Update, context: ContextTypes.DEFAULT_TYPE):
     new_prices_text = update.message.text
     try:
         new_prices = json.loads(new_prices_text)
-        save_prices(new_prices)
-        global PRICES
-        PRICES = new_prices
-        await update.message.reply_text("Цены успешно обновлены.")
     except json.JSONDecodeError:
         await update.message.reply_text("Ошибка в формате JSON. Попробуйте ещё раз.")
         return ADMIN_UPDATE_PRICES
+    try:
+        # Таблица цен компилируется до сохранения: некорректный прайс-лист не попадёт в файл
+        table = await publish_price_table(prices=new_prices)
+    except ValueError as e:
+        await update.message.reply_text(f"Ошибка в прайс-листе: {e}\nПопробуйте ещё раз.")
+        return ADMIN_UPDATE_PRICES
+    await update.message.reply_text("Цены успешно обновлены.\n\n" + render_price_schedule(table))
     return ADMIN_MENU
 
+# Цены на все сроки для текущего режима (для проверки администратором)
+def render_price_schedule(table):
+    schedule_text = (
+        f"Версия цен: {table.version}\n"
+        f"Режим: {PRICING_MODES.get(table.mode, {}).get('name', table.mode)}\n"
+    )
+    for order_type_key in table.prices:
+        order_name = ORDER_TYPES.get(order_type_key, {'name': order_type_key})['name']
+        schedule_text += f"\n{order_name}:\n"
+        for from_days, to_days, price in table.schedule(order_type_key):
+            if to_days is None:
+                schedule_text += f"  от {from_days} дн. — {price} руб.\n"
+            else:
+                schedule_text += f"  {from_days}–{to_days} дн. — {price} руб.\n"
+    return schedule_text
+
+# Страница отзывов из индекса и клавиатура для перехода между страницами
+def render_feedbacks_page(before_id=None, after_id=None):
+    rows, has_older, has_newer = storage.get_feedback_page(FEEDBACKS_PAGE_SIZE, before_id, after_id)
+    if not rows:
+        return "💬 Отзывов пока нет.", None
+
+    feedbacks_text = "💬 Отзывы пользователей:\n\n"
+    for row in rows:
+        text = row['text']
+        if len(text) > FEEDBACK_PREVIEW_LENGTH:
+            text = text[:FEEDBACK_PREVIEW_LENGTH] + "…"
+        feedbacks_text += f"#{row['id']} {row['created_at']} от @{row['user_key']}:\n{text}\n\n"
+
+    buttons = []
+    if has_newer:
+        buttons.append(InlineKeyboardButton("⬅️ Новее", callback_data=f"feedbacks_newer_{rows[0]['id']}"))
+    if has_older:
+        buttons.append(InlineKeyboardButton("Старше ➡️", callback_data=f"feedbacks_older_{rows[-1]['id']}"))
+    reply_markup = InlineKeyboardMarkup([buttons]) if buttons else None
+    return feedbacks_text, reply_markup
+
+@fileio.measured
 async def admin_view_feedbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    feedbacks_dir = os.path.join(BASE_DIR, 'feedbacks')
-    feedbacks_text = "💬 *Отзывы пользователей:*\n\n"
-    if os.path.exists(feedbacks_dir):
-        for user_dir in os.listdir(feedbacks_dir):
-            user_feedback_dir = os.path.join(feedbacks_dir, user_dir)
-            if os.path.isdir(user_feedback_dir):
-                for feedback_file in os.listdir(user_feedback_dir):
-                    feedback_file_path = os.path.join(feedbacks_dir, user_dir, feedback_file)
-                    with open(feedback_file_path, 'r', encoding='utf-8') as f:
-                        feedback_content = f.read()
-                        feedbacks_text += f"От @{user_dir}:\n{feedback_content}\n\n"
+    feedbacks_text, reply_markup = await fileio.run_blocking(render_feedbacks_page)
+    await update.callback_query.message.reply_text(feedbacks_text, reply_markup=reply_markup)
+
+# Переход между страницами отзывов (кнопки «Новее» / «Старше»)
+async def admin_feedbacks_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if update.effective_user.id != ADMIN_CHAT_ID:
+        return ADMIN_MENU
+    _, direction, feedback_id = query.data.split('_')
+    if direction == 'older':
+        feedbacks_text, reply_markup = await fileio.run_blocking(render_feedbacks_page, before_id=int(feedback_id))
     else:
-        feedbacks_text += "Отзывов пока нет."
-    await update.callback_query.message.reply_text(feedbacks_text, parse_mode='Markdown')
+        feedbacks_text, reply_markup = await fileio.run_blocking(render_feedbacks_page, after_id=int(feedback_id))
+    await query.message.edit_text(feedbacks_text, reply_markup=reply_markup)
+    return ADMIN_MENU
 
-async def admin_receive_order_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Разбор обновлений статусов: строки из полей (user_id, order_id, статус).
+# Возвращает (обновления, ошибки разбора в виде (номер строки, текст строки)).
+def parse_status_updates(rows):
+    updates, errors = [], []
+    for line_number, fields in rows:
+        fields = [field.strip() for field in fields]
+        if not any(fields):
+            continue
+        try:
+            if len(fields) != 3 or not fields[2]:
+                raise ValueError
+            updates.append((int(fields[0]), int(fields[1]), fields[2]))
+        except ValueError:
+            errors.append((line_number, ' '.join(fields)))
+    return updates, errors
+
+def parse_status_text(text):
+    return parse_status_updates(
+        (line_number, line.strip().split(None, 2))
+        for line_number, line in enumerate(text.splitlines(), start=1)
+    )
+
+# CSV с разделителем «,», «;» или табуляцией; строка заголовка пропускается
+def parse_status_csv(content):
     try:
-        user_id_str, order_id_str, new_status = update.message.text.strip().split(None, 2)
-        user_id = int(user_id_str)
-        order_id = int(order_id_str)
-        orders = user_orders.get(user_id, [])
-        for order in orders:
-            if order['order_id'] == order_id:
-                order['status'] = new_status
-                # Уведомляем пользователя
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"🔔 Статус вашего заказа #{order_id} обновлён: {new_status}"
-                )
-                await update.message.reply_text("Статус заказа обновлён.")
-                return ADMIN_MENU
-        await update.message.reply_text("Заказ не найден.")
-        return ADMIN_MENU
-    except ValueError:
+        text = content.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        # CSV из русской версии Excel
+        text = content.decode('cp1251')
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    rows = list(enumerate(csv.reader(io.StringIO(text), dialect), start=1))
+    if rows and rows[0][1] and not rows[0][1][0].strip().isdigit():
+        rows = rows[1:]
+    return parse_status_updates(rows)
+
+# Применение обновлений одной транзакцией и отчёт администратору.
+# Уведомления пользователям ставятся в очередь задач по одному сообщению на пользователя.
+async def apply_status_updates(update: Update, updates, errors):
+    if not updates and not errors:
+        await update.message.reply_text("Обновлений не найдено. Попробуйте ещё раз.")
+        return ADMIN_UPDATE_ORDER_STATUS
+    if not updates:
         await update.message.reply_text("Неправильный формат данных. Попробуйте ещё раз.")
         return ADMIN_UPDATE_ORDER_STATUS
 
+    applied, missing = await fileio.run_blocking(
+        storage.update_order_statuses, updates, 'notify_order_status'
+    )
+    if applied:
+        jobs.wake()
+
+    if len(updates) == 1 and not errors:
+        await update.message.reply_text("Статус заказа обновлён." if applied else "Заказ не найден.")
+        return ADMIN_MENU
+
+    report = (
+        f"📋 Обновление статусов:\n"
+        f"✅ Обновлено: {len(applied)}\n"
+        f"❓ Заказ не найден: {len(missing)}\n"
+        f"⚠️ Ошибки в строках: {len(errors)}\n"
+    )
+    if missing:
+        report += "\nНе найдены (ID пользователя, ID заказа):\n"
+        report += ''.join(f"{user_id} {order_id}\n" for user_id, order_id, _ in missing[:STATUS_REPORT_LIST_LIMIT])
+        if len(missing) > STATUS_REPORT_LIST_LIMIT:
+            report += f"… и ещё {len(missing) - STATUS_REPORT_LIST_LIMIT}\n"
+    if errors:
+        report += "\nНе удалось разобрать строки:\n"
+        report += ''.join(f"{line_number}: {text}\n" for line_number, text in errors[:STATUS_REPORT_LIST_LIMIT])
+        if len(errors) > STATUS_REPORT_LIST_LIMIT:
+            report += f"… и ещё {len(errors) - STATUS_REPORT_LIST_LIMIT}\n"
+    if applied:
+        report += f"\nУведомления пользователям ({len({user_id for user_id, _, _ in applied})}) отправляются в фоне."
+    await update.message.reply_text(report)
+    return ADMIN_MENU
+
+@fileio.measured
+async def admin_receive_order_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    updates, errors = parse_status_text(update.message.text)
+    return await apply_status_updates(update, updates, errors)
+
+# Массовое обновление статусов из CSV-файла
+@fileio.measured
+async def admin_receive_order_status_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    document = update.message.document
+    if document.file_size and document.file_size > STATUS_UPDATES_MAX_FILE_SIZE:
+        await update.message.reply_text("Файл слишком большой. Разбейте обновления на несколько файлов.")
+        return ADMIN_UPDATE_ORDER_STATUS
+    file = await document.get_file()
+    content = bytes(await file.download_as_bytearray())
+    updates, errors = await fileio.run_blocking(parse_status_csv, content)
+    return await apply_status_updates(update, updates, errors)
+
+# Разбор аргументов /export: формат и фильтры вида ключ=значение,
+# значения с пробелами берутся в кавычки. Возвращает (формат, фильтры для storage.iter_orders).
+def parse_export_args(text):
+    fmt = 'xlsx'
+    filters = {}
+    keys = {'from': 'date_from', 'to': 'date_to', 'status': 'status', 'type': 'order_type'}
+    for arg in shlex.split(text)[1:]:
+        if arg.lower() in exports.FORMATS:
+            fmt = arg.lower()
+            continue
+        key, sep, value = arg.partition('=')
+        if not sep or key not in keys or not value:
+            raise ValueError(f"Непонятный параметр: {arg}")
+        if key in ('from', 'to'):
+            try:
+                datetime.strptime(value, '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f"Некорректная дата: {value}")
+        filters[keys[key]] = value
+    return fmt, filters
+
+# Выгрузка выполняется в фоне и не задерживает обработку других обновлений
+async def run_export(bot, chat_id, fmt, filters):
+    path = os.path.join(EXPORTS_DIR, f"orders_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.{fmt}")
+    try:
+        orders_count = await fileio.run_blocking(exports.export_orders, path, fmt, **filters)
+        if not orders_count:
+            await bot.send_message(chat_id=chat_id, text="Нет заказов по заданным фильтрам.")
+            return
+        content = await fileio.read_bytes(path)
+        await bot.send_document(
+            chat_id=chat_id,
+            document=content,
+            filename=f"orders.{fmt}",
+            caption=f"📊 Выгружено заказов: {orders_count}"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки заказов: {e}")
+        await bot.send_message(chat_id=chat_id, text=f"Не удалось выгрузить заказы: {e}")
+    finally:
+        if await fileio.run_blocking(os.path.exists, path):
+            await fileio.run_blocking(os.remove, path)
+
+# Обработчик команды /stats: задержки обработчиков, скорость обновлений и задержка цикла событий
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_CHAT_ID:
+        await update.message.reply_text("Извините, эта команда доступна только администратору.")
+        return
+    await update.message.reply_text(metrics.render_summary(context.application.update_processor.active_updates))
+
+# Обработчик команды /export [xlsx|csv] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД] [status="..."] [type="..."]
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_CHAT_ID:
+        await update.message.reply_text("Извините, эта команда доступна только администратору.")
+        return
+    try:
+        fmt, filters = parse_export_args(update.message.text)
+    except ValueError as e:
+        await update.message.reply_text(
+            f"{e}\n\nФормат: /export [xlsx|csv] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД] "
+            f"[status=\"Новый заказ\"] [type=\"Курсовая\"]"
+        )
+        return
+    context.application.create_task(run_export(context.bot, update.effective_chat.id, fmt, filters))
+    await update.message.reply_text("⏳ Выгрузка запущена, файл придёт отдельным сообщением.")
+
+# Результаты поиска: заказы и отзывы с фрагментами, где найдено совпадение
+def render_search_results(query, orders, feedbacks):
+    if not orders and not feedbacks:
+        return f"🔍 По запросу «{query}» ничего не найдено."
+    text = f"🔍 Результаты поиска «{query}»:\n"
+    if orders:
+        text += "\n📄 Заказы:\n\n"
+    for order in orders:
+        name = f"@{order['username']}" if order['username'] else (order['first_name'] or 'Без имени')
+        text += (
+            f"#{order['order_id']} • {order['created_at']} • {order['status']}\n"
+            f"{order['order_type']}, {name}, ID {order['user_id']}\n"
+            f"{order['snippet']}\n\n"
+        )
+    if feedbacks:
+        text += "\n💬 Отзывы:\n\n"
+    for feedback in feedbacks:
+        text += f"{feedback['created_at']} • {feedback['user_key']}\n{feedback['snippet']}\n\n"
+    # Ограничение длины сообщения Telegram
+    return text[:4096]
+
+# Обработчик команды /search <текст>: полнотекстовый поиск по заказам и отзывам (см. storage.search)
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_CHAT_ID:
+        await update.message.reply_text("Извините, эта команда доступна только администратору.")
+        return
+    query = update.message.text.partition(' ')[2].strip()
+    if not query:
+        await update.message.reply_text(
+            "Формат: /search <текст>\n"
+            "Ищет по теме, руководителю, базе практики, плану и имени клиента в заказах, а также по отзывам."
+        )
+        return
+    orders, feedbacks = await fileio.run_blocking(storage.search, query, SEARCH_RESULTS_LIMIT)
+    await update.message.reply_text(render_search_results(query, orders, feedbacks))
+
+# Рассылка выполняется в фоне (см. broadcast.py), прогресс приходит отдельным сообщением
 async def admin_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = update.message.text
-    success_count = 0
-    for user_id in user_ids:
-        try:
-            await context.bot.send_message(chat_id=user_id, text=message)
-            success_count += 1
-        except Exception as e:
-            logger.error(f"Не удалось отправить сообщение пользователю {user_id}: {e}")
-    await update.message.reply_text(f"Сообщение отправлено {success_count} пользователям.")
+    broadcast_id = await fileio.run_blocking(storage.create_broadcast, message, update.effective_chat.id)
+    total = (await fileio.run_blocking(storage.get_broadcast, broadcast_id))['total']
+    if sharding.is_primary():
+        broadcast.start_broadcast(context.application, broadcast_id)
+    else:
+        # В режиме шардирования рассылки отправляет только рабочий процесс 0 (см. post_init)
+        sharding.publish('broadcast')
+    await update.message.reply_text(f"📢 Рассылка #{broadcast_id} запущена для {total} пользователей.")
     return ADMIN_MENU
 
+# Рейтинг пользователей по количеству рефералов (по индексу счётчиков)
+@fileio.measured
+async def admin_referral_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    leaders = await fileio.run_blocking(storage.get_referral_leaderboard, REFERRAL_LEADERBOARD_SIZE)
+    if not leaders:
+        await update.callback_query.message.reply_text("Рефералов пока нет.")
+        return
+    leaderboard_text = "🏆 Топ рефералов:\n\n"
+    for place, row in enumerate(leaders, start=1):
+        name = f"@{row['username']}" if row['username'] else (row['first_name'] or 'Без имени')
+        leaderboard_text += f"{place}. {name} (ID {row['referrer_id']}) — {row['count']}\n"
+    await update.callback_query.message.reply_text(leaderboard_text)
+
+# Выгрузка дерева рефералов файлом
+@fileio.measured
+async def admin_referral_tree(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tree_text = await fileio.run_blocking(storage.export_referral_tree)
+    if not tree_text:
+        await update.callback_query.message.reply_text("Рефералов пока нет.")
+        return
+    await update.callback_query.message.reply_document(
+        document=tree_text.encode('utf-8'),
+        filename='referrals.txt',
+        caption="🌳 Дерево рефералов"
+    )
+
 async def admin_change_pricing_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [
         [InlineKeyboardButton("🔴 Hard Mode", callback_data='set_hard_mode')],
@@ -957,13 +1525,12 @@ async def admin_change_pricing_mode(update: Update, context: ContextTypes.DEFAUL
 async def admin_change_pricing_mode_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
-    global current_pricing_mode
     if query.data == 'set_hard_mode':
-        current_pricing_mode = 'hard'
+        await publish_price_table(mode='hard')
         await query.message.reply_text("Режим ценообразования установлен на Hard Mode.")
         return ADMIN_MENU
     elif query.data == 'set_light_mode':
-        current_pricing_mode = 'light'
+        await publish_price_table(mode='light')
         await query.message.reply_text("Режим ценообразования установлен на Light Mode.")
         return ADMIN_MENU
     elif query.data == 'back_to_admin_menu':
@@ -983,8 +1550,101 @@ async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Извините, я не понимаю эту команду. Пожалуйста, используйте меню для навигации."
     )
 
-def main():
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+# Фоновые задачи (см. jobs.py)
+
+@jobs.handler('notify_admin_new_order')
+async def notify_admin_new_order(application, payload):
+    order = await fileio.run_blocking(storage.get_order_by_id, payload['order_id'])
+    if order is None:
+        return
+    await jobs.limiter.acquire(ADMIN_CHAT_ID)
+    await application.bot.send_message(
+        chat_id=ADMIN_CHAT_ID,
+        text=f"🆕 *Новый заказ от пользователя @{order['username']}:*\n\n"
+             f"Тип работы: {order['order_type']}\n"
+             f"Тема: {order['topic']}\n"
+             f"Сроки: {order['deadline']}\n"
+             f"Стоимость: {order['price']} рублей (версия цен {order['price_version'] or 'не указана'})\n"
+             f"ID заказа: {order['order_id']}\n"
+             f"Все заказы — кнопка «Выгрузить заказы в Excel» в меню администратора.",
+        parse_mode='Markdown'
+    )
+
+@jobs.handler('notify_admin')
+async def notify_admin(application, payload):
+    await jobs.limiter.acquire(ADMIN_CHAT_ID)
+    await application.bot.send_message(chat_id=ADMIN_CHAT_ID, text=payload['text'])
+
+# Одно сообщение на пользователя, даже если обновлено несколько его заказов
+@jobs.handler('notify_order_status')
+async def notify_order_status(application, payload):
+    updates = payload.get('updates') or [[payload['order_id'], payload['status']]]
+    if len(updates) == 1:
+        order_id, status = updates[0]
+        text = f"🔔 Статус вашего заказа #{order_id} обновлён: {status}"
+    else:
+        text = "🔔 Статусы ваших заказов обновлены:\n" + ''.join(
+            f"#{order_id}: {status}\n" for order_id, status in updates
+        )
+    await jobs.limiter.acquire(payload['user_id'])
+    await application.bot.send_message(chat_id=payload['user_id'], text=text)
+
+# Задачи обновления orders.xlsx больше не ставятся (выгрузка строится по запросу);
+# обработчик выполняет задачи, оставшиеся в очереди от прежней версии
+@jobs.handler('refresh_orders_excel')
+async def refresh_orders_excel(application, payload):
+    await fileio.run_blocking(exports.export_orders, ORDERS_EXCEL_PATH)
+
+# Действия после запуска приложения
+async def post_init(application):
+    await fileio.run_blocking(init_pricing)
+    pricing.start_watcher(PRICES_FILE, on_prices_reloaded, on_error=on_prices_rejected)
+    # В режиме шардирования рассылки и очередь задач обслуживает только рабочий процесс 0:
+    # одна рассылка не отправляется двумя процессами, а все массовые отправки идут через один
+    # ограничитель скорости. Остальные процессы сообщают о новых рассылках и задачах событиями.
+    if sharding.is_primary():
+        await broadcast.resume_broadcasts(application)
+        jobs.start(application)
+        sharding.subscribe('jobs', jobs.wake)
+        sharding.subscribe('broadcast', lambda: broadcast.resume_broadcasts(application))
+    else:
+        jobs.remote_wake = lambda: sharding.publish('jobs')
+    # У каждого рабочего процесса свой эндпоинт метрик: METRICS_PORT + номер процесса
+    metrics_port = METRICS_PORT + sharding.shard_index if METRICS_PORT and sharding.is_worker() else METRICS_PORT
+    await metrics.start(metrics_port, get_active_updates=lambda: application.update_processor.active_updates)
+
+# Действия после остановки приложения, до закрытия соединений
+async def post_stop(application):
+    await pricing.stop_watcher()
+    await broadcast.stop()
+    await jobs.stop()
+    await metrics.stop()
+
+# Действия при остановке приложения
+async def post_shutdown(application):
+    fileio.log_blocking_stats()
+    screens.log_stats()
+    calendars.log_stats()
+    await uploads.shutdown()
+    fileio.shutdown()
+
+# Сборка приложения со всеми обработчиками.
+# request позволяет подменить HTTP-слой (используется в бенчмарках без обращения к Telegram).
+def build_application(request=None):
+    builder = (
+        ApplicationBuilder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY))
+        .persistence(SqlitePersistence())
+        # Встроенная JobQueue не используется (фоновые задачи — в jobs.py), планировщик не запускаем
+        .job_queue(None)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
 
     user_conv_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start)],
@@ -1055,13 +1715,19 @@ def main():
                 MessageHandler(filters.TEXT & ~filters.COMMAND, receive_feedback)
             ],
             ADMIN_MENU: [
+                CallbackQueryHandler(admin_feedbacks_page, pattern=r'^feedbacks_(older|newer)_\d+$'),
+                CallbackQueryHandler(
+                    admin_orders_page,
+                    pattern=r'^orders_((older|newer)_\d+|filter|show|reset|fs_(all|\d+)|ft_\w+|fd_(all|\d+))$'
+                ),
                 CallbackQueryHandler(admin_menu_handler),
             ],
             ADMIN_UPDATE_PRICES: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, admin_receive_new_prices)
             ],
             ADMIN_UPDATE_ORDER_STATUS: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, admin_receive_order_status)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, admin_receive_order_status),
+                MessageHandler(filters.Document.ALL, admin_receive_order_status_file)
             ],
             ADMIN_BROADCAST: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, admin_broadcast)
@@ -1076,17 +1742,88 @@ def main():
             CommandHandler('help', help_command)
         ],
         per_user=True,
-        allow_reentry=True
+        allow_reentry=True,
+        # Состояние диалога сохраняется в SQLite и восстанавливается после перезапуска
+        name='user_conversation',
+        persistent=True
     )
 
     application.add_handler(user_conv_handler)
     application.add_handler(CommandHandler('feedback', feedback))
     application.add_handler(CommandHandler('admin', admin_start))
+    application.add_handler(CommandHandler('export', export_command))
+    application.add_handler(CommandHandler('stats', stats_command))
+    application.add_handler(CommandHandler('search', search_command))
     application.add_handler(CommandHandler('help', help_command))
     application.add_handler(MessageHandler(filters.COMMAND, unknown))
+    # Учёт задержек и ошибок всех зарегистрированных обработчиков (см. metrics.py)
+    metrics.instrument_application(application)
+    return application
+
+# Параметры webhook для Application.run_webhook и Updater.start_webhook
+def webhook_settings():
+    return dict(
+        listen=WEBHOOK_LISTEN,
+        port=WEBHOOK_PORT,
+        url_path=WEBHOOK_PATH,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET_TOKEN,
+        cert=WEBHOOK_CERT,
+        key=WEBHOOK_KEY,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+
+# Восстановление файлов после аварийной остановки: недописанные временные файлы удаляются,
+# повреждённая выгрузка orders.xlsx откладывается (новая строится из журнала при следующей выгрузке).
+# Выполняется до запуска обработки, пока никто не пишет файлы.
+def recover_files():
+    removed = fileio.remove_temp_files(BASE_DIR) + fileio.remove_temp_files(os.path.dirname(PRICES_FILE))
+    removed += uploads.remove_partial_downloads()
+    if removed:
+        logger.info(f"Удалено недописанных временных файлов: {removed}")
+    if os.path.exists(ORDERS_EXCEL_PATH) and not zipfile.is_zipfile(ORDERS_EXCEL_PATH):
+        corrupt_path = f"{ORDERS_EXCEL_PATH}.corrupt"
+        os.replace(ORDERS_EXCEL_PATH, corrupt_path)
+        logger.error(f"Файл {ORDERS_EXCEL_PATH} повреждён и сохранён как {corrupt_path}")
+
+def main():
+    # Рабочий процесс режима шардирования: обновления приходят от входного процесса
+    if sharding.is_worker():
+        try:
+            asyncio.run(sharding.run_worker(build_application(), int(os.environ[sharding.ENV_FRONT_PORT])))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    recover_files()
+
+    # Перенос заказов из orders.xlsx, созданного предыдущими версиями бота
+    imported = storage.import_legacy_excel(ORDERS_EXCEL_PATH)
+    if imported:
+        logger.info(f"Перенесено заказов из {ORDERS_EXCEL_PATH} в журнал: {imported}")
+    # Перенос отзывов, сохранённых только файлами, в индекс отзывов
+    imported = storage.import_feedback_files(os.path.join(BASE_DIR, 'feedbacks'))
+    if imported:
+        logger.info(f"Перенесено отзывов в индекс: {imported}")
+
+    # Telegram передаёт секретный токен в заголовке X-Telegram-Bot-Api-Secret-Token,
+    # запросы без него или с другим токеном отклоняются
+    webhook = webhook_settings() if BOT_MODE == 'webhook' else None
+
+    if SHARDS > 1:
+        try:
+            asyncio.run(sharding.run_front(TELEGRAM_BOT_TOKEN, SHARDS, webhook))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    application = build_application()
 
     # Запуск бота
-    application.run_polling()
+    if webhook is not None:
+        application.run_webhook(**webhook)
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,210 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from telegram.error import Forbidden, BadRequest, RetryAfter, TimedOut, NetworkError
+
+import fileio
+import storage
+
+# Движок рассылок.
+# Сообщения отправляются пулом из нескольких асинхронных воркеров с соблюдением лимитов
+# Telegram (около 30 сообщений в секунду на бота и не чаще одного сообщения в секунду в один чат).
+# Рассылка выполняется в фоне, прогресс периодически отправляется администратору,
+# а состояние доставки хранится в SQLite, поэтому после перезапуска рассылка продолжается.
+
+logger = logging.getLogger(__name__)
+
+# Общий лимит бота с небольшим запасом относительно 30 сообщений в секунду
+GLOBAL_RATE = 25
+# Минимальный интервал между сообщениями в один чат, секунд
+PER_CHAT_INTERVAL = 1.0
+# Количество одновременно работающих воркеров
+WORKERS = 16
+# Сколько получателей читается из базы за один раз
+FETCH_SIZE = 500
+# Результаты доставки сохраняются в базу пачками
+FLUSH_SIZE = 50
+# Как часто обновлять сообщение с прогрессом, секунд
+PROGRESS_INTERVAL = 5.0
+# Количество повторов при сетевых ошибках
+MAX_ATTEMPTS = 3
+
+# Рассылки, выполняющиеся в этом процессе: broadcast_id -> asyncio.Task
+# (ссылки на задачи хранятся здесь, чтобы их не собрал сборщик мусора и их можно было отменить)
+_running = {}
+
+
+# Ограничитель скорости: общий лимит сообщений в секунду и минимальный интервал для одного чата.
+# При RetryAfter от Telegram отправка приостанавливается для всех воркеров.
+class RateLimiter:
+    def __init__(self, global_rate=GLOBAL_RATE, per_chat_interval=PER_CHAT_INTERVAL):
+        self.global_interval = 1.0 / global_rate if global_rate else 0.0
+        self.per_chat_interval = per_chat_interval
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._chat_slots = {}
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, chat_id):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            slot = max(now, self._next_slot, self._paused_until, self._chat_slots.get(chat_id, 0.0))
+            self._next_slot = slot + self.global_interval
+            self._chat_slots[chat_id] = slot + self.per_chat_interval
+            if len(self._chat_slots) > 10000:
+                self._chat_slots = {chat: t for chat, t in self._chat_slots.items() if t > now}
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        loop = asyncio.get_running_loop()
+        self._paused_until = max(self._paused_until, loop.time() + seconds)
+
+
+# Общий ограничитель процесса для рассылок и фоновых задач (jobs.py): лимит Telegram один на бота,
+# и уведомления, отправленные во время рассылки, должны укладываться в него вместе с ней
+limiter = RateLimiter()
+
+
+# Пауза из RetryAfter в секундах: в зависимости от настроек библиотеки это число или timedelta
+def retry_after_seconds(error):
+    if isinstance(error.retry_after, timedelta):
+        return error.retry_after.total_seconds()
+    return float(error.retry_after)
+
+
+# Отправка одного сообщения с учётом лимитов. Возвращает состояние доставки для storage.
+async def _deliver(bot, limiter, chat_id, text):
+    attempt = 0
+    while True:
+        await limiter.acquire(chat_id)
+        try:
+            await bot.send_message(chat_id=chat_id, text=text)
+            return storage.BROADCAST_SENT
+        except RetryAfter as e:
+            # Повтор после паузы, которую запросил Telegram; попытка не расходуется
+            limiter.pause(retry_after_seconds(e))
+        except (Forbidden, BadRequest) as e:
+            # Пользователь заблокировал бота или чат недоступен — повтор не поможет
+            logger.info(f"Рассылка: пользователь {chat_id} недоступен: {e}")
+            return storage.BROADCAST_FAILED
+        except (TimedOut, NetworkError) as e:
+            attempt += 1
+            if attempt >= MAX_ATTEMPTS:
+                logger.error(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+                return storage.BROADCAST_FAILED
+            await asyncio.sleep(2 ** attempt)
+        except Exception as e:
+            logger.error(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+            return storage.BROADCAST_FAILED
+
+
+async def _progress_text(broadcast_id):
+    row = await fileio.run_blocking(storage.get_broadcast, broadcast_id)
+    done = row['sent'] + row['failed']
+    return (
+        f"📢 Рассылка #{broadcast_id}: обработано {done} из {row['total']} "
+        f"(доставлено {row['sent']}, ошибок {row['failed']})"
+    )
+
+
+async def _report_progress(bot, broadcast_id, report_chat_id, interval):
+    if report_chat_id is None:
+        return
+    message = await bot.send_message(chat_id=report_chat_id, text=await _progress_text(broadcast_id))
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await message.edit_text(await _progress_text(broadcast_id))
+        except BadRequest:
+            # Текст не изменился с прошлого обновления
+            pass
+
+
+# Выполнение рассылки до конца. Можно вызывать повторно для прерванной рассылки:
+# уже доставленные сообщения повторно не отправляются.
+async def run_broadcast(bot, broadcast_id, limiter=limiter, workers=WORKERS, progress_interval=PROGRESS_INTERVAL):
+    broadcast = await fileio.run_blocking(storage.get_broadcast, broadcast_id)
+    text = broadcast['text']
+    report_chat_id = broadcast['report_chat_id']
+    queue = asyncio.Queue(maxsize=workers * 4)
+    results = []
+
+    async def producer():
+        last_user_id = 0
+        while True:
+            chunk = await fileio.run_blocking(storage.get_pending_recipients, broadcast_id, last_user_id, FETCH_SIZE)
+            if not chunk:
+                break
+            for user_id in chunk:
+                await queue.put(user_id)
+            last_user_id = chunk[-1]
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def worker():
+        while True:
+            user_id = await queue.get()
+            if user_id is None:
+                return
+            results.append((user_id, await _deliver(bot, limiter, user_id, text)))
+            if len(results) >= FLUSH_SIZE:
+                batch = results[:]
+                results.clear()
+                await fileio.run_blocking(storage.mark_recipients, broadcast_id, batch)
+
+    progress_task = asyncio.create_task(_report_progress(bot, broadcast_id, report_chat_id, progress_interval))
+    try:
+        await asyncio.gather(producer(), *(worker() for _ in range(workers)))
+    finally:
+        # При остановке бота сохраняются и результаты, ещё не записанные пачкой
+        progress_task.cancel()
+        await fileio.run_blocking(storage.mark_recipients, broadcast_id, results)
+
+    await fileio.run_blocking(storage.finish_broadcast, broadcast_id)
+    row = await fileio.run_blocking(storage.get_broadcast, broadcast_id)
+    logger.info(f"Рассылка #{broadcast_id} завершена: доставлено {row['sent']}, ошибок {row['failed']}")
+    if report_chat_id is not None:
+        await bot.send_message(
+            chat_id=report_chat_id,
+            text=f"✅ Рассылка #{broadcast_id} завершена.\n"
+                 f"Сообщение отправлено {row['sent']} пользователям, ошибок: {row['failed']}."
+        )
+    return row
+
+
+# Запуск рассылки в фоне приложения.
+# Не через application.create_task: Application.stop() ждёт завершения таких задач, и рассылка
+# по тысячам пользователей задержала бы остановку бота. Прерванную рассылку stop() отменяет,
+# а resume_broadcasts() после перезапуска продолжает с недоставленных получателей.
+def start_broadcast(application, broadcast_id):
+    if broadcast_id in _running:
+        return _running[broadcast_id]
+    task = asyncio.get_running_loop().create_task(run_broadcast(application.bot, broadcast_id))
+    _running[broadcast_id] = task
+    task.add_done_callback(lambda _: _running.pop(broadcast_id, None))
+    return task
+
+
+# Продолжение рассылок, прерванных перезапуском бота
+async def resume_broadcasts(application):
+    for row in await fileio.run_blocking(storage.get_running_broadcasts):
+        logger.info(f"Продолжение рассылки #{row['id']}")
+        start_broadcast(application, row['id'])
+
+
+# Остановка рассылок этого процесса; состояние доставки уже сохранено в базе
+async def stop():
+    tasks = list(_running.values())
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Ошибка рассылки при остановке: {e}")
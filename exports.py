@@ -0,0 +1,50 @@
+import csv
+
+import fileio
+import storage
+
+# Выгрузка заказов в XLSX или CSV.
+# Строки читаются из журнала страницами (storage.iter_orders) и сразу пишутся в файл:
+# XLSX — через openpyxl в режиме write_only, CSV — построчно, поэтому память не зависит
+# от количества заказов. Файл пишется атомарно (fileio.atomic_output), так что ни администратор,
+# ни orders.xlsx никогда не получат наполовину записанную выгрузку.
+# Функции блокирующие: из обработчиков их вызывают через fileio.run_blocking.
+
+FORMATS = ('xlsx', 'csv')
+
+
+def _write_xlsx(path, rows):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Заказы')
+    sheet.append(storage.EXCEL_COLUMNS)
+    count = 0
+    for row in rows:
+        values = storage.order_to_excel_row(row)
+        sheet.append([values[column] for column in storage.EXCEL_COLUMNS])
+        count += 1
+    workbook.save(path)
+    return count
+
+
+def _write_csv(path, rows):
+    # utf-8-sig и ';' — чтобы файл без настройки открывался в русской версии Excel
+    with open(path, 'w', encoding='utf-8-sig', newline='') as out:
+        writer = csv.writer(out, delimiter=';')
+        writer.writerow(storage.EXCEL_COLUMNS)
+        count = 0
+        for row in rows:
+            values = storage.order_to_excel_row(row)
+            writer.writerow([values[column] for column in storage.EXCEL_COLUMNS])
+            count += 1
+    return count
+
+
+# Выгрузка заказов в path. Фильтры передаются в storage.iter_orders. Возвращает количество заказов.
+def export_orders(path, fmt='xlsx', **filters):
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+    rows = storage.iter_orders(**filters)
+    with fileio.atomic_output(path) as temp_path:
+        return _write_xlsx(temp_path, rows) if fmt == 'xlsx' else _write_csv(temp_path, rows)
@@ -0,0 +1,284 @@
+import asyncio
+import functools
+import logging
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Асинхронный слой для работы с диском.
+# Все блокирующие операции (open, os.listdir, os.makedirs, pandas, SQLite) из обработчиков
+# выполняются в отдельном пуле потоков, чтобы медленный диск не задерживал обработку
+# обновлений других пользователей.
+# Для обработчиков, помеченных @measured, учитывается время, проведённое в блокирующих вызовах.
+#
+# Файлы записываются атомарно: содержимое пишется во временный файл рядом с итоговым,
+# синхронизируется на диск (fsync) и подменяет итоговый переименованием. После сбоя на диске
+# остаётся либо старая, либо новая версия файла, но не обрезанная; недописанные временные файлы
+# удаляются при запуске (remove_temp_files). Данные пишутся один раз, как и при записи на месте.
+# Мелкие файлы, записанные почти одновременно (group=True), фиксируются группой: одно задание
+# в пуле потоков и одна синхронизация папки на всю группу.
+
+logger = logging.getLogger(__name__)
+
+# Количество потоков для дисковых операций
+IO_WORKERS = 4
+# Блокирующие вызовы дольше этого порога попадают в лог как медленные, секунд
+SLOW_IO_THRESHOLD = 0.5
+# Окончание имени временных файлов атомарной записи
+TEMP_SUFFIX = '.gipsr.tmp'
+# Сколько ждать остальные записи группы, секунд
+GROUP_COMMIT_DELAY = 0.005
+
+_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix='gipsr-io')
+
+# Имя текущего обработчика и накопленное им время блокирующих вызовов
+_current = ContextVar('fileio_current_handler', default=None)
+
+# Статистика по обработчикам: имя -> {'calls', 'blocking_calls', 'blocking_total', 'blocking_max'}
+_stats = {}
+
+# Записи, ожидающие групповой фиксации: (путь, данные, future)
+_group = []
+_group_task = None
+
+
+def _timed_call(func, args, kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+# Выполнение блокирующей функции в пуле потоков
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    result, elapsed = await loop.run_in_executor(_executor, _timed_call, func, args, kwargs)
+    current = _current.get()
+    if current is not None:
+        current['blocking_calls'] += 1
+        current['blocking_total'] += elapsed
+    if elapsed > SLOW_IO_THRESHOLD:
+        handler = current['name'] if current else '-'
+        logger.warning(f"Медленная дисковая операция {getattr(func, '__name__', func)} "
+                       f"в обработчике {handler}: {elapsed:.3f} с")
+    return result
+
+
+def _read_text(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _temp_path(path):
+    return f"{path}.{uuid.uuid4().hex[:8]}{TEMP_SUFFIX}"
+
+
+def _write_synced(path, data):
+    with open(path, 'wb') as f:
+        # Текст пишется с переводами строк платформы, как при открытии файла в текстовом режиме
+        f.write(data.replace('\n', os.linesep).encode('utf-8') if isinstance(data, str) else data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Синхронизация записи о переименовании в папке (на Windows не поддерживается и не нужна)
+def fsync_dir(directory):
+    if sys.platform == 'win32':
+        return
+    fd = os.open(directory or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+# Атомарная запись файла, который создаёт сторонний код (openpyxl, csv):
+#     with atomic_output(path) as temp_path:
+#         workbook.save(temp_path)
+# Временный файл подменяет path только при успешном выходе из блока.
+@contextmanager
+def atomic_output(path):
+    temp_path = _temp_path(path)
+    try:
+        yield temp_path
+        with open(temp_path, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        _remove_quietly(temp_path)
+        raise
+    fsync_dir(os.path.dirname(path))
+
+
+# Межпроцессная блокировка на время чтения, изменения и записи общего файла:
+#     with file_lock(path + '.lock'):
+#         ...
+# Блокируется отдельный файл, а не сам path: атомарная запись подменяет path другим файлом.
+@contextmanager
+def file_lock(lock_path):
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if sys.platform == 'win32':
+            import msvcrt
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Блокировка снимается при закрытии файла
+        os.close(fd)
+
+
+# Атомарная запись строки (UTF-8) или байтов
+def atomic_write(path, data):
+    temp_path = _temp_path(path)
+    try:
+        _write_synced(temp_path, data)
+        os.replace(temp_path, path)
+    except BaseException:
+        _remove_quietly(temp_path)
+        raise
+    fsync_dir(os.path.dirname(path))
+
+
+# Запись группы файлов: [(путь, данные)] -> [исключение или None] для каждого файла
+def _write_group(items):
+    results = []
+    written = []
+    for path, data in items:
+        temp_path = _temp_path(path)
+        try:
+            _write_synced(temp_path, data)
+            os.replace(temp_path, path)
+            written.append(path)
+            results.append(None)
+        except Exception as e:
+            _remove_quietly(temp_path)
+            results.append(e)
+    for directory in {os.path.dirname(path) for path in written}:
+        fsync_dir(directory)
+    return results
+
+
+async def _commit_group():
+    global _group, _group_task
+    await asyncio.sleep(GROUP_COMMIT_DELAY)
+    batch, _group = _group, []
+    _group_task = None
+    try:
+        results = await asyncio.get_running_loop().run_in_executor(
+            _executor, _write_group, [(path, data) for path, data, _ in batch]
+        )
+    except BaseException as e:
+        results = [e] * len(batch)
+    for (_, _, future), error in zip(batch, results):
+        if future.done():
+            continue
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+
+
+async def _write_grouped(path, data):
+    global _group_task
+    future = asyncio.get_running_loop().create_future()
+    _group.append((path, data, future))
+    if _group_task is None:
+        _group_task = asyncio.get_running_loop().create_task(_commit_group())
+    await future
+
+
+# Удаление временных файлов, оставшихся после аварийной остановки, в папке и всех вложенных.
+# Вызывается при запуске, пока никто не пишет файлы. Возвращает количество удалённых файлов.
+def remove_temp_files(directory, suffix=TEMP_SUFFIX):
+    removed = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.endswith(suffix):
+                _remove_quietly(os.path.join(root, name))
+                removed += 1
+    return removed
+
+
+async def read_text(path):
+    return await run_blocking(_read_text, path)
+
+
+# group=True — для мелких файлов, которые пишутся часто: запись фиксируется вместе с соседними
+async def write_text(path, text, group=False):
+    if group:
+        await _write_grouped(path, text)
+    else:
+        await run_blocking(atomic_write, path, text)
+
+
+async def read_bytes(path):
+    return await run_blocking(_read_bytes, path)
+
+
+async def makedirs(path):
+    await run_blocking(os.makedirs, path, exist_ok=True)
+
+
+async def listdir(path):
+    return await run_blocking(os.listdir, path)
+
+
+# Декоратор обработчика: собирает время, которое обработчик провёл в блокирующих вызовах.
+# Учитываются только вызовы через run_blocking: обращение к диску или SQLite прямо в цикле событий
+# здесь не видно, поэтому обработчики выполняют такие вызовы только через run_blocking.
+def measured(handler):
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        if _current.get() is not None:
+            # Вложенный вызов (обработчик вызывает другой обработчик) учитывается во внешнем
+            return await handler(*args, **kwargs)
+        current = {'name': handler.__name__, 'blocking_calls': 0, 'blocking_total': 0.0}
+        token = _current.set(current)
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            _current.reset(token)
+            stats = _stats.setdefault(handler.__name__, {
+                'calls': 0, 'blocking_calls': 0, 'blocking_total': 0.0, 'blocking_max': 0.0
+            })
+            stats['calls'] += 1
+            stats['blocking_calls'] += current['blocking_calls']
+            stats['blocking_total'] += current['blocking_total']
+            stats['blocking_max'] = max(stats['blocking_max'], current['blocking_total'])
+    return wrapper
+
+
+def blocking_stats():
+    return {name: dict(stats) for name, stats in _stats.items()}
+
+
+def log_blocking_stats():
+    for name, stats in sorted(_stats.items()):
+        average = stats['blocking_total'] / stats['calls'] if stats['calls'] else 0.0
+        logger.info(
+            f"{name}: вызовов {stats['calls']}, блокирующих операций {stats['blocking_calls']}, "
+            f"в пуле потоков всего {stats['blocking_total']:.3f} с, "
+            f"в среднем {average * 1000:.1f} мс, максимум {stats['blocking_max'] * 1000:.1f} мс"
+        )
+
+
+def shutdown():
+    _executor.shutdown(wait=True)
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import Forbidden, BadRequest, RetryAfter
+
+import fileio
+import storage
+from broadcast import limiter, retry_after_seconds
+
+# Очередь фоновых задач с побочными эффектами: уведомления администратору и клиентам,
+# обновление orders.xlsx.
+# Обработчик диалога только записывает задачу в SQLite (в той же транзакции, что и сам заказ),
+# а отправкой занимается фоновый цикл. Медленный или упавший вызов Telegram больше не задерживает
+# ответ пользователю; неудачная задача повторяется с экспоненциальной задержкой и переживает
+# перезапуск бота.
+#
+# Обработчики задач регистрируются декоратором @handler('kind') и вызываются как
+# handler(application, payload). Перед отправкой сообщения обработчик вызывает
+# await limiter.acquire(chat_id), чтобы пачка уведомлений укладывалась в лимиты Telegram.
+# Ограничитель общий с рассылками (broadcast.limiter), поэтому уведомления и рассылка вместе
+# не превышают лимит бота.
+
+logger = logging.getLogger(__name__)
+
+# Задержка перед первым повтором и максимальная задержка, секунд
+BASE_DELAY = 5
+MAX_DELAY = 3600
+# После стольких неудачных попыток задача помечается как failed
+MAX_ATTEMPTS = 8
+# Сколько задач выполняется за один проход
+BATCH_SIZE = 20
+# Максимальная пауза между проверками очереди, секунд
+POLL_INTERVAL = 30
+
+_handlers = {}
+_wakeup = None
+_task = None
+# Вызывается из wake(), если цикл задач работает в другом процессе (режим шардирования, см. sharding.py)
+remote_wake = None
+
+
+def handler(kind):
+    def register(func):
+        _handlers[kind] = func
+        return func
+    return register
+
+
+# Постановка задачи в очередь вне транзакций storage
+async def enqueue(kind, payload=None):
+    job_id = await fileio.run_blocking(storage.enqueue_job, kind, payload)
+    wake()
+    return job_id
+
+
+# Сообщить циклу, что в очереди появились задачи
+def wake():
+    if _wakeup is not None:
+        _wakeup.set()
+    elif remote_wake is not None:
+        remote_wake()
+
+
+def _retry_delay(attempts):
+    return min(BASE_DELAY * 2 ** attempts, MAX_DELAY)
+
+
+async def _run_job(application, job_id, kind, payload, attempts):
+    func = _handlers.get(kind)
+    if func is None:
+        await fileio.run_blocking(storage.fail_job, job_id, f"Неизвестный тип задачи: {kind}")
+        logger.error(f"Задача #{job_id}: неизвестный тип {kind}")
+        return
+    try:
+        await func(application, payload)
+    except RetryAfter as e:
+        # Повтор после паузы, которую запросил Telegram
+        retry_after = retry_after_seconds(e)
+        limiter.pause(retry_after)
+        await fileio.run_blocking(storage.retry_job, job_id, time.time() + retry_after, str(e))
+    except (Forbidden, BadRequest) as e:
+        # Чат недоступен или сообщение некорректно — повтор не поможет
+        await fileio.run_blocking(storage.fail_job, job_id, str(e))
+        logger.warning(f"Задача #{job_id} ({kind}) отменена: {e}")
+    except Exception as e:
+        if attempts + 1 >= MAX_ATTEMPTS:
+            await fileio.run_blocking(storage.fail_job, job_id, str(e))
+            logger.error(f"Задача #{job_id} ({kind}) не выполнена после {attempts + 1} попыток: {e}")
+        else:
+            delay = _retry_delay(attempts)
+            await fileio.run_blocking(storage.retry_job, job_id, time.time() + delay, str(e))
+            logger.warning(f"Задача #{job_id} ({kind}) завершилась ошибкой, повтор через {delay} с: {e}")
+    else:
+        await fileio.run_blocking(storage.complete_job, job_id)
+
+
+async def run_jobs(application):
+    while True:
+        _wakeup.clear()
+        try:
+            due = await fileio.run_blocking(storage.get_due_jobs, time.time(), BATCH_SIZE)
+            if due:
+                await asyncio.gather(*(_run_job(application, *job) for job in due))
+                continue
+            next_run = await fileio.run_blocking(storage.next_job_time)
+        except Exception as e:
+            logger.error(f"Ошибка очереди задач: {e}")
+            next_run = None
+        timeout = POLL_INTERVAL if next_run is None else min(max(next_run - time.time(), 0), POLL_INTERVAL)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+# Запуск фонового цикла. Задачи, оставшиеся в очереди после перезапуска, выполняются сразу.
+def start(application):
+    global _wakeup, _task
+    if _task is not None and not _task.done():
+        return _task
+    _wakeup = asyncio.Event()
+    # Не через application.create_task: Application.stop() ждёт завершения таких задач
+    _task = asyncio.get_running_loop().create_task(run_jobs(application))
+    return _task
+
+
+async def stop():
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    try:
+        await _task
+    except asyncio.CancelledError:
+        pass
+    _task = None
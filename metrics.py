@@ -0,0 +1,236 @@
+import asyncio
+import bisect
+import functools
+import logging
+import time
+
+from telegram.ext import ConversationHandler
+
+# Метрики бота: задержка и ошибки каждого обработчика, количество и длительность обновлений,
+# задержка цикла событий asyncio.
+# Значения хранятся в памяти процесса и доступны в формате Prometheus по HTTP
+# (METRICS_PORT, только на localhost) и текстом через команду администратора /stats.
+# Учёт одного вызова — два perf_counter и bisect по гистограмме, поэтому метрики можно
+# держать включёнными постоянно.
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, секунд
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Как часто измерять задержку цикла событий, секунд
+LOOP_LAG_INTERVAL = 0.5
+# За сколько последних секунд считать скорость обновлений
+RATE_WINDOW = 60
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    # Оценка квантиля по корзинам: верхняя граница корзины, в которую он попадает (не больше максимума)
+    def quantile(self, fraction):
+        if not self.total:
+            return 0.0
+        rank = fraction * self.total
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+        return self.max
+
+
+# Имя обработчика -> {'latency': Histogram, 'errors': количество исключений}
+_handlers = {}
+_updates = Histogram()
+_loop_lag = Histogram()
+_last_loop_lag = 0.0
+# Количество обновлений по секундам за последние RATE_WINDOW секунд: [секунда, количество]
+_rate_slots = [[0, 0] for _ in range(RATE_WINDOW)]
+_started_at = time.time()
+_lag_task = None
+_server = None
+
+
+def _handler_stats(name):
+    stats = _handlers.get(name)
+    if stats is None:
+        stats = _handlers[name] = {'latency': Histogram(), 'errors': 0}
+    return stats
+
+
+def instrument(callback):
+    stats = _handler_stats(callback.__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            stats['errors'] += 1
+            raise
+        finally:
+            stats['latency'].observe(time.perf_counter() - started)
+    wrapper.metrics_instrumented = True
+    return wrapper
+
+
+def _instrument_handler(handler):
+    if isinstance(handler, ConversationHandler):
+        for nested in handler.entry_points + handler.fallbacks:
+            _instrument_handler(nested)
+        for state_handlers in handler.states.values():
+            for nested in state_handlers:
+                _instrument_handler(nested)
+    elif getattr(handler, 'callback', None) is not None and not getattr(handler.callback, 'metrics_instrumented', False):
+        handler.callback = instrument(handler.callback)
+
+
+# Подключение учёта ко всем обработчикам приложения, включая состояния диалогов
+def instrument_application(application):
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _instrument_handler(handler)
+
+
+# Учёт обработанного обновления (вызывается процессором обновлений)
+def observe_update(elapsed):
+    _updates.observe(elapsed)
+    second = int(time.time())
+    slot = _rate_slots[second % RATE_WINDOW]
+    if slot[0] != second:
+        slot[0], slot[1] = second, 0
+    slot[1] += 1
+
+
+def update_rate():
+    now = int(time.time())
+    return sum(count for second, count in _rate_slots if now - RATE_WINDOW < second <= now) / RATE_WINDOW
+
+
+async def _measure_loop_lag():
+    global _last_loop_lag
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        _last_loop_lag = max(loop.time() - expected, 0.0)
+        _loop_lag.observe(_last_loop_lag)
+
+
+def _format_histogram(name, labels, histogram):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+        cumulative += count
+        le = bound if bound == '+Inf' else repr(bound)
+        lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+    suffix = f'{{{labels}}}' if labels else ''
+    lines.append(f'{name}_sum{suffix} {histogram.sum}')
+    lines.append(f'{name}_count{suffix} {histogram.total}')
+    return lines
+
+
+# Все метрики в текстовом формате Prometheus
+def render_prometheus(active_updates=0):
+    lines = ['# TYPE gipsr_handler_latency_seconds histogram']
+    for name, stats in sorted(_handlers.items()):
+        lines += _format_histogram('gipsr_handler_latency_seconds', f'handler="{name}"', stats['latency'])
+    lines.append('# TYPE gipsr_handler_errors_total counter')
+    for name, stats in sorted(_handlers.items()):
+        lines.append(f'gipsr_handler_errors_total{{handler="{name}"}} {stats["errors"]}')
+    lines.append('# TYPE gipsr_update_duration_seconds histogram')
+    lines += _format_histogram('gipsr_update_duration_seconds', '', _updates)
+    lines.append('# TYPE gipsr_updates_in_flight gauge')
+    lines.append(f'gipsr_updates_in_flight {active_updates}')
+    lines.append('# TYPE gipsr_event_loop_lag_seconds histogram')
+    lines += _format_histogram('gipsr_event_loop_lag_seconds', '', _loop_lag)
+    lines.append('# TYPE gipsr_uptime_seconds gauge')
+    lines.append(f'gipsr_uptime_seconds {time.time() - _started_at:.0f}')
+    return '\n'.join(lines) + '\n'
+
+
+# Краткая сводка для команды /stats
+def render_summary(active_updates=0, top=15):
+    uptime = int(time.time() - _started_at)
+    text = (
+        f"📈 Статистика бота\n\n"
+        f"Время работы: {uptime // 3600} ч {uptime % 3600 // 60} мин\n"
+        f"Обновлений: {_updates.total}, за последнюю минуту: {update_rate():.2f}/с, в обработке: {active_updates}\n"
+        f"Обработка обновления: p50 {_updates.quantile(0.5) * 1000:.0f} мс, "
+        f"p95 {_updates.quantile(0.95) * 1000:.0f} мс, максимум {_updates.max * 1000:.0f} мс\n"
+        f"Задержка цикла событий: сейчас {_last_loop_lag * 1000:.1f} мс, "
+        f"p95 {_loop_lag.quantile(0.95) * 1000:.0f} мс, максимум {_loop_lag.max * 1000:.1f} мс\n"
+    )
+    handlers = sorted(_handlers.items(), key=lambda item: item[1]['latency'].sum, reverse=True)
+    handlers = [(name, stats) for name, stats in handlers if stats['latency'].total][:top]
+    if handlers:
+        text += "\nОбработчики (вызовов, ошибок, среднее, p95):\n"
+    for name, stats in handlers:
+        latency = stats['latency']
+        text += (
+            f"{name}: {latency.total}, {stats['errors']}, "
+            f"{latency.sum / latency.total * 1000:.0f} мс, {latency.quantile(0.95) * 1000:.0f} мс\n"
+        )
+    return text
+
+
+# HTTP-эндпоинт /metrics. Ответ строится целиком в цикле событий, без блокирующих вызовов.
+async def _serve_client(reader, writer, get_active_updates):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1] == '/metrics':
+            body = render_prometheus(get_active_updates()).encode('utf-8')
+            status, content_type = '200 OK', 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body, status, content_type = b'Not Found\n', '404 Not Found', 'text/plain'
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+# Запуск измерения задержки цикла событий и (если задан port) HTTP-эндпоинта
+async def start(port=None, host='127.0.0.1', get_active_updates=lambda: 0):
+    global _lag_task, _server
+    if _lag_task is None:
+        _lag_task = asyncio.get_running_loop().create_task(_measure_loop_lag())
+    if port and _server is None:
+        _server = await asyncio.start_server(
+            lambda reader, writer: _serve_client(reader, writer, get_active_updates), host, port
+        )
+        logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+
+
+async def stop():
+    global _lag_task, _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
+    if _lag_task is not None:
+        _lag_task.cancel()
+        try:
+            await _lag_task
+        except asyncio.CancelledError:
+            pass
+        _lag_task = None
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import logging
+import pickle
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import fileio
+import storage
+
+# Хранение состояния диалогов (ConversationHandler), context.user_data и context.bot_data в SQLite,
+# чтобы незавершённые заказы переживали перезапуск бота.
+# Application передаёт изменения раз в update_interval секунд и только для тех пользователей,
+# у которых что-то поменялось. Все изменения одного прохода собираются в память и записываются
+# одной транзакцией, поэтому стоимость записи на одно обновление почти нулевая.
+# При остановке бота Application вызывает flush(), который дописывает всё накопленное.
+
+logger = logging.getLogger(__name__)
+
+# Как часто сохранять накопленные изменения, секунд
+PERSISTENCE_INTERVAL = 10
+
+
+class SqlitePersistence(BasePersistence):
+    def __init__(self, update_interval=PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self._pending_user_data = {}
+        self._pending_bot_data = None
+        self._pending_conversations = {}
+        self._saved_bot_data = None
+        self._write_task = None
+
+    # Ключ диалога — кортеж (chat_id, user_id); в базе хранится как JSON-строка
+    @staticmethod
+    def _encode_key(key):
+        return json.dumps(list(key))
+
+    @staticmethod
+    def _decode_key(key):
+        return tuple(json.loads(key))
+
+    async def get_user_data(self):
+        rows = await fileio.run_blocking(storage.load_user_data)
+        return {user_id: pickle.loads(data) for user_id, data in rows}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        data = await fileio.run_blocking(storage.load_bot_data)
+        self._saved_bot_data = data
+        return pickle.loads(data) if data is not None else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        rows = await fileio.run_blocking(storage.load_conversations, name)
+        return {self._decode_key(key): pickle.loads(state) for key, state in rows}
+
+    async def update_user_data(self, user_id, data):
+        self._pending_user_data[user_id] = pickle.dumps(data)
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id):
+        self._pending_user_data[user_id] = None
+        self._schedule_write()
+
+    async def update_bot_data(self, data):
+        # bot_data передаётся целиком на каждом проходе — пишем только при изменении
+        serialized = pickle.dumps(data)
+        if serialized != self._saved_bot_data:
+            self._pending_bot_data = serialized
+            self._schedule_write()
+
+    async def update_conversation(self, name, key, new_state):
+        self._pending_conversations[(name, self._encode_key(key))] = (
+            pickle.dumps(new_state) if new_state is not None else None
+        )
+        self._schedule_write()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # Запись запускается один раз на проход: все update_* этого прохода попадают в один пакет
+    def _schedule_write(self):
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.get_running_loop().create_task(self._write_pending())
+
+    def _has_pending(self):
+        return bool(self._pending_user_data or self._pending_conversations or self._pending_bot_data is not None)
+
+    async def _write_pending(self):
+        # Даём остальным update_* текущего прохода добавить свои изменения
+        await asyncio.sleep(0)
+        while self._has_pending():
+            user_data, self._pending_user_data = self._pending_user_data, {}
+            conversations, self._pending_conversations = self._pending_conversations, {}
+            bot_data, self._pending_bot_data = self._pending_bot_data, None
+            try:
+                await fileio.run_blocking(storage.save_persistence_batch, user_data, bot_data, conversations)
+            except Exception:
+                # Возвращаем несохранённые изменения, если более свежие ещё не появились
+                for user_id, data in user_data.items():
+                    self._pending_user_data.setdefault(user_id, data)
+                for key, state in conversations.items():
+                    self._pending_conversations.setdefault(key, state)
+                if self._pending_bot_data is None:
+                    self._pending_bot_data = bot_data
+                raise
+            if bot_data is not None:
+                self._saved_bot_data = bot_data
+
+    async def flush(self):
+        if self._write_task is not None and not self._write_task.done():
+            try:
+                await self._write_task
+            except Exception as e:
+                logger.error(f"Не удалось сохранить состояние диалогов: {e}")
+        if self._has_pending():
+            await self._write_pending()
@@ -0,0 +1,318 @@
+import asyncio
+import json
+import logging
+import math
+import os
+from datetime import date, datetime
+
+import fileio
+
+# Движок расчёта цен.
+# Прайс-лист компилируется в таблицу (тип работы, режим, дней до дедлайна) -> цена,
+# поэтому расчёт стоимости — это один поиск в таблице.
+# Таблица пересобирается целиком и подменяется одним присваиванием, когда администратор
+# меняет цены или режим ценообразования, так что расчёт никогда не видит наполовину
+# обновлённых данных.
+#
+# Формат прайс-листа:
+#     {"vkr": {"base": 32000, "tiers": {"hard": [{"days": 7, "multiplier": 1.3}, ...]}}, ...}
+# Ключ "tiers" необязателен: для режимов, не указанных у типа работы, действуют DEFAULT_TIERS.
+# Ступень применяется, если до дедлайна осталось не больше days дней; проверяются по возрастанию days.
+# Дни считаются по календарным датам (days_until): дедлайн через 3 дня — это 3 дня при любом времени суток.
+#
+# Файл конфигурации цен (prices.json) хранит прайс-лист, режим и номер версии:
+#     {"version": 5, "mode": "light", "prices": {...}}
+# Версия увеличивается при каждом изменении цен или режима. Расчёт стоимости запоминает версию
+# таблицы, по которой он сделан, и она сохраняется в заказе. Файл записывается атомарно
+# (временный файл и переименование), а фоновая проверка (start_watcher) подхватывает изменения,
+# сделанные вручную или другим процессом бота: файл применяется, только если он проходит
+# проверку и его версия больше действующей. Старый формат (только прайс-лист) читается как версия 0.
+
+MODES = ('hard', 'light')
+
+# Как часто проверять, изменился ли файл конфигурации цен, секунд
+WATCH_INTERVAL = 2
+# Наибольшее значение days в ступени: таблица цен хранит цену на каждый день до этой границы
+MAX_TIER_DAYS = 365
+
+logger = logging.getLogger(__name__)
+
+# Надбавки за срочность по умолчанию: (не больше дней до дедлайна, множитель)
+DEFAULT_TIERS = {
+    'hard': ((7, 1.3), (14, 1.15)),
+    'light': ((3, 1.3),),
+}
+
+
+# Скомпилированный прайс-лист для конкретного набора цен и режима
+class PriceTable:
+    def __init__(self, prices, mode, version=0):
+        self.prices = prices
+        self.mode = mode
+        self.version = version
+        # (тип работы, режим) -> (цены по дням до дедлайна начиная с 0, базовая цена)
+        self.table = {}
+        # (тип работы, режим) -> ступени надбавок
+        self.tiers = {}
+        for order_type_key, config in prices.items():
+            base_price = config.get('base', 0)
+            custom_tiers = config.get('tiers', {})
+            for tier_mode in MODES:
+                tiers = _parse_tiers(order_type_key, tier_mode, custom_tiers.get(tier_mode, DEFAULT_TIERS[tier_mode]))
+                self.tiers[(order_type_key, tier_mode)] = tiers
+                self.table[(order_type_key, tier_mode)] = (_compile_tiers(base_price, tiers), base_price)
+
+    def quote(self, order_type_key, days_left, mode=None):
+        entry = self.table.get((order_type_key, mode or self.mode))
+        if entry is None:
+            # Неизвестный режим — базовая цена, неизвестный тип работы — 0
+            return self.prices.get(order_type_key, {}).get('base', 0)
+        by_day, base_price = entry
+        days_left = max(days_left, 0)
+        return by_day[days_left] if days_left < len(by_day) else base_price
+
+    # Цены на все сроки сразу: список (от дней, до дней или None, цена)
+    def schedule(self, order_type_key, mode=None):
+        mode = mode or self.mode
+        base_price = self.prices.get(order_type_key, {}).get('base', 0)
+        result = []
+        previous_days = 0
+        for days, multiplier in self.tiers.get((order_type_key, mode), ()):
+            result.append((previous_days, days, int(base_price * multiplier)))
+            previous_days = days + 1
+        result.append((previous_days, None, base_price))
+        return result
+
+
+# Конечное число; json.load пропускает NaN и Infinity, а bool — подкласс int
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _parse_tiers(order_type_key, mode, tiers):
+    if not isinstance(tiers, (list, tuple)):
+        raise ValueError(f"Ступени цены для {order_type_key} ({mode}) должны быть списком")
+    parsed = []
+    for tier in tiers:
+        if isinstance(tier, dict):
+            days, multiplier = tier.get('days'), tier.get('multiplier')
+        elif isinstance(tier, (list, tuple)) and len(tier) == 2:
+            days, multiplier = tier
+        else:
+            raise ValueError(
+                f"Некорректная ступень цены для {order_type_key} ({mode}): {tier} "
+                f"(нужен объект с полями days и multiplier)"
+            )
+        if (not isinstance(days, int) or isinstance(days, bool) or not 0 <= days <= MAX_TIER_DAYS
+                or not _is_number(multiplier) or multiplier <= 0):
+            raise ValueError(
+                f"Некорректная ступень цены для {order_type_key} ({mode}): {tier} "
+                f"(days — целое от 0 до {MAX_TIER_DAYS}, multiplier — положительное число)"
+            )
+        parsed.append((days, multiplier))
+    return tuple(sorted(parsed))
+
+
+def _compile_tiers(base_price, tiers):
+    if not tiers:
+        return ()
+    by_day = []
+    for days_left in range(tiers[-1][0] + 1):
+        price = base_price
+        for days, multiplier in tiers:
+            if days_left <= days:
+                price = int(base_price * multiplier)
+                break
+        by_day.append(price)
+    return tuple(by_day)
+
+
+def validate_prices(prices):
+    if not isinstance(prices, dict):
+        raise ValueError("Прайс-лист должен быть JSON-объектом")
+    for order_type_key, config in prices.items():
+        base_price = config.get('base') if isinstance(config, dict) else None
+        if not _is_number(base_price) or base_price < 0:
+            raise ValueError(f"Для {order_type_key} нужна неотрицательная цена 'base'")
+        tiers = config.get('tiers', {})
+        if not isinstance(tiers, dict) or set(tiers) - set(MODES):
+            raise ValueError(f"'tiers' для {order_type_key} должен содержать только режимы {', '.join(MODES)}")
+        # Ступени проверяются полностью здесь, чтобы любая ошибка в файле или сообщении
+        # администратора была ValueError с понятным текстом, а не исключением при компиляции
+        for mode, mode_tiers in tiers.items():
+            _parse_tiers(order_type_key, mode, mode_tiers)
+
+
+def validate_version(version):
+    if not isinstance(version, int) or isinstance(version, bool) or version < 0:
+        raise ValueError("'version' должен быть неотрицательным целым числом")
+
+
+_table = PriceTable({}, 'light')
+_watch_task = None
+
+
+def _compile(prices, mode, version):
+    if mode not in MODES:
+        raise ValueError(f"Неизвестный режим ценообразования: {mode}")
+    validate_prices(prices)
+    validate_version(version)
+    return PriceTable(prices, mode, version)
+
+
+# Компиляция и атомарная подмена таблицы. Ошибка в прайс-листе не затрагивает действующую таблицу.
+# Без version номер версии увеличивается на единицу.
+def configure(prices, mode, version=None):
+    global _table
+    if version is None:
+        version = _table.version + 1
+    _table = _compile(prices, mode, version)
+    return _table
+
+
+def current_table():
+    return _table
+
+
+def current_mode():
+    return _table.mode
+
+
+def current_version():
+    return _table.version
+
+
+def get_prices():
+    return _table.prices
+
+
+# Дней до дедлайна по календарным датам. Дедлайн хранится как полночь выбранного дня, и разница
+# с datetime.now() отбрасывала бы текущий день: выбор «через 3 дня» днём давал бы 2 дня.
+def days_until(deadline_date):
+    if isinstance(deadline_date, datetime):
+        deadline_date = deadline_date.date()
+    return (deadline_date - date.today()).days
+
+
+# Стоимость работы с учётом дедлайна. table — снимок таблицы, если вместе с ценой нужна её версия.
+def quote(order_type_key, deadline_date, table=None):
+    return (table or _table).quote(order_type_key, days_until(deadline_date))
+
+
+# Разбор файла конфигурации цен: (прайс-лист, режим, версия).
+# default_mode — режим для файла старого формата, в котором хранился только прайс-лист.
+def parse_config(data, default_mode):
+    if isinstance(data, dict) and 'prices' in data and 'version' in data:
+        prices, mode, version = data['prices'], data.get('mode', default_mode), data['version']
+    else:
+        prices, mode, version = data, default_mode, 0
+    validate_prices(prices)
+    validate_version(version)
+    if mode not in MODES:
+        raise ValueError(f"Неизвестный режим ценообразования: {mode}")
+    return prices, mode, version
+
+
+def load_config(path, default_mode):
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse_config(json.load(f), default_mode)
+
+
+# Запись таблицы в файл конфигурации. Запись атомарная, поэтому другой процесс
+# или фоновая проверка никогда не прочитают файл наполовину записанным.
+def save_config(path, table):
+    fileio.atomic_write(path, json.dumps(
+        {'version': table.version, 'mode': table.mode, 'prices': table.prices}, ensure_ascii=False, indent=4
+    ))
+
+
+# Новая версия цен: прайс-лист и/или режим меняются, остальное берётся из файла.
+# Файл общий для всех процессов бота, поэтому чтение, изменение и запись выполняются под блокировкой:
+# два процесса, меняющие цены одновременно, не получат одну и ту же версию, и ни одно изменение
+# не потеряется. Если другой процесс уже записал более новую версию, изменение применяется к ней.
+# Некорректный прайс-лист не попадает ни в файл, ни в действующую таблицу.
+def update_config(path, prices=None, mode=None):
+    global _table
+    with fileio.file_lock(f"{path}.lock"):
+        base = _table
+        try:
+            disk_prices, disk_mode, disk_version = load_config(path, _table.mode)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            # Испорченный вручную файл заменяется: основой служит действующая таблица
+            logger.warning(f"Файл цен {path} не прочитан ({e}), он будет перезаписан")
+        else:
+            if disk_version >= base.version:
+                base = PriceTable(disk_prices, disk_mode, disk_version)
+        table = _compile(
+            base.prices if prices is None else prices,
+            base.mode if mode is None else mode,
+            max(base.version, _table.version) + 1,
+        )
+        save_config(path, table)
+        _table = table
+    return table
+
+
+# Применение файла конфигурации, если в нём более новая версия.
+# Возвращает новую таблицу или None, если файл совпадает с действующей таблицей.
+def reload_config(path):
+    prices, mode, version = load_config(path, _table.mode)
+    if version == _table.version and prices == _table.prices and mode == _table.mode:
+        return None
+    if version <= _table.version:
+        raise ValueError(f"версия в файле ({version}) должна быть больше действующей ({_table.version})")
+    return configure(prices, mode, version)
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+async def _watch(path, on_reload, interval, on_error):
+    signature = await fileio.run_blocking(_file_signature, path)
+    while True:
+        await asyncio.sleep(interval)
+        current = await fileio.run_blocking(_file_signature, path)
+        if current == signature or current is None:
+            continue
+        try:
+            table = await fileio.run_blocking(reload_config, path)
+        except (OSError, ValueError) as e:
+            # Файл могут ещё дописывать вручную: повторим при следующем изменении
+            logger.warning(f"Файл цен {path} не применён: {e}")
+            signature = current
+            if on_error is not None:
+                await on_error(e)
+            continue
+        signature = current
+        if table is not None:
+            logger.info(f"Применена версия цен {table.version} (режим {table.mode}) из {path}")
+            on_reload(table)
+
+
+# Фоновая проверка файла конфигурации цен; on_reload(table) вызывается после применения новой версии,
+# await on_error(exception) — если изменённый файл не прошёл проверку
+def start_watcher(path, on_reload, interval=WATCH_INTERVAL, on_error=None):
+    global _watch_task
+    if _watch_task is None or _watch_task.done():
+        # Не через application.create_task: Application.stop() ждёт завершения таких задач
+        _watch_task = asyncio.get_running_loop().create_task(_watch(path, on_reload, interval, on_error))
+    return _watch_task
+
+
+async def stop_watcher():
+    global _watch_task
+    if _watch_task is None:
+        return
+    _watch_task.cancel()
+    try:
+        await _watch_task
+    except asyncio.CancelledError:
+        pass
+    _watch_task = None
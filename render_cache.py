@@ -0,0 +1,46 @@
+import logging
+from collections import OrderedDict
+
+# Кэш готовых экранов бота: текст и клавиатура строятся один раз и переиспользуются
+# при каждом нажатии кнопки. Клавиатуры telegram неизменяемы, поэтому их безопасно
+# отдавать разным пользователям. Экраны, зависящие от цен, сбрасываются при изменении цен
+# или режима ценообразования. Для кэша, ключи которого приходят от пользователей (например,
+# год из кнопки календаря), задаётся max_size: при переполнении вытесняется давно не используемый экран.
+
+logger = logging.getLogger(__name__)
+
+
+class RenderCache:
+    def __init__(self, name='экранов', max_size=None):
+        self.name = name
+        self.max_size = max_size
+        self._screens = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # Готовый экран по ключу; render() вызывается только при промахе
+    def get(self, key, render):
+        screen = self._screens.get(key)
+        if screen is None:
+            self.misses += 1
+            screen = self._screens[key] = render()
+            if self.max_size is not None and len(self._screens) > self.max_size:
+                self._screens.popitem(last=False)
+        else:
+            self.hits += 1
+            self._screens.move_to_end(key)
+        return screen
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._screens.clear()
+        else:
+            self._screens.pop(key, None)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'screens': len(self._screens)}
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        hit_rate = self.hits / total * 100 if total else 0.0
+        logger.info(f"Кэш {self.name}: попаданий {self.hits}, промахов {self.misses} ({hit_rate:.1f}% попаданий)")
@@ -0,0 +1,292 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+# Режим шардирования: несколько процессов обработки вместо одного.
+# Входной процесс (run_front) получает обновления от Telegram (polling или webhook) и распределяет
+# их по рабочим процессам по user_id: все обновления одного пользователя попадают в один процесс
+# и передаются в нём в порядке поступления, поэтому состояние диалога, user_data и порядок
+# обработки остаются такими же, как в обычном режиме.
+# Рабочий процесс (run_worker) — обычное приложение из bot.py без собственного получения обновлений.
+#
+# Общее состояние (заказы, пользователи, рефералы, режим ценообразования, очередь задач) хранится
+# в общей базе SQLite, прайс-лист — в общем prices.json. Об изменениях процессы сообщают друг другу
+# событиями: publish('pricing') в одном процессе вызывает обработчики subscribe('pricing', ...)
+# во всех остальных. События и обновления идут через входной процесс по одному TCP-соединению
+# на рабочий процесс (только 127.0.0.1), по строке JSON на сообщение.
+#
+# Фоновые задачи (jobs.py) и рассылки (broadcast.py) выполняет только рабочий процесс 0,
+# остальные будят его событиями 'jobs' и 'broadcast'. Поэтому массовые отправки всех процессов
+# проходят через один ограничитель скорости; ответы на обновления пользователей идут из своих процессов.
+
+logger = logging.getLogger(__name__)
+
+# Сколько сообщений может ждать отправки в один рабочий процесс
+SHARD_QUEUE_SIZE = 10000
+# Пауза перед перезапуском упавшего рабочего процесса, секунд
+RESTART_DELAY = 5
+# Сколько ждать завершения рабочих процессов при остановке, секунд
+STOP_TIMEOUT = 30
+
+# Переменные окружения, через которые входной процесс передаёт рабочему его номер и адрес
+ENV_SHARD_INDEX = 'GIPSR_SHARD_INDEX'
+ENV_SHARD_COUNT = 'GIPSR_SHARD_COUNT'
+ENV_FRONT_PORT = 'GIPSR_FRONT_PORT'
+
+# Номер текущего рабочего процесса (None — обычный режим без шардирования)
+shard_index = int(os.environ[ENV_SHARD_INDEX]) if ENV_SHARD_INDEX in os.environ else None
+
+_subscribers = {}
+_front_writer = None
+
+
+def is_worker():
+    return shard_index is not None
+
+
+# Процесс, который выполняет общие для всех фоновые работы: единственный процесс в обычном режиме
+# или рабочий процесс 0
+def is_primary():
+    return shard_index in (None, 0)
+
+
+def shard_for(update, shard_count):
+    user = update.effective_user
+    chat = update.effective_chat
+    key = user.id if user is not None else chat.id if chat is not None else 0
+    return key % shard_count
+
+
+def _encode(message):
+    return (json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+# События между процессами
+
+def subscribe(event, callback):
+    _subscribers.setdefault(event, []).append(callback)
+
+
+# Сообщить остальным процессам об изменении. В обычном режиме ничего не делает.
+def publish(event):
+    if _front_writer is None or _front_writer.is_closing():
+        return
+    _front_writer.write(_encode({'event': event}))
+
+
+async def _dispatch(event):
+    for callback in _subscribers.get(event, ()):
+        try:
+            result = callback()
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            logger.error(f"Ошибка обработки события {event}: {e}")
+
+
+# SIGTERM завершает процесс так же аккуратно, как Ctrl+C (на Windows сигнала нет)
+def _cancel_on_sigterm():
+    if sys.platform != 'win32':
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+
+# Рабочий процесс
+
+async def run_worker(application, port):
+    global _front_writer
+    _cancel_on_sigterm()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(_encode({'shard': shard_index}))
+    await writer.drain()
+    _front_writer = writer
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    # Пока процесс не был подключён, он мог пропустить события — перечитываем общее состояние
+    for event in _subscribers:
+        await _dispatch(event)
+    logger.info(f"Рабочий процесс {shard_index} запущен")
+    try:
+        # Входной процесс закрывает соединение при остановке бота
+        while line := await reader.readline():
+            message = json.loads(line)
+            if 'update' in message:
+                await application.update_queue.put(Update.de_json(message['update'], application.bot))
+            elif 'event' in message:
+                await _dispatch(message['event'])
+    finally:
+        _front_writer = None
+        writer.close()
+        # Обновления, уже полученные процессом, обрабатываются до остановки
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        logger.info(f"Рабочий процесс {shard_index} остановлен")
+
+
+# Входной процесс
+
+class _Shard:
+    def __init__(self, index):
+        self.index = index
+        self.queue = asyncio.Queue(SHARD_QUEUE_SIZE)
+        self.writer = None
+        self.connected = asyncio.Event()
+        self.process = None
+
+    # Сообщения отправляются строго по очереди; при обрыве соединения неотправленное сообщение
+    # ждёт перезапуска процесса
+    async def send_loop(self):
+        while True:
+            data = await self.queue.get()
+            while True:
+                await self.connected.wait()
+                writer = self.writer
+                if writer is None or writer.is_closing():
+                    self.connected.clear()
+                    continue
+                try:
+                    writer.write(data)
+                    await writer.drain()
+                    break
+                except ConnectionError:
+                    self.connected.clear()
+            self.queue.task_done()
+
+    # Ожидание доставки очереди, пока процесс подключён, но не дольше timeout
+    async def drain(self, timeout):
+        joined = asyncio.ensure_future(self.queue.join())
+        deadline = asyncio.get_running_loop().time() + timeout
+        try:
+            while not joined.done() and self.connected.is_set():
+                if asyncio.get_running_loop().time() > deadline:
+                    break
+                await asyncio.wait({joined}, timeout=0.1)
+        finally:
+            joined.cancel()
+        return self.queue.empty()
+
+
+class Front:
+    def __init__(self, shard_count, worker_command):
+        self.shards = [_Shard(index) for index in range(shard_count)]
+        self.worker_command = worker_command
+        self.stopping = False
+        self.server = None
+        self.tasks = []
+
+    async def _handle_worker(self, reader, writer):
+        try:
+            hello = json.loads(await reader.readline())
+            shard = self.shards[hello['shard']]
+        except (ValueError, KeyError, IndexError, TypeError):
+            writer.close()
+            return
+        shard.writer = writer
+        shard.connected.set()
+        try:
+            while line := await reader.readline():
+                # Событие рабочего процесса пересылается всем остальным
+                if 'event' in json.loads(line):
+                    for other in self.shards:
+                        if other is not shard:
+                            await other.queue.put(line)
+        except ConnectionError:
+            pass
+        finally:
+            if shard.writer is writer:
+                shard.connected.clear()
+                shard.writer = None
+            writer.close()
+
+    async def _supervise(self, shard, port):
+        env = {
+            **os.environ,
+            ENV_SHARD_INDEX: str(shard.index),
+            ENV_SHARD_COUNT: str(len(self.shards)),
+            ENV_FRONT_PORT: str(port),
+        }
+        while not self.stopping:
+            shard.process = await asyncio.create_subprocess_exec(*self.worker_command, env=env)
+            return_code = await shard.process.wait()
+            if self.stopping:
+                break
+            logger.error(
+                f"Рабочий процесс {shard.index} завершился с кодом {return_code}, "
+                f"перезапуск через {RESTART_DELAY} с"
+            )
+            await asyncio.sleep(RESTART_DELAY)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle_worker, '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        for shard in self.shards:
+            self.tasks.append(asyncio.create_task(shard.send_loop()))
+            self.tasks.append(asyncio.create_task(self._supervise(shard, port)))
+        logger.info(f"Запущено рабочих процессов: {len(self.shards)}")
+
+    async def route(self, update):
+        shard = self.shards[shard_for(update, len(self.shards))]
+        await shard.queue.put(_encode({'update': update.to_dict()}))
+
+    async def stop(self):
+        # Сначала доставляем уже полученные обновления, затем закрываем соединения:
+        # рабочие процессы обрабатывают свои очереди и завершаются сами
+        self.stopping = True
+        for shard in self.shards:
+            if not await shard.drain(STOP_TIMEOUT):
+                logger.warning(f"Рабочий процесс {shard.index}: не доставлено сообщений: {shard.queue.qsize()}")
+        for shard in self.shards:
+            if shard.writer is not None:
+                shard.writer.close()
+        for shard in self.shards:
+            if shard.process is None or shard.process.returncode is not None:
+                continue
+            try:
+                await asyncio.wait_for(shard.process.wait(), STOP_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warning(f"Рабочий процесс {shard.index} не завершился вовремя и будет остановлен")
+                shard.process.kill()
+                await shard.process.wait()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.server.close()
+        await self.server.wait_closed()
+
+
+# Входной процесс: получение обновлений и распределение по shard_count рабочим процессам.
+# webhook — параметры Updater.start_webhook или None для long polling.
+async def run_front(token, shard_count, webhook=None, worker_command=None):
+    front = Front(shard_count, worker_command or [sys.executable, os.path.abspath(sys.argv[0])])
+    update_queue = asyncio.Queue()
+    updater = Updater(Bot(token), update_queue)
+    _cancel_on_sigterm()
+    await front.start()
+    try:
+        await updater.initialize()
+        if webhook is not None:
+            await updater.start_webhook(**webhook)
+        else:
+            await updater.start_polling()
+        while True:
+            await front.route(await update_queue.get())
+    finally:
+        if updater.running:
+            await updater.stop()
+        await updater.shutdown()
+        # Обновления, полученные до остановки Updater, тоже распределяются
+        while not update_queue.empty():
+            await front.route(update_queue.get_nowait())
+        await front.stop()
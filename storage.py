@@ -0,0 +1,950 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# Хранилище данных бота на SQLite: заказы, пользователи и рефералы.
+# Подтверждение заказа — это одна вставка в конец журнала (append-only),
+# стоимость которой не зависит от количества уже сохранённых заказов.
+# orders.xlsx больше не переписывается при каждом заказе, а строится из журнала по запросу.
+# Все выборки в обработчиках идут по индексам, поэтому после перезапуска
+# ничего не нужно восстанавливать вручную.
+
+DB_FILENAME = 'gipsr.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    username TEXT,
+    first_name TEXT,
+    order_type TEXT,
+    topic TEXT,
+    deadline TEXT,
+    supervisor TEXT,
+    practice_base TEXT,
+    plan TEXT,
+    price INTEGER,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    deleted INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    referrer_id INTEGER,
+    created_at TEXT NOT NULL
+);
+
+-- Счётчики рефералов обновляются вместе с записью реферера в users
+CREATE TABLE IF NOT EXISTS referral_counts (
+    referrer_id INTEGER PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS feedbacks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    user_key TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+
+-- Состояние диалогов и данные пользователей для persistence.py (значения сериализованы pickle)
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS bot_data (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    data BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state BLOB NOT NULL,
+    PRIMARY KEY (name, key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    text TEXT NOT NULL,
+    report_chat_id INTEGER,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    finished_at TEXT
+);
+
+-- state: 0 — ожидает отправки, 1 — доставлено, 2 — ошибка
+CREATE TABLE IF NOT EXISTS broadcast_recipients (
+    broadcast_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    state INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (broadcast_id, user_id)
+) WITHOUT ROWID;
+
+-- Файлы планов хранятся один раз по SHA-256 содержимого (см. uploads.py)
+CREATE TABLE IF NOT EXISTS plan_files (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mime_type TEXT,
+    created_at TEXT NOT NULL
+) WITHOUT ROWID;
+
+-- file_unique_id Telegram -> содержимое: повторно присланный файл не скачивается
+CREATE TABLE IF NOT EXISTS plan_file_ids (
+    file_unique_id TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+) WITHOUT ROWID;
+
+-- Очередь фоновых задач (см. jobs.py). run_at — время запуска в секундах эпохи.
+-- Выполненные задачи удаляются, задачи с исчерпанными попытками остаются со статусом failed.
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_at REAL NOT NULL,
+    last_error TEXT,
+    created_at TEXT NOT NULL
+);
+
+-- Настройки бота, общие для всех процессов (значения в JSON)
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Индексы создаются после миграций, т.к. могут ссылаться на новые колонки
+INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_user_order ON orders (user_id, order_id);
+CREATE INDEX IF NOT EXISTS idx_orders_order_id ON orders (order_id);
+CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status);
+CREATE INDEX IF NOT EXISTS idx_orders_order_type ON orders (order_type);
+CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at);
+CREATE INDEX IF NOT EXISTS idx_users_referrer ON users (referrer_id);
+CREATE INDEX IF NOT EXISTS idx_referral_counts_count ON referral_counts (count DESC);
+CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts (status);
+CREATE INDEX IF NOT EXISTS idx_feedbacks_user_key ON feedbacks (user_key);
+CREATE INDEX IF NOT EXISTS idx_orders_plan_sha256 ON orders (plan_sha256);
+CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (status, run_at);
+"""
+
+# Полнотекстовый индекс заказов и отзывов для поиска администратором (SQLite FTS5).
+# Таблицы индекса хранят только токены (external content), тексты остаются в orders и feedbacks.
+# Индекс обновляется триггерами в той же транзакции, что и сами данные; смена статуса
+# или номера заказа индекс не трогает. Индексы префиксов ускоряют поиск по началу слова.
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+    topic, supervisor, practice_base, plan, first_name, username,
+    content='orders', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS orders_fts_insert AFTER INSERT ON orders BEGIN
+    INSERT INTO orders_fts (rowid, topic, supervisor, practice_base, plan, first_name, username)
+    VALUES (new.id, new.topic, new.supervisor, new.practice_base, new.plan, new.first_name, new.username);
+END;
+CREATE TRIGGER IF NOT EXISTS orders_fts_delete AFTER DELETE ON orders BEGIN
+    INSERT INTO orders_fts (orders_fts, rowid, topic, supervisor, practice_base, plan, first_name, username)
+    VALUES ('delete', old.id, old.topic, old.supervisor, old.practice_base, old.plan, old.first_name, old.username);
+END;
+CREATE TRIGGER IF NOT EXISTS orders_fts_update
+AFTER UPDATE OF topic, supervisor, practice_base, plan, first_name, username ON orders BEGIN
+    INSERT INTO orders_fts (orders_fts, rowid, topic, supervisor, practice_base, plan, first_name, username)
+    VALUES ('delete', old.id, old.topic, old.supervisor, old.practice_base, old.plan, old.first_name, old.username);
+    INSERT INTO orders_fts (rowid, topic, supervisor, practice_base, plan, first_name, username)
+    VALUES (new.id, new.topic, new.supervisor, new.practice_base, new.plan, new.first_name, new.username);
+END;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS feedbacks_fts USING fts5(
+    text, user_key,
+    content='feedbacks', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS feedbacks_fts_insert AFTER INSERT ON feedbacks BEGIN
+    INSERT INTO feedbacks_fts (rowid, text, user_key) VALUES (new.id, new.text, new.user_key);
+END;
+CREATE TRIGGER IF NOT EXISTS feedbacks_fts_delete AFTER DELETE ON feedbacks BEGIN
+    INSERT INTO feedbacks_fts (feedbacks_fts, rowid, text, user_key) VALUES ('delete', old.id, old.text, old.user_key);
+END;
+"""
+# Таблицы полнотекстового индекса
+SEARCH_TABLES = ('orders_fts', 'feedbacks_fts')
+# Максимальное количество слов в поисковом запросе
+SEARCH_MAX_TERMS = 8
+
+# Колонки, добавленные в таблицы после первой версии схемы
+MIGRATIONS = {
+    'orders': {
+        'deleted': 'INTEGER NOT NULL DEFAULT 0',
+        'plan_sha256': 'TEXT',
+        # Версия цен (pricing.py), по которой рассчитана стоимость
+        'price_version': 'INTEGER',
+        # Номер заказа из старого orders.xlsx (нумерация была своя у каждого пользователя)
+        'legacy_order_id': 'INTEGER',
+    },
+}
+
+# Колонки Excel-выгрузки (совпадают с прежним форматом orders.xlsx)
+EXCEL_COLUMNS = ['ID заказа', 'Дата', 'Пользователь', 'ID', 'Тип работы', 'Тема', 'Сроки', 'Стоимость', 'Статус']
+
+# Верхняя граница для keyset-пагинации (максимальное значение INTEGER PRIMARY KEY)
+MAX_ID = 2 ** 63 - 1
+
+_db_path = None
+_conn = None
+_lock = threading.RLock()
+
+
+# Указываем директорию, в которой будет лежать файл базы данных
+def init(data_dir):
+    global _db_path
+    os.makedirs(data_dir, exist_ok=True)
+    _db_path = os.path.join(data_dir, DB_FILENAME)
+
+
+# Соединение открывается лениво, при первом обращении к хранилищу
+def get_connection():
+    global _conn
+    if _conn is None:
+        with _lock:
+            if _conn is None:
+                if _db_path is None:
+                    raise RuntimeError("Хранилище не инициализировано: вызовите storage.init()")
+                conn = sqlite3.connect(_db_path, check_same_thread=False)
+                conn.row_factory = sqlite3.Row
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+                conn.executescript(SCHEMA)
+                _migrate(conn)
+                conn.executescript(INDEXES)
+                _init_search(conn)
+                _conn = conn
+    return _conn
+
+
+def _migrate(conn):
+    for table, columns in MIGRATIONS.items():
+        existing = {row['name'] for row in conn.execute(f'PRAGMA table_info({table})')}
+        for column, definition in columns.items():
+            if column not in existing:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+                if (table, column) == ('orders', 'legacy_order_id'):
+                    _renumber_legacy_orders(conn)
+    # Заполнение счётчиков рефералов для базы, созданной до их появления
+    if conn.execute('SELECT 1 FROM referral_counts LIMIT 1').fetchone() is None:
+        conn.execute(
+            'INSERT INTO referral_counts (referrer_id, count) '
+            'SELECT referrer_id, COUNT(*) FROM users WHERE referrer_id IS NOT NULL GROUP BY referrer_id'
+        )
+    conn.commit()
+
+
+# Создание полнотекстового индекса. Для базы, созданной до его появления, индекс
+# один раз строится по уже сохранённым заказам и отзывам.
+def _init_search(conn):
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.executescript(SEARCH_SCHEMA)
+    for table in SEARCH_TABLES:
+        if table not in existing:
+            conn.execute(f"INSERT INTO {table} ({table}) VALUES ('rebuild')")
+    conn.commit()
+
+
+def close():
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+# Добавление заказа в журнал. Номер заказа берётся из AUTOINCREMENT-счётчика журнала
+# в той же транзакции: он глобально уникален, монотонно растёт и не переиспользуется
+# после удаления заказа. Этот же номер используется в имени txt-файла и в Excel-выгрузке.
+# jobs — фоновые задачи (kind, payload), которые ставятся в очередь в той же транзакции;
+# в payload добавляется order_id. Возвращает номер заказа.
+def append_order(order, jobs=()):
+    conn = get_connection()
+    with _lock, conn:
+        cursor = conn.execute(
+            """
+            INSERT INTO orders (
+                order_id, user_id, username, first_name, order_type, topic, deadline,
+                supervisor, practice_base, plan, plan_sha256, price, price_version, status, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                0,
+                order['user_id'],
+                order.get('username'),
+                order.get('first_name'),
+                order.get('type'),
+                order.get('topic'),
+                _format_date(order.get('deadline')),
+                order.get('supervisor'),
+                order.get('practice_base'),
+                order.get('plan'),
+                order.get('plan_sha256'),
+                order.get('price'),
+                order.get('price_version'),
+                order['status'],
+                order['date'].strftime('%Y-%m-%d %H:%M:%S'),
+            )
+        )
+        order_id = cursor.lastrowid
+        conn.execute('UPDATE orders SET order_id = ? WHERE id = ?', (order_id, order_id))
+        for kind, payload in jobs:
+            _insert_job(conn, kind, {**payload, 'order_id': order_id} if payload is not None else None)
+        return order_id
+
+
+def count_orders():
+    conn = get_connection()
+    with _lock:
+        return conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0]
+
+
+# Обход журнала страницами по batch_size записей (keyset по id), чтобы выгрузка любого
+# размера занимала ограниченную память и не держала блокировку хранилища.
+# date_from и date_to — строки 'ГГГГ-ММ-ДД' (включительно), order_type — часть названия типа работы.
+def iter_orders(date_from=None, date_to=None, status=None, order_type=None, batch_size=1000):
+    conditions, params = ['id > ?'], []
+    if date_from:
+        conditions.append('created_at >= ?')
+        params.append(date_from)
+    if date_to:
+        # created_at хранится как 'ГГГГ-ММ-ДД ЧЧ:ММ:СС', поэтому граница — конец дня
+        conditions.append('created_at <= ?')
+        params.append(f"{date_to} 23:59:59")
+    if status:
+        conditions.append('status = ?')
+        params.append(status)
+    if order_type:
+        conditions.append('order_type LIKE ?')
+        params.append(f"%{order_type}%")
+    query = f"SELECT * FROM orders WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?"
+
+    conn = get_connection()
+    last_id = 0
+    while True:
+        with _lock:
+            rows = conn.execute(query, (last_id, *params, batch_size)).fetchall()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]['id']
+
+
+# Заказы пользователя (без удалённых), по индексу user_id
+def get_user_orders(user_id):
+    conn = get_connection()
+    with _lock:
+        return conn.execute(
+            'SELECT * FROM orders WHERE user_id = ? AND deleted = 0 ORDER BY order_id',
+            (user_id,)
+        ).fetchall()
+
+
+def get_order_by_id(order_id):
+    conn = get_connection()
+    with _lock:
+        return conn.execute('SELECT * FROM orders WHERE id = ?', (order_id,)).fetchone()
+
+
+# Страница заказов для админ-панели, от новых к старым, с фильтрами по статусу, типу работы
+# и дате создания (date_from — строка 'ГГГГ-ММ-ДД'). Курсор — id заказа: before_id для следующей
+# (более старой) страницы, after_id для предыдущей. Каждое условие обслуживается индексом, который
+# включает id, поэтому стоимость страницы не зависит от количества заказов.
+# Возвращает (заказы, есть ли более старые, есть ли более новые).
+def get_orders_page(limit, before_id=None, after_id=None, status=None, order_type=None, date_from=None):
+    conditions, params = ['deleted = 0'], []
+    if status:
+        conditions.append('status = ?')
+        params.append(status)
+    if order_type:
+        conditions.append('order_type = ?')
+        params.append(order_type)
+    if date_from:
+        conditions.append('created_at >= ?')
+        params.append(date_from)
+    where = ' AND '.join(conditions)
+
+    conn = get_connection()
+    with _lock:
+        if after_id is not None:
+            rows = conn.execute(
+                f'SELECT * FROM orders WHERE {where} AND id > ? ORDER BY id ASC LIMIT ?',
+                (*params, after_id, limit + 1)
+            ).fetchall()
+            has_newer = len(rows) > limit
+            rows = rows[:limit][::-1]
+            has_older = bool(rows) and conn.execute(
+                f'SELECT 1 FROM orders WHERE {where} AND id < ? LIMIT 1', (*params, rows[-1]['id'])
+            ).fetchone() is not None
+        else:
+            rows = conn.execute(
+                f'SELECT * FROM orders WHERE {where} AND id < ? ORDER BY id DESC LIMIT ?',
+                (*params, before_id if before_id is not None else MAX_ID, limit + 1)
+            ).fetchall()
+            has_older = len(rows) > limit
+            rows = rows[:limit]
+            has_newer = bool(rows) and conn.execute(
+                f'SELECT 1 FROM orders WHERE {where} AND id > ? LIMIT 1', (*params, rows[0]['id'])
+            ).fetchone() is not None
+    return rows, has_older, has_newer
+
+
+# Статусы, встречающиеся в журнале (по индексу статусов)
+def get_order_statuses():
+    conn = get_connection()
+    with _lock:
+        return [row['status'] for row in conn.execute('SELECT DISTINCT status FROM orders ORDER BY status')]
+
+
+# Обновление статусов заказов одной транзакцией: updates — список (user_id, order_id, статус).
+# Каждый заказ находится по уникальному индексу (user_id, order_id).
+# notify_kind — тип фоновой задачи, которая ставится по одной на пользователя с payload
+# {'user_id': ..., 'updates': [[order_id, статус], ...]}.
+# Возвращает (применённые обновления, обновления для ненайденных заказов).
+def update_order_statuses(updates, notify_kind=None):
+    applied, missing = [], []
+    per_user = {}
+    conn = get_connection()
+    with _lock, conn:
+        for user_id, order_id, status in updates:
+            cursor = conn.execute(
+                'UPDATE orders SET status = ? WHERE user_id = ? AND order_id = ? AND deleted = 0',
+                (status, user_id, order_id)
+            )
+            if cursor.rowcount:
+                applied.append((user_id, order_id, status))
+                per_user.setdefault(user_id, []).append([order_id, status])
+            else:
+                missing.append((user_id, order_id, status))
+        if notify_kind:
+            for user_id, user_updates in per_user.items():
+                _insert_job(conn, notify_kind, {'user_id': user_id, 'updates': user_updates})
+    return applied, missing
+
+
+# Удаление заказа пользователем. Запись остаётся в журнале и в Excel-выгрузке,
+# но больше не показывается в профиле. Возвращает True, если заказ найден.
+def delete_order(user_id, order_id):
+    conn = get_connection()
+    with _lock, conn:
+        cursor = conn.execute(
+            'UPDATE orders SET deleted = 1 WHERE user_id = ? AND order_id = ? AND deleted = 0',
+            (user_id, order_id)
+        )
+        return cursor.rowcount > 0
+
+
+# Регистрация пользователя. Реферер запоминается только при первом приглашении.
+# Возвращает True, если реферер был записан этим вызовом.
+def register_user(user_id, username, first_name, referrer_id=None):
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute(
+            """
+            INSERT INTO users (user_id, username, first_name, created_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET username = excluded.username, first_name = excluded.first_name
+            """,
+            (user_id, username, first_name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        if referrer_id is None:
+            return False
+        cursor = conn.execute(
+            'UPDATE users SET referrer_id = ? WHERE user_id = ? AND referrer_id IS NULL',
+            (referrer_id, user_id)
+        )
+        if cursor.rowcount == 0:
+            return False
+        conn.execute(
+            'INSERT INTO referral_counts (referrer_id, count) VALUES (?, 1) '
+            'ON CONFLICT (referrer_id) DO UPDATE SET count = count + 1',
+            (referrer_id,)
+        )
+        return True
+
+
+# Количество рефералов — одно чтение по первичному ключу
+def count_referrals(referrer_id):
+    conn = get_connection()
+    with _lock:
+        row = conn.execute('SELECT count FROM referral_counts WHERE referrer_id = ?', (referrer_id,)).fetchone()
+    return row[0] if row else 0
+
+
+# Рейтинг пользователей по количеству приглашённых
+def get_referral_leaderboard(limit):
+    conn = get_connection()
+    with _lock:
+        return conn.execute(
+            '''
+            SELECT rc.referrer_id, rc.count, u.username, u.first_name
+            FROM referral_counts rc LEFT JOIN users u ON u.user_id = rc.referrer_id
+            ORDER BY rc.count DESC, rc.referrer_id LIMIT ?
+            ''',
+            (limit,)
+        ).fetchall()
+
+
+# Дерево рефералов в текстовом виде: пользователи, пришедшие сами, и все приглашённые ими по цепочке
+def export_referral_tree():
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute(
+            'SELECT user_id, username, first_name, referrer_id FROM users '
+            'WHERE referrer_id IS NOT NULL OR user_id IN (SELECT referrer_id FROM referral_counts)'
+        ).fetchall()
+        counts = dict(conn.execute('SELECT referrer_id, count FROM referral_counts').fetchall())
+
+    names = {}
+    children = {}
+    has_referrer = set()
+    for row in rows:
+        names[row['user_id']] = f"@{row['username']}" if row['username'] else row['first_name']
+        if row['referrer_id'] is not None:
+            children.setdefault(row['referrer_id'], []).append(row['user_id'])
+            has_referrer.add(row['user_id'])
+
+    lines = []
+    visited = set()
+
+    def walk(user_id, depth):
+        if user_id in visited:
+            return
+        visited.add(user_id)
+        lines.append(f"{'    ' * depth}{names.get(user_id, '?')} (ID {user_id}), приглашено: {counts.get(user_id, 0)}")
+        for child_id in sorted(children.get(user_id, [])):
+            walk(child_id, depth + 1)
+
+    roots = sorted(set(children) - has_referrer)
+    for root_id in roots:
+        walk(root_id, 0)
+    # Пользователи, замкнутые в цикл приглашений, не имеют корня — выводим их отдельно
+    for referrer_id in sorted(children):
+        walk(referrer_id, 0)
+    return '\n'.join(lines)
+
+
+# Только для миграции: режим цен раньше хранился в таблице settings, теперь он в prices.json
+# (см. bot.load_legacy_pricing_mode). Новые значения в settings не записываются.
+def get_setting(key, default=None):
+    conn = get_connection()
+    with _lock:
+        row = conn.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+
+# Индекс отзывов. Отзывы только добавляются, а страницы выбираются по первичному ключу
+# (keyset-пагинация), поэтому стоимость страницы не зависит от общего числа отзывов.
+def add_feedback(user_id, user_key, text, created_at=None):
+    created_at = created_at or datetime.now()
+    conn = get_connection()
+    with _lock, conn:
+        cursor = conn.execute(
+            'INSERT INTO feedbacks (user_id, user_key, text, created_at) VALUES (?, ?, ?, ?)',
+            (user_id, user_key, text, created_at.strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        return cursor.lastrowid
+
+
+# Страница отзывов от новых к старым. before_id — показать отзывы старше указанного,
+# after_id — новее указанного. Возвращает (отзывы, есть_старше, есть_новее).
+def get_feedback_page(limit, before_id=None, after_id=None):
+    conn = get_connection()
+    with _lock:
+        if after_id is not None:
+            rows = conn.execute(
+                'SELECT * FROM feedbacks WHERE id > ? ORDER BY id ASC LIMIT ?',
+                (after_id, limit + 1)
+            ).fetchall()
+            has_newer = len(rows) > limit
+            rows = rows[:limit][::-1]
+            has_older = bool(rows) and conn.execute(
+                'SELECT 1 FROM feedbacks WHERE id < ? LIMIT 1', (rows[-1]['id'],)
+            ).fetchone() is not None
+        else:
+            rows = conn.execute(
+                'SELECT * FROM feedbacks WHERE id < ? ORDER BY id DESC LIMIT ?',
+                (before_id if before_id is not None else MAX_ID, limit + 1)
+            ).fetchall()
+            has_older = len(rows) > limit
+            rows = rows[:limit]
+            has_newer = bool(rows) and conn.execute(
+                'SELECT 1 FROM feedbacks WHERE id > ? LIMIT 1', (rows[0]['id'],)
+            ).fetchone() is not None
+    return rows, has_older, has_newer
+
+
+# Запрос FTS5 из текста администратора: каждое слово ищется по началу, должны встретиться все слова.
+# Операторы и спецсимволы FTS5 из текста в запрос не попадают.
+def _search_query(text):
+    words = re.findall(r'\w+', text.lower())[:SEARCH_MAX_TERMS]
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+# Полнотекстовый поиск по заказам (тема, руководитель, база практики, план, имя клиента)
+# и отзывам. Результаты упорядочены по релевантности (bm25, совпадения в теме и имени весят больше).
+# Возвращает (заказы, отзывы); у каждой строки есть колонка snippet с фрагментом совпадения.
+def search(text, limit):
+    query = _search_query(text)
+    if not query:
+        return [], []
+    conn = get_connection()
+    with _lock:
+        orders = conn.execute(
+            """
+            SELECT o.*, snippet(orders_fts, -1, '«', '»', '…', 12) AS snippet
+            FROM orders_fts JOIN orders o ON o.id = orders_fts.rowid
+            WHERE orders_fts MATCH ? AND o.deleted = 0
+            ORDER BY bm25(orders_fts, 3.0, 1.0, 1.0, 1.0, 2.0, 2.0)
+            LIMIT ?
+            """,
+            (query, limit)
+        ).fetchall()
+        feedbacks = conn.execute(
+            """
+            SELECT f.*, snippet(feedbacks_fts, 0, '«', '»', '…', 16) AS snippet
+            FROM feedbacks_fts JOIN feedbacks f ON f.id = feedbacks_fts.rowid
+            WHERE feedbacks_fts MATCH ?
+            ORDER BY bm25(feedbacks_fts)
+            LIMIT ?
+            """,
+            (query, limit)
+        ).fetchall()
+    return orders, feedbacks
+
+
+# Однократный перенос отзывов, сохранённых файлами в feedbacks/<пользователь>/ до появления индекса
+def import_feedback_files(feedbacks_dir):
+    conn = get_connection()
+    with _lock:
+        if conn.execute('SELECT 1 FROM feedbacks LIMIT 1').fetchone() is not None:
+            return 0
+    if not os.path.isdir(feedbacks_dir):
+        return 0
+    records = []
+    for user_key in os.listdir(feedbacks_dir):
+        user_feedback_dir = os.path.join(feedbacks_dir, user_key)
+        if not os.path.isdir(user_feedback_dir):
+            continue
+        for feedback_file in os.listdir(user_feedback_dir):
+            feedback_path = os.path.join(user_feedback_dir, feedback_file)
+            with open(feedback_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            created_at = datetime.fromtimestamp(os.path.getmtime(feedback_path))
+            records.append((created_at, user_key, text))
+    records.sort()
+    with _lock, conn:
+        conn.executemany(
+            'INSERT INTO feedbacks (user_key, text, created_at) VALUES (?, ?, ?)',
+            [(user_key, text, created_at.strftime('%Y-%m-%d %H:%M:%S')) for created_at, user_key, text in records]
+        )
+    return len(records)
+
+
+# Данные для persistence.py. Запись выполняется одним пакетом за проход обновления.
+def load_user_data():
+    conn = get_connection()
+    with _lock:
+        return conn.execute('SELECT user_id, data FROM user_data').fetchall()
+
+
+def load_bot_data():
+    conn = get_connection()
+    with _lock:
+        row = conn.execute('SELECT data FROM bot_data WHERE id = 1').fetchone()
+    return row[0] if row else None
+
+
+def load_conversations(name):
+    conn = get_connection()
+    with _lock:
+        return conn.execute('SELECT key, state FROM conversations WHERE name = ?', (name,)).fetchall()
+
+
+# user_data: {user_id: bytes или None для удаления}, bot_data: bytes или None (без изменений),
+# conversations: {(name, key): bytes или None для завершённого диалога}
+def save_persistence_batch(user_data, bot_data, conversations):
+    conn = get_connection()
+    with _lock, conn:
+        conn.executemany(
+            'INSERT INTO user_data (user_id, data) VALUES (?, ?) '
+            'ON CONFLICT (user_id) DO UPDATE SET data = excluded.data',
+            [(user_id, data) for user_id, data in user_data.items() if data is not None]
+        )
+        conn.executemany(
+            'DELETE FROM user_data WHERE user_id = ?',
+            [(user_id,) for user_id, data in user_data.items() if data is None]
+        )
+        if bot_data is not None:
+            conn.execute(
+                'INSERT INTO bot_data (id, data) VALUES (1, ?) ON CONFLICT (id) DO UPDATE SET data = excluded.data',
+                (bot_data,)
+            )
+        conn.executemany(
+            'INSERT INTO conversations (name, key, state) VALUES (?, ?, ?) '
+            'ON CONFLICT (name, key) DO UPDATE SET state = excluded.state',
+            [(name, key, state) for (name, key), state in conversations.items() if state is not None]
+        )
+        conn.executemany(
+            'DELETE FROM conversations WHERE name = ? AND key = ?',
+            [(name, key) for (name, key), state in conversations.items() if state is None]
+        )
+
+
+# Рассылки. Получатели фиксируются при создании рассылки, а состояние доставки
+# сохраняется пачками, поэтому прерванную рассылку можно продолжить после перезапуска.
+BROADCAST_PENDING = 0
+BROADCAST_SENT = 1
+BROADCAST_FAILED = 2
+
+
+def create_broadcast(text, report_chat_id):
+    conn = get_connection()
+    with _lock, conn:
+        cursor = conn.execute(
+            "INSERT INTO broadcasts (text, report_chat_id, status, created_at) VALUES (?, ?, 'running', ?)",
+            (text, report_chat_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        broadcast_id = cursor.lastrowid
+        total = conn.execute(
+            'INSERT INTO broadcast_recipients (broadcast_id, user_id) SELECT ?, user_id FROM users',
+            (broadcast_id,)
+        ).rowcount
+        conn.execute('UPDATE broadcasts SET total = ? WHERE id = ?', (total, broadcast_id))
+        return broadcast_id
+
+
+def get_broadcast(broadcast_id):
+    conn = get_connection()
+    with _lock:
+        return conn.execute('SELECT * FROM broadcasts WHERE id = ?', (broadcast_id,)).fetchone()
+
+
+def get_running_broadcasts():
+    conn = get_connection()
+    with _lock:
+        return conn.execute("SELECT * FROM broadcasts WHERE status = 'running' ORDER BY id").fetchall()
+
+
+# Следующая порция получателей, ещё не получивших сообщение (по возрастанию user_id)
+def get_pending_recipients(broadcast_id, after_user_id, limit):
+    conn = get_connection()
+    with _lock:
+        return [row[0] for row in conn.execute(
+            'SELECT user_id FROM broadcast_recipients WHERE broadcast_id = ? AND state = 0 AND user_id > ? '
+            'ORDER BY user_id LIMIT ?',
+            (broadcast_id, after_user_id, limit)
+        )]
+
+
+# Сохранение результатов доставки одной транзакцией: results — список (user_id, state)
+def mark_recipients(broadcast_id, results):
+    if not results:
+        return
+    sent = sum(1 for _, state in results if state == BROADCAST_SENT)
+    conn = get_connection()
+    with _lock, conn:
+        conn.executemany(
+            'UPDATE broadcast_recipients SET state = ? WHERE broadcast_id = ? AND user_id = ?',
+            [(state, broadcast_id, user_id) for user_id, state in results]
+        )
+        conn.execute(
+            'UPDATE broadcasts SET sent = sent + ?, failed = failed + ? WHERE id = ?',
+            (sent, len(results) - sent, broadcast_id)
+        )
+
+
+def finish_broadcast(broadcast_id):
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute(
+            "UPDATE broadcasts SET status = 'finished', finished_at = ? WHERE id = ?",
+            (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), broadcast_id)
+        )
+
+
+# Содержимое, уже полученное ранее под этим file_unique_id
+def find_plan_file(file_unique_id):
+    conn = get_connection()
+    with _lock:
+        row = conn.execute(
+            'SELECT p.sha256, p.size, p.mime_type FROM plan_file_ids i '
+            'JOIN plan_files p ON p.sha256 = i.sha256 WHERE i.file_unique_id = ?',
+            (file_unique_id,)
+        ).fetchone()
+    return dict(row) if row is not None else None
+
+
+# Регистрация загруженного файла плана. Возвращает True, если такого содержимого ещё не было.
+def add_plan_file(sha256, size, mime_type, file_unique_id=None):
+    conn = get_connection()
+    with _lock, conn:
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO plan_files (sha256, size, mime_type, created_at) VALUES (?, ?, ?, ?)',
+            (sha256, size, mime_type, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        )
+        if file_unique_id:
+            conn.execute(
+                'INSERT OR REPLACE INTO plan_file_ids (file_unique_id, sha256) VALUES (?, ?)',
+                (file_unique_id, sha256)
+            )
+        return cursor.rowcount == 1
+
+
+# Очередь фоновых задач
+
+JOB_PENDING = 'pending'
+JOB_FAILED = 'failed'
+
+
+def _insert_job(conn, kind, payload, run_at=None):
+    cursor = conn.execute(
+        'INSERT INTO jobs (kind, payload, status, run_at, created_at) VALUES (?, ?, ?, ?, ?)',
+        (
+            kind,
+            json.dumps(payload, ensure_ascii=False) if payload is not None else None,
+            JOB_PENDING,
+            run_at if run_at is not None else time.time(),
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        )
+    )
+    return cursor.lastrowid
+
+
+def enqueue_job(kind, payload=None, run_at=None):
+    conn = get_connection()
+    with _lock, conn:
+        return _insert_job(conn, kind, payload, run_at)
+
+
+# Задачи, время которых наступило: список (id, kind, payload, attempts)
+def get_due_jobs(now, limit):
+    conn = get_connection()
+    with _lock:
+        rows = conn.execute(
+            'SELECT id, kind, payload, attempts FROM jobs WHERE status = ? AND run_at <= ? ORDER BY run_at, id LIMIT ?',
+            (JOB_PENDING, now, limit)
+        ).fetchall()
+    return [
+        (row['id'], row['kind'], json.loads(row['payload']) if row['payload'] is not None else None, row['attempts'])
+        for row in rows
+    ]
+
+
+# Время ближайшей задачи в очереди или None
+def next_job_time():
+    conn = get_connection()
+    with _lock:
+        return conn.execute('SELECT MIN(run_at) FROM jobs WHERE status = ?', (JOB_PENDING,)).fetchone()[0]
+
+
+def complete_job(job_id):
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+
+def retry_job(job_id, run_at, error):
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute(
+            'UPDATE jobs SET attempts = attempts + 1, run_at = ?, last_error = ? WHERE id = ?',
+            (run_at, error, job_id)
+        )
+
+
+def fail_job(job_id, error):
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute(
+            'UPDATE jobs SET status = ?, attempts = attempts + 1, last_error = ? WHERE id = ?',
+            (JOB_FAILED, error, job_id)
+        )
+
+
+# Строка журнала в формате Excel-выгрузки
+def order_to_excel_row(row):
+    return {
+        'ID заказа': row['order_id'],
+        'Дата': row['created_at'],
+        'Пользователь': f"{row['first_name']} (@{row['username']})",
+        'ID': row['user_id'],
+        'Тип работы': row['order_type'],
+        'Тема': row['topic'],
+        'Сроки': row['deadline'],
+        'Стоимость': row['price'],
+        'Статус': row['status'],
+    }
+
+
+# Заказы, перенесённые из orders.xlsx до появления legacy_order_id, сохранили номера, которые
+# совпадали с номерами заказов других пользователей. Номер заказа становится равен id строки, как
+# у новых заказов, а прежний сохраняется в legacy_order_id. Сначала номера делаются отрицательными,
+# чтобы промежуточное состояние не нарушало уникальность (user_id, order_id).
+def _renumber_legacy_orders(conn):
+    conn.execute('UPDATE orders SET legacy_order_id = order_id, order_id = -id WHERE order_id != id')
+    conn.execute('UPDATE orders SET order_id = id WHERE order_id < 0')
+
+
+# Однократный перенос заказов из старого orders.xlsx, если журнал ещё пуст.
+# Заказ получает номер, равный id строки, как и новые заказы: в orders.xlsx номера шли
+# отдельно у каждого пользователя и не были уникальными. Прежний номер сохраняется в legacy_order_id.
+def import_legacy_excel(excel_path):
+    if not os.path.exists(excel_path) or count_orders() > 0:
+        return 0
+    import pandas as pd
+
+    df = pd.read_excel(excel_path)
+    per_user = {}
+    user_pattern = re.compile(r'^(.*) \(@(.*)\)$')
+    conn = get_connection()
+    with _lock, conn:
+        for record in df.fillna('').to_dict('records'):
+            user_id = int(record.get('ID') or 0)
+            per_user[user_id] = per_user.get(user_id, 0) + 1
+            match = user_pattern.match(str(record.get('Пользователь', '')))
+            first_name, username = match.groups() if match else (str(record.get('Пользователь', '')), None)
+            cursor = conn.execute(
+                """
+                INSERT INTO orders (
+                    order_id, legacy_order_id, user_id, first_name, username, order_type, topic, deadline, price,
+                    status, created_at
+                ) VALUES (0, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    per_user[user_id],
+                    user_id,
+                    first_name,
+                    username,
+                    str(record.get('Тип работы', '')),
+                    str(record.get('Тема', '')),
+                    str(record.get('Сроки', '')),
+                    int(record['Стоимость']) if record.get('Стоимость') != '' else None,
+                    str(record.get('Статус') or 'Новый заказ'),
+                    str(record.get('Дата', '')),
+                )
+            )
+            conn.execute('UPDATE orders SET order_id = id WHERE id = ?', (cursor.lastrowid,))
+    return len(df)
+
+
+def _format_date(value):
+    if isinstance(value, datetime):
+        return value.strftime('%d.%m.%Y')
+    return value
@@ -0,0 +1,73 @@
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from fake_telegram import prepare_environment
+
+prepare_environment()
+
+import bot
+import pricing
+from render_cache import RenderCache
+
+TABLES = {mode: pricing.PriceTable({'vkr': {'base': 1000}}, mode) for mode in pricing.MODES}
+# Ступень, в которую должен попасть каждый быстрый выбор срока: (режим, цена)
+EXPECTED = {
+    3: ('light', 1300),
+    7: ('hard', 1300),
+    14: ('hard', 1150),
+    30: ('hard', 1000),
+}
+
+
+def test_expected_covers_quick_picks():
+    assert set(EXPECTED) == set(bot.QUICK_DEADLINE_DAYS)
+
+
+# Дедлайн сохраняется так же, как в handle_calendar: полночь выбранного дня
+@pytest.mark.parametrize('days', bot.QUICK_DEADLINE_DAYS)
+def test_quick_pick_priced_in_its_tier(days):
+    mode, price = EXPECTED[days]
+    deadline = datetime.combine(datetime.now().date() + timedelta(days=days), datetime.min.time())
+    assert pricing.days_until(deadline) == days
+    assert pricing.quote('vkr', deadline, TABLES[mode]) == price
+
+
+class FakeQuery:
+    def __init__(self, data):
+        self.data = data
+
+    async def answer(self):
+        pass
+
+
+class FakeUpdate:
+    def __init__(self, data):
+        self.callback_query = FakeQuery(data)
+
+
+class FakeContext:
+    def __init__(self):
+        self.user_data = {}
+
+
+# Данные кнопки приходят от клиента: срок вне быстрого выбора не принимается
+@pytest.mark.parametrize('data', ['deadline_in_5', 'deadline_in_-3', 'deadline_in_', 'deadline_in_10000000000'])
+def test_unknown_quick_pick_ignored(data):
+    context = FakeContext()
+    assert asyncio.run(bot.handle_calendar(FakeUpdate(data), context)) == bot.SELECT_DEADLINE_DATE
+    assert 'deadline' not in context.user_data
+
+
+def test_calendar_cache_is_bounded():
+    cache = RenderCache('календарей', max_size=2)
+    for year in (2030, 2031, 2030, 2032):
+        cache.get(year, lambda: str(year))
+    assert cache.stats() == {'hits': 1, 'misses': 3, 'screens': 2}
+    assert cache.get(2030, lambda: 'rendered again') == '2030'
+    assert bot.calendars.max_size == bot.CALENDAR_CACHE_SIZE
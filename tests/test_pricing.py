@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pricing
+
+
+def prices_with_tier(days):
+    return {'vkr': {'base': 1000, 'tiers': {'hard': [{'days': days, 'multiplier': 1.3}]}}}
+
+
+def test_tier_prices_by_days_left():
+    table = pricing.PriceTable(prices_with_tier(7), 'hard')
+    assert table.quote('vkr', 0) == 1300
+    assert table.quote('vkr', 7) == 1300
+    assert table.quote('vkr', 8) == 1000
+
+
+def test_tier_days_at_limit_is_accepted():
+    table = pricing.PriceTable(prices_with_tier(pricing.MAX_TIER_DAYS), 'hard')
+    assert table.quote('vkr', pricing.MAX_TIER_DAYS) == 1300
+
+
+# Огромное значение days не должно приводить к построению таблицы такого размера
+@pytest.mark.parametrize('days', [pricing.MAX_TIER_DAYS + 1, 10 ** 9, -1, True])
+def test_out_of_range_tier_days_rejected(days):
+    with pytest.raises(ValueError):
+        pricing.PriceTable(prices_with_tier(days), 'hard')
+
+
+# Любая ошибка в прайс-листе администратора или в prices.json — ValueError, а не падение при компиляции
+@pytest.mark.parametrize('prices', [
+    {'vkr': {'base': 1000, 'tiers': {'hard': 7}}},
+    {'vkr': {'base': 1000, 'tiers': {'hard': [7]}}},
+    {'vkr': {'base': 1000, 'tiers': {'hard': [[7, 1.3, 1]]}}},
+    {'vkr': {'base': 1000, 'tiers': {'hard': [['7', 1.3]]}}},
+    {'vkr': {'base': 1000, 'tiers': {'hard': [{'days': 7, 'multiplier': float('nan')}]}}},
+    {'vkr': {'base': float('inf')}},
+    {'vkr': 1000},
+])
+def test_malformed_prices_rejected(prices):
+    with pytest.raises(ValueError):
+        pricing.validate_prices(prices)
+
+
+# Другой процесс уже записал версию 5: смена режима применяется к его прайс-листу, а не к устаревшему
+def test_update_config_builds_on_newer_file(tmp_path):
+    path = str(tmp_path / 'prices.json')
+    pricing.configure(prices_with_tier(7), 'light', 1)
+    pricing.save_config(path, pricing.PriceTable(prices_with_tier(14), 'light', 5))
+    table = pricing.update_config(path, mode='hard')
+    assert (table.version, table.mode, table.prices) == (6, 'hard', prices_with_tier(14))
+    assert pricing.load_config(path, 'light') == (prices_with_tier(14), 'hard', 6)
+    assert pricing.current_table() is table
+
+
+def test_update_config_rejects_bad_prices(tmp_path):
+    path = str(tmp_path / 'prices.json')
+    table = pricing.update_config(path, prices_with_tier(7), 'light')
+    with pytest.raises(ValueError):
+        pricing.update_config(path, prices={'vkr': {}})
+    assert pricing.current_table() is table
+    assert pricing.load_config(path, 'light')[2] == table.version
@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+# Параллельная обработка обновлений с сохранением порядка для каждого пользователя.
+# Обновления разных пользователей обрабатываются одновременно (не более max_concurrent_updates),
+# а обновления одного пользователя — строго по очереди, в порядке поступления.
+# Благодаря этому состояние ConversationHandler пользователя никогда не видит переставленных
+# обновлений, а медленный обработчик одного пользователя не задерживает остальных.
+#
+# Семафор BaseUpdateProcessor занимается ещё до do_process_update, то есть и обновлениями,
+# которые ждут своей очереди у пользователя: пачка обновлений одного пользователя заняла бы
+# все места и задержала остальных. Поэтому базовому классу передаётся только верхняя граница
+# числа ожидающих обновлений, а число обрабатываемых одновременно ограничивает собственный
+# семафор, который занимается уже после очереди пользователя.
+
+# Сколько обновлений может одновременно находиться в обработке и в очередях пользователей
+MAX_PENDING_UPDATES = 100000
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates должен быть положительным числом")
+        super().__init__(max(MAX_PENDING_UPDATES, max_concurrent_updates))
+        # Число обновлений, которые обрабатываются одновременно
+        self.concurrency = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # user_id -> [asyncio.Lock, количество обновлений пользователя в обработке или в ожидании]
+        self._user_locks = {}
+        self._active_updates = 0
+
+    # Количество обновлений, которые сейчас обрабатываются или ждут своей очереди
+    @property
+    def active_updates(self):
+        return self._active_updates
+
+    @staticmethod
+    def _user_key(update):
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            return user.id
+        chat = getattr(update, 'effective_chat', None)
+        return chat.id if chat is not None else None
+
+    async def do_process_update(self, update, coroutine):
+        self._active_updates += 1
+        try:
+            await self._process_in_user_order(update, coroutine)
+        finally:
+            self._active_updates -= 1
+
+    async def _process_in_user_order(self, update, coroutine):
+        key = self._user_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock пропускает ожидающих в порядке очереди (FIFO)
+            async with entry[0]:
+                await self._run(coroutine)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[key]
+
+    # Обработка обновления, когда подошла его очередь: занимает одно из concurrency мест
+    async def _run(self, coroutine):
+        async with self._slots:
+            started = time.perf_counter()
+            try:
+                await coroutine
+            finally:
+                metrics.observe_update(time.perf_counter() - started)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
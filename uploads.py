@@ -0,0 +1,241 @@
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+
+import httpx
+from telegram.error import TelegramError
+
+import fileio
+import storage
+
+# Приём файлов планов.
+# Файл скачивается потоком, частями по CHUNK_SIZE, во временный файл; SHA-256 считается
+# по ходу записи, поэтому файл целиком никогда не лежит в памяти.
+# Содержимое хранится один раз: PLANS_DIR/<первые 2 символа хэша>/<хэш>. В папку клиента
+# кладётся копия этого файла, а в заказе сохраняется хэш. Копия, а не жёсткая ссылка: у ссылки
+# тот же inode, и правка файла в папке клиента испортила бы содержимое для всех заказов с ним.
+# Повторно присланный файл с тем же file_unique_id не скачивается вовсе.
+# Размер проверяется до скачивания (по file_size) и во время скачивания, тип — по белому списку MIME.
+
+logger = logging.getLogger(__name__)
+
+# Максимальный размер файла плана (Bot API отдаёт ботам файлы до 20 МБ)
+MAX_PLAN_SIZE = 20 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = 60
+
+ALLOWED_MIME_TYPES = {
+    'application/pdf': '.pdf',
+    'application/msword': '.doc',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': '.docx',
+    'application/vnd.oasis.opendocument.text': '.odt',
+    'application/rtf': '.rtf',
+    'text/rtf': '.rtf',
+    'text/plain': '.txt',
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+}
+# Для файлов без MIME-типа или с application/octet-stream тип определяется по расширению
+ALLOWED_EXTENSIONS = {'.pdf', '.doc', '.docx', '.odt', '.rtf', '.txt', '.jpg', '.jpeg', '.png'}
+
+_plans_dir = None
+_client = None
+
+
+class UploadRejected(Exception):
+    pass
+
+
+# Файл не удалось скачать или сохранить (сеть, Telegram, диск); его можно прислать ещё раз
+class UploadFailed(Exception):
+    pass
+
+
+def init(plans_dir):
+    global _plans_dir
+    os.makedirs(plans_dir, exist_ok=True)
+    _plans_dir = plans_dir
+
+
+def _blob_path(sha256):
+    return os.path.join(_plans_dir, sha256[:2], sha256)
+
+
+def _safe_file_name(file_name, sha256, mime_type):
+    # Имя от пользователя не должно выводить за пределы папки клиента
+    name = os.path.basename((file_name or '').replace('\\', '/')).strip()
+    if not name or name in ('.', '..'):
+        name = f"plan_{sha256[:12]}{ALLOWED_MIME_TYPES.get(mime_type, '')}"
+    return name
+
+
+def check_document(document):
+    if document.file_size and document.file_size > MAX_PLAN_SIZE:
+        raise UploadRejected(f"Файл слишком большой: максимум {MAX_PLAN_SIZE // (1024 * 1024)} МБ.")
+    mime_type = document.mime_type
+    if mime_type in ALLOWED_MIME_TYPES:
+        return
+    extension = os.path.splitext(document.file_name or '')[1].lower()
+    if mime_type in (None, 'application/octet-stream') and extension in ALLOWED_EXTENSIONS:
+        return
+    raise UploadRejected("Этот тип файла не поддерживается. Загрузите PDF, DOC/DOCX, ODT, RTF, TXT или изображение.")
+
+
+# Удаление недокачанных файлов, оставшихся после аварийной остановки (вызывается при запуске)
+def remove_partial_downloads():
+    return fileio.remove_temp_files(os.path.join(_plans_dir, 'tmp'), suffix='.part')
+
+
+def _open_temp():
+    os.makedirs(os.path.join(_plans_dir, 'tmp'), exist_ok=True)
+    path = os.path.join(_plans_dir, 'tmp', f"{uuid.uuid4().hex}.part")
+    return path, open(path, 'wb')
+
+
+def _close_synced(f):
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+
+def _write_chunk(f, digest, chunk):
+    f.write(chunk)
+    digest.update(chunk)
+
+
+def _copy_local(source_path, f, digest):
+    size = 0
+    with open(source_path, 'rb') as source:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            size += len(chunk)
+            if size > MAX_PLAN_SIZE:
+                break
+            _write_chunk(f, digest, chunk)
+    return size
+
+
+# Временный файл переносится в хранилище; если такое содержимое уже есть, он просто удаляется
+def _commit_blob(temp_path, sha256):
+    blob_path = _blob_path(sha256)
+    if os.path.exists(blob_path):
+        os.remove(temp_path)
+        return blob_path, True
+    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+    os.replace(temp_path, blob_path)
+    fileio.fsync_dir(os.path.dirname(blob_path))
+    return blob_path, False
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Копия содержимого в папке клиента. Файл с тем же именем, но другим содержимым
+# не перезаписывается: новому файлу добавляется номер.
+def _copy_into(blob_path, target_dir, file_name, sha256):
+    os.makedirs(target_dir, exist_ok=True)
+    stem, extension = os.path.splitext(file_name)
+    candidate = file_name
+    number = 1
+    while True:
+        target_path = os.path.join(target_dir, candidate)
+        if not os.path.exists(target_path):
+            break
+        if os.path.getsize(target_path) == os.path.getsize(blob_path) and _file_sha256(target_path) == sha256:
+            return target_path
+        number += 1
+        candidate = f"{stem} ({number}){extension}"
+    shutil.copyfile(blob_path, target_path)
+    return target_path
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=DOWNLOAD_TIMEOUT)
+    return _client
+
+
+async def _download(file, f, digest):
+    size = 0
+    if os.path.isabs(file.file_path):
+        # Локальный Bot API сервер отдаёт путь к файлу на диске
+        size = await fileio.run_blocking(_copy_local, file.file_path, f, digest)
+    else:
+        async with _get_client().stream('GET', file.file_path) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_PLAN_SIZE:
+                    break
+                await fileio.run_blocking(_write_chunk, f, digest, chunk)
+    if size > MAX_PLAN_SIZE:
+        raise UploadRejected(f"Файл слишком большой: максимум {MAX_PLAN_SIZE // (1024 * 1024)} МБ.")
+    return size
+
+
+# Сохранение документа Telegram в папку клиента.
+# Возвращает (путь к файлу в папке клиента, SHA-256 содержимого, был ли файл уже в хранилище).
+# UploadRejected — файл не подходит, UploadFailed — не удалось скачать или сохранить.
+async def store_plan(document, target_dir):
+    try:
+        return await _store_plan(document, target_dir)
+    except (TelegramError, httpx.HTTPError, OSError) as e:
+        logger.warning(f"Не удалось сохранить файл плана {document.file_unique_id}: {e}")
+        raise UploadFailed("Не удалось загрузить файл. Попробуйте отправить его ещё раз.") from e
+
+
+async def _store_plan(document, target_dir):
+    if _plans_dir is None:
+        raise RuntimeError("Хранилище файлов не инициализировано: вызовите uploads.init()")
+    check_document(document)
+
+    known = await fileio.run_blocking(storage.find_plan_file, document.file_unique_id)
+    if known is not None and await fileio.run_blocking(os.path.exists, _blob_path(known['sha256'])):
+        sha256 = known['sha256']
+        file_name = _safe_file_name(document.file_name, sha256, document.mime_type)
+        path = await fileio.run_blocking(_copy_into, _blob_path(sha256), target_dir, file_name, sha256)
+        logger.info(f"Файл плана {sha256[:12]} уже загружен ранее, скачивание пропущено")
+        return path, sha256, True
+
+    file = await document.get_file()
+    digest = hashlib.sha256()
+    temp_path, f = await fileio.run_blocking(_open_temp)
+    try:
+        try:
+            size = await _download(file, f, digest)
+        finally:
+            # Содержимое синхронизируется на диск до переноса в хранилище
+            await fileio.run_blocking(_close_synced, f)
+        sha256 = digest.hexdigest()
+        blob_path, deduplicated = await fileio.run_blocking(_commit_blob, temp_path, sha256)
+    except BaseException:
+        await fileio.run_blocking(_remove, temp_path)
+        raise
+
+    await fileio.run_blocking(storage.add_plan_file, sha256, size, document.mime_type, document.file_unique_id)
+    file_name = _safe_file_name(document.file_name, sha256, document.mime_type)
+    path = await fileio.run_blocking(_copy_into, blob_path, target_dir, file_name, sha256)
+    if deduplicated:
+        logger.info(f"Файл плана {sha256[:12]} совпал с уже сохранённым, копия не создана")
+    return path, sha256, deduplicated
+
+
+async def shutdown():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None